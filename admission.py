@@ -0,0 +1,211 @@
+"""
+Admission control for the agent endpoints of the RAG API server.
+
+Every model gets a limit of concurrent runs and a bounded wait queue. A request that
+finds its model saturated waits in the queue; when the queue is full (or the wait
+exceeds the queue timeout) it is rejected with Overloaded, which the server turns
+into 429 with a Retry-After estimated from the recent run times.
+
+The queue has two priority lanes: "interactive" requests are always admitted before
+"batch" ones (benchmark harnesses), and an interactive request arriving at a full
+queue sheds the newest batch request instead of being rejected. Within a lane,
+clients are served round-robin, so one client submitting many requests does not
+starve the others.
+
+All methods run on the event loop; no locking is needed.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Tuple
+
+PRIORITIES = ("interactive", "batch")
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("RAG_ADMISSION_MAX_IN_FLIGHT", "2"))
+ADMISSION_MAX_QUEUE = int(os.getenv("RAG_ADMISSION_MAX_QUEUE", "16"))
+ADMISSION_QUEUE_TIMEOUT_S = float(os.getenv("RAG_ADMISSION_QUEUE_TIMEOUT_S", "120"))
+
+
+def parse_model_limits(value: Optional[str]) -> Dict[str, Tuple[int, int]]:
+    """'llama3.1:70b=1/4,gpt-4o=8/64' -> {model: (max in flight, max queue)}"""
+    limits = {}
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        model, separator, limit = item.rpartition("=")
+        in_flight, slash, queue = limit.partition("/")
+        if not separator or not model or not slash or not in_flight.isdigit() or not queue.isdigit():
+            raise ValueError(f"Invalid model limit '{item}': use <model>=<max in flight>/<max queue>")
+        limits[model.strip()] = (int(in_flight), int(queue))
+    return limits
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Server overloaded ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Waiter:
+    def __init__(self, client: str, priority: str):
+        self.client = client
+        self.priority = priority
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.perf_counter()
+
+
+class ModelLane:
+    """Runs and wait queues of one model."""
+
+    def __init__(self, max_in_flight: int, max_queue: int):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.running = 0
+        # priority -> client -> waiters; clients are served in the order of the OrderedDict
+        self.queues: Dict[str, "OrderedDict[str, Deque[Waiter]]"] = {priority: OrderedDict() for priority in PRIORITIES}
+        self.queued = 0
+        # Exponentially weighted average run time, for Retry-After
+        self.avg_run_s = 0.0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {}
+        self.total_wait_s = 0.0
+
+    def queued_by_priority(self) -> Dict[str, int]:
+        return {priority: sum(len(waiters) for waiters in queue.values()) for priority, queue in self.queues.items()}
+
+    def retry_after(self) -> int:
+        # Time for the queue ahead to drain, at least one second
+        return max(1, math.ceil((self.queued + 1) * (self.avg_run_s or 1.0) / max(self.max_in_flight, 1)))
+
+    def push(self, waiter: Waiter):
+        self.queues[waiter.priority].setdefault(waiter.client, deque()).append(waiter)
+        self.queued += 1
+
+    def remove(self, waiter: Waiter) -> bool:
+        queue = self.queues[waiter.priority]
+        waiters = queue.get(waiter.client)
+        if not waiters or waiter not in waiters:
+            return False
+        waiters.remove(waiter)
+        if not waiters:
+            del queue[waiter.client]
+        self.queued -= 1
+        return True
+
+    def pop_next(self) -> Optional[Waiter]:
+        """Next waiter: highest priority lane first, round-robin over the clients of a lane."""
+        for priority in PRIORITIES:
+            queue = self.queues[priority]
+            if queue:
+                client, waiters = next(iter(queue.items()))
+                waiter = waiters.popleft()
+                # The client goes to the back of the lane
+                del queue[client]
+                if waiters:
+                    queue[client] = waiters
+                self.queued -= 1
+                return waiter
+        return None
+
+    def newest_batch_waiter(self) -> Optional[Waiter]:
+        waiters = [waiter for waiters in self.queues["batch"].values() for waiter in waiters]
+        return max(waiters, key=lambda waiter: waiter.queued_at) if waiters else None
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT, max_queue: int = ADMISSION_MAX_QUEUE,
+                 queue_timeout_s: float = ADMISSION_QUEUE_TIMEOUT_S,
+                 model_limits: Optional[Dict[str, Tuple[int, int]]] = None):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self.model_limits = model_limits or {}
+        self.lanes: Dict[str, ModelLane] = {}
+
+    def lane(self, model: str) -> ModelLane:
+        lane = self.lanes.get(model)
+        if lane is None:
+            max_in_flight, max_queue = self.model_limits.get(model, (self.max_in_flight, self.max_queue))
+            lane = self.lanes[model] = ModelLane(max_in_flight, max_queue)
+        return lane
+
+    def _reject(self, lane: ModelLane, reason: str) -> Overloaded:
+        lane.rejected[reason] = lane.rejected.get(reason, 0) + 1
+        return Overloaded(reason, lane.retry_after())
+
+    async def acquire(self, model: str, client: str, priority: str = "interactive") -> float:
+        """
+        Wait for a run slot of model; returns the seconds waited. Raises Overloaded when the
+        queue is full or the wait timed out. Every successful acquire must be released.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+        lane = self.lane(model)
+        if lane.running < lane.max_in_flight and lane.queued == 0:
+            lane.running += 1
+            lane.admitted += 1
+            return 0.0
+
+        if lane.queued >= lane.max_queue:
+            victim = lane.newest_batch_waiter() if priority == "interactive" else None
+            if victim is None:
+                raise self._reject(lane, "queue_full")
+            # Interactive work displaces the newest batch request
+            lane.remove(victim)
+            victim.future.set_exception(self._reject(lane, "shed"))
+
+        waiter = Waiter(client, priority)
+        lane.push(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            if lane.remove(waiter):
+                raise self._reject(lane, "queue_timeout")
+            # Admitted (or shed) just as the timeout fired
+            waiter.future.result()
+        except asyncio.CancelledError:
+            # Client went away while waiting; give the slot on if it was already handed over
+            if not lane.remove(waiter) and waiter.future.done() and not waiter.future.exception():
+                self.release(model, 0.0)
+            raise
+        waited = time.perf_counter() - waiter.queued_at
+        lane.total_wait_s += waited
+        return waited
+
+    def release(self, model: str, run_s: float):
+        """Free the slot of a finished run and hand it to the next waiter."""
+        lane = self.lane(model)
+        if run_s > 0:
+            lane.avg_run_s = run_s if lane.avg_run_s == 0 else 0.8 * lane.avg_run_s + 0.2 * run_s
+        lane.running -= 1
+        while lane.running < lane.max_in_flight:
+            waiter = lane.pop_next()
+            if waiter is None:
+                break
+            if waiter.future.done():
+                continue
+            lane.running += 1
+            lane.admitted += 1
+            waiter.future.set_result(None)
+
+    def stats(self) -> Dict:
+        return {
+            "queue_timeout_s": self.queue_timeout_s,
+            "models": {
+                model: {
+                    "max_in_flight": lane.max_in_flight,
+                    "max_queue": lane.max_queue,
+                    "running": lane.running,
+                    "queued": lane.queued_by_priority(),
+                    "admitted": lane.admitted,
+                    "rejected": dict(lane.rejected),
+                    "avg_run_s": round(lane.avg_run_s, 3),
+                    "avg_wait_s": round(lane.total_wait_s / lane.admitted, 4) if lane.admitted else 0.0,
+                    "retry_after_s": lane.retry_after(),
+                }
+                for model, lane in self.lanes.items()
+            },
+        }
@@ -0,0 +1,144 @@
+"""
+Pool of constructed agents, keyed by model pair.
+
+Building an agent (model client, vector db engine, storage, embedder) is much more
+expensive than starting a conversation on one. Sessions take an agent from the pool
+when they are initialized and give it back when they are dropped, re-initialized with
+other models or evicted; a pooled agent only gets a fresh session (cleared memory, new
+session id) before it is handed out again. Pairs listed in the prewarm config are
+constructed at server start so the first run does not pay the cold start either.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from phi.agent import Agent
+from phi.utils.log import logger
+
+
+def parse_model_pairs(value: Optional[str]) -> List[Tuple[str, str]]:
+    """'llama3.1:70b=nomic-embed-text,gpt-4o=nomic-embed-text' -> [(llm_model, embeddings_model), ...]"""
+    pairs = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        llm_model, separator, embeddings_model = item.partition("=")
+        if not separator or not llm_model.strip() or not embeddings_model.strip():
+            raise ValueError(f"Invalid model pair '{item}': use <llm_model>=<embeddings_model>")
+        pairs.append((llm_model.strip(), embeddings_model.strip()))
+    return pairs
+
+
+@dataclass
+class AgentPoolStats:
+    cold_inits: int = 0
+    warm_inits: int = 0
+    prewarmed: int = 0
+    released: int = 0
+    discarded: int = 0
+    cold_s: float = 0.0
+    warm_s: float = 0.0
+    prewarm_s: float = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "cold_inits": self.cold_inits,
+            "warm_inits": self.warm_inits,
+            "prewarmed": self.prewarmed,
+            "released": self.released,
+            "discarded": self.discarded,
+            "avg_cold_ms": round(self.cold_s / self.cold_inits * 1000, 1) if self.cold_inits else None,
+            "avg_warm_ms": round(self.warm_s / self.warm_inits * 1000, 1) if self.warm_inits else None,
+            "avg_prewarm_ms": round(self.prewarm_s / self.prewarmed * 1000, 1) if self.prewarmed else None,
+        }
+
+
+class AgentPool:
+    """Thread-safe pool of idle agents; at most max_idle agents are kept per key."""
+
+    def __init__(self, max_idle: int = 2):
+        self.max_idle = max_idle
+        self._idle: Dict[Hashable, List[Agent]] = {}
+        self._stats: Dict[Hashable, AgentPoolStats] = {}
+        self._lock = threading.Lock()
+
+    def _stats_locked(self, key: Hashable) -> AgentPoolStats:
+        return self._stats.setdefault(key, AgentPoolStats())
+
+    def acquire(self, key: Hashable, factory: Callable[[], Agent]) -> Tuple[Agent, bool, float]:
+        """
+        An agent for key with a fresh session: a pooled one if available (warm), else a
+        new one from factory (cold). Returns the agent, whether it was warm and the seconds spent.
+        """
+        started_at = time.perf_counter()
+        with self._lock:
+            idle = self._idle.get(key)
+            agent = idle.pop() if idle else None
+        warm = agent is not None
+        if warm:
+            agent.new_session()
+        else:
+            agent = factory()
+            agent.create_session()
+        elapsed = time.perf_counter() - started_at
+        with self._lock:
+            stats = self._stats_locked(key)
+            if warm:
+                stats.warm_inits += 1
+                stats.warm_s += elapsed
+            else:
+                stats.cold_inits += 1
+                stats.cold_s += elapsed
+        logger.info(f"{'Warm' if warm else 'Cold'} agent init for {key} in {elapsed * 1000:.0f}ms")
+        return agent, warm, elapsed
+
+    def release(self, key: Hashable, agent: Agent) -> bool:
+        """Give an agent that is no longer used back to the pool; returns False if it was discarded."""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            stats = self._stats_locked(key)
+            if len(idle) >= self.max_idle:
+                stats.discarded += 1
+                return False
+            idle.append(agent)
+            stats.released += 1
+            return True
+
+    def prewarm(self, key: Hashable, factory: Callable[[], Agent], count: int = 1) -> int:
+        """Construct agents until count are idle for key; returns the number constructed."""
+        built = 0
+        while True:
+            with self._lock:
+                if len(self._idle.get(key, ())) >= min(count, self.max_idle):
+                    break
+            started_at = time.perf_counter()
+            agent = factory()
+            agent.create_session()
+            elapsed = time.perf_counter() - started_at
+            with self._lock:
+                self._idle.setdefault(key, []).append(agent)
+                stats = self._stats_locked(key)
+                stats.prewarmed += 1
+                stats.prewarm_s += elapsed
+            built += 1
+            logger.info(f"Prewarmed agent for {key} in {elapsed * 1000:.0f}ms")
+        return built
+
+    def clear(self) -> int:
+        with self._lock:
+            removed = sum(len(idle) for idle in self._idle.values())
+            self._idle.clear()
+            return removed
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return {
+                "max_idle": self.max_idle,
+                "pools": [
+                    {"key": list(key) if isinstance(key, tuple) else key,
+                     "idle": len(self._idle.get(key, ())), **stats.as_dict()}
+                    for key, stats in self._stats.items()
+                ],
+            }
@@ -0,0 +1,279 @@
+"""
+Write-behind agent storage.
+
+Agents persist their session (memory, run data) with storage.upsert() after every run,
+and PgAgentStorage does that synchronously: an INSERT ... ON CONFLICT plus a read-back,
+added to every /ask/. WriteBehindStorage takes the write off the request path:
+upserts are queued per session (a newer state replaces a queued one) and a background
+worker writes them in batches, one transaction per batch. Reads are served from the
+queue first, so an agent always sees its own latest state.
+
+RAG_AGENT_STORAGE_MODE selects the durability:
+  sync    - write through to Postgres on every upsert (default)
+  async   - write-behind, flushed every RAG_AGENT_STORAGE_FLUSH_S seconds and on server
+            shutdown; a crash loses the writes of the last flush interval (opt-in)
+  memory  - keep sessions in process memory only, never touch Postgres (benchmarks)
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from phi.agent.session import AgentSession
+from phi.storage.agent.base import AgentStorage
+from phi.storage.agent.postgres import PgAgentStorage
+from phi.utils.log import logger
+from sqlalchemy.dialects import postgresql
+
+from db import get_engine
+
+AGENT_STORAGE_MODES = ("sync", "async", "memory")
+AGENT_STORAGE_MODE = os.getenv("RAG_AGENT_STORAGE_MODE", "sync")
+AGENT_STORAGE_FLUSH_S = float(os.getenv("RAG_AGENT_STORAGE_FLUSH_S", "0.5"))
+AGENT_STORAGE_BATCH_SIZE = int(os.getenv("RAG_AGENT_STORAGE_BATCH_SIZE", "64"))
+# Sessions kept by the in-memory mode (least recently written ones are dropped)
+AGENT_STORAGE_MEMORY_SESSIONS = int(os.getenv("RAG_AGENT_STORAGE_MEMORY_SESSIONS", "1000"))
+
+
+class WriteBehindStorage(AgentStorage):
+    def __init__(self, table_name: str, db_url: str, mode: str = AGENT_STORAGE_MODE,
+                 flush_interval_s: float = AGENT_STORAGE_FLUSH_S, batch_size: int = AGENT_STORAGE_BATCH_SIZE):
+        if mode not in AGENT_STORAGE_MODES:
+            raise ValueError(f"Unknown agent storage mode '{mode}': use {', '.join(AGENT_STORAGE_MODES)}")
+        self.table_name = table_name
+        # The in-memory mode never connects to Postgres
+        self.storage: Optional[PgAgentStorage] = (
+            PgAgentStorage(table_name=table_name, db_engine=get_engine(db_url)) if mode != "memory" else None
+        )
+        self.mode = mode
+        self.flush_interval_s = flush_interval_s
+        self.batch_size = batch_size
+        # session_id -> (latest state, time its oldest unwritten change was queued)
+        self._pending: "OrderedDict[str, Tuple[AgentSession, float]]" = OrderedDict()
+        self._sessions: "OrderedDict[str, AgentSession]" = OrderedDict()
+        self._condition = threading.Condition()
+        self._writing: Dict[str, AgentSession] = {}
+        self._closed = False
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_batch_ms = 0.0
+        self.max_lag_s = 0.0
+        self._worker: Optional[threading.Thread] = None
+        if mode == "async":
+            self._worker = threading.Thread(target=self._run, name=f"agent-storage-{table_name}", daemon=True)
+            self._worker.start()
+
+    # AgentStorage interface
+
+    def create(self) -> None:
+        if self.mode != "memory":
+            self.storage.create()
+
+    def read(self, session_id: str, user_id: Optional[str] = None) -> Optional[AgentSession]:
+        if self.mode == "memory":
+            with self._condition:
+                session = self._sessions.get(session_id)
+            return session if session is not None and (user_id is None or session.user_id == user_id) else None
+        if self.mode == "async":
+            with self._condition:
+                queued = self._pending.get(session_id)
+                session = queued[0] if queued is not None else self._writing.get(session_id)
+            if session is not None:
+                return session if user_id is None or session.user_id == user_id else None
+        return self.storage.read(session_id, user_id)
+
+    def get_all_session_ids(self, user_id: Optional[str] = None, agent_id: Optional[str] = None) -> List[str]:
+        return [session.session_id for session in self.get_all_sessions(user_id, agent_id)]
+
+    def get_all_sessions(self, user_id: Optional[str] = None, agent_id: Optional[str] = None) -> List[AgentSession]:
+        if self.mode == "memory":
+            with self._condition:
+                sessions = list(self._sessions.values())
+            return [
+                session for session in sessions
+                if (user_id is None or session.user_id == user_id) and (agent_id is None or session.agent_id == agent_id)
+            ]
+        self.flush()
+        return self.storage.get_all_sessions(user_id, agent_id)
+
+    def upsert(self, session: AgentSession) -> Optional[AgentSession]:
+        if self.mode == "sync":
+            return self.storage.upsert(session)
+        now = int(time.time())
+        session.created_at = session.created_at or now
+        session.updated_at = now
+        with self._condition:
+            if self.mode == "memory":
+                self._sessions[session.session_id] = session
+                self._sessions.move_to_end(session.session_id)
+                while len(self._sessions) > AGENT_STORAGE_MEMORY_SESSIONS:
+                    self._sessions.popitem(last=False)
+                return session
+            previous = self._pending.pop(session.session_id, None)
+            self._pending[session.session_id] = (session, previous[1] if previous else time.time())
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify_all()
+        return session
+
+    def delete_session(self, session_id: Optional[str] = None):
+        with self._condition:
+            self._pending.pop(session_id, None)
+            self._sessions.pop(session_id, None)
+        if self.mode != "memory":
+            self.storage.delete_session(session_id)
+
+    def drop(self) -> None:
+        with self._condition:
+            self._pending.clear()
+            self._sessions.clear()
+        if self.mode != "memory":
+            self.storage.drop()
+
+    def upgrade_schema(self) -> None:
+        if self.mode != "memory":
+            self.storage.upgrade_schema()
+
+    # Write-behind
+
+    def _take_batch(self) -> List[Tuple[AgentSession, float]]:
+        batch = []
+        while self._pending and len(batch) < self.batch_size:
+            _, item = self._pending.popitem(last=False)
+            batch.append(item)
+        self._writing = {session.session_id: session for session, _ in batch}
+        return batch
+
+    def _write(self, sessions: List[AgentSession]):
+        """Upsert a batch in one transaction (PgAgentStorage.upsert also reads every row back)."""
+        table = self.storage.table
+        with self.storage.Session() as sess, sess.begin():
+            for session in sessions:
+                values = dict(
+                    agent_id=session.agent_id,
+                    user_id=session.user_id,
+                    memory=session.memory,
+                    agent_data=session.agent_data,
+                    user_data=session.user_data,
+                    session_data=session.session_data,
+                )
+                stmt = postgresql.insert(table).values(session_id=session.session_id, **values)
+                sess.execute(stmt.on_conflict_do_update(
+                    index_elements=["session_id"], set_=dict(values, updated_at=session.updated_at)
+                ))
+
+    def _flush_batch(self, batch: List[Tuple[AgentSession, float]]):
+        started_at = time.perf_counter()
+        sessions = [session for session, _ in batch]
+        try:
+            try:
+                self._write(sessions)
+            except Exception:
+                if self.storage.table_exists():
+                    raise
+                # First write to a new table
+                self.storage.create()
+                self._write(sessions)
+        except Exception as e:
+            logger.warning(f"Could not write {len(sessions)} agent sessions to {self.table_name}: {e}")
+            with self._condition:
+                self.failures += 1
+                # Retry with the next flush unless a newer state was queued meanwhile
+                for session, queued_at in batch:
+                    if session.session_id not in self._pending:
+                        self._pending[session.session_id] = (session, queued_at)
+                        self._pending.move_to_end(session.session_id, last=False)
+                self._writing = {}
+            return False
+        now = time.time()
+        with self._condition:
+            self.written += len(sessions)
+            self.batches += 1
+            self.last_batch_ms = (time.perf_counter() - started_at) * 1000
+            self.max_lag_s = max([self.max_lag_s] + [now - queued_at for _, queued_at in batch])
+            self._writing = {}
+            self._condition.notify_all()
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._condition.wait(self.flush_interval_s)
+                if self._closed and not self._pending:
+                    return
+                batch = self._take_batch()
+            if batch and not self._flush_batch(batch):
+                # Back off after a failed write
+                time.sleep(self.flush_interval_s)
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """Wait until every queued write reached Postgres; returns False on timeout."""
+        if self.mode != "async":
+            return True
+        deadline = time.time() + timeout
+        with self._condition:
+            self._condition.notify_all()
+            while self._pending or self._writing:
+                remaining = deadline - time.time()
+                if remaining <= 0 or self._worker is None or not self._worker.is_alive():
+                    return False
+                self._condition.wait(min(remaining, 0.1))
+        return True
+
+    def close(self, timeout: float = 30.0):
+        """Flush the queue and stop the worker."""
+        flushed = self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._worker is not None:
+            self._worker.join(timeout)
+        if not flushed:
+            logger.warning(f"Agent storage {self.table_name} closed with {len(self._pending)} unwritten sessions")
+
+    def lag(self) -> Dict:
+        """Storage-lag gauge: queued sessions and the age of the oldest unwritten change."""
+        now = time.time()
+        with self._condition:
+            queued_at = [queued_at for _, queued_at in self._pending.values()]
+            return {
+                "table": self.table_name,
+                "mode": self.mode,
+                "pending": len(self._pending) + len(self._writing),
+                "lag_s": round(now - min(queued_at), 3) if queued_at else 0.0,
+                "max_lag_s": round(self.max_lag_s, 3),
+                "written": self.written,
+                "batches": self.batches,
+                "failures": self.failures,
+                "last_batch_ms": round(self.last_batch_ms, 2),
+                "memory_sessions": len(self._sessions),
+            }
+
+
+_storages: Dict[Tuple[str, str], WriteBehindStorage] = {}
+_storages_lock = threading.Lock()
+
+
+def get_agent_storage(table_name: str, db_url: str) -> WriteBehindStorage:
+    """The process-wide storage of a table; agents of the pool share it (and its connection pool)."""
+    with _storages_lock:
+        storage = _storages.get((table_name, db_url))
+        if storage is None:
+            storage = _storages[(table_name, db_url)] = WriteBehindStorage(table_name, db_url)
+        return storage
+
+
+def agent_storage_lag() -> List[Dict]:
+    with _storages_lock:
+        storages = list(_storages.values())
+    return [storage.lag() for storage in storages]
+
+
+def close_agent_storages(timeout: float = 30.0):
+    """Flush every storage; called on server shutdown."""
+    with _storages_lock:
+        storages = list(_storages.values())
+    for storage in storages:
+        storage.close(timeout)
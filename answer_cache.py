@@ -0,0 +1,224 @@
+"""
+Response cache for the knowledge agent.
+
+Benchmark campaigns send the same prompt (problem description + system prompt +
+file contents) many times. Answers are cached under the prompt hash, the LLM,
+the embedder and the knowledge-base version; a semantic lookup can optionally
+reuse the answer of a near-identical prompt by comparing prompt embeddings.
+The cache is opt-in per request so stochasticity studies are unaffected.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+KB_VERSIONS_PATH = Path(__file__).parent / "kb_cache" / "kb_versions.db"
+
+# off: no lookup, no store | exact / semantic: lookup then store | refresh: bypass the lookup but store
+ANSWER_CACHE_MODES = ("off", "exact", "semantic", "refresh")
+
+
+class KnowledgeBaseVersions:
+    """
+    Content fingerprint of every knowledge-base table.
+
+    The version is derived from the set of sources loaded since the last clear,
+    so clearing and re-adding the same sources gives back the same version. The
+    sources are persisted in SQLite (kb_cache/kb_versions.db), so a restarted server
+    does not reset the versions of tables that changed before the restart.
+    """
+
+    def __init__(self, db_path: Optional[Path] = KB_VERSIONS_PATH):
+        self.db_path = Path(db_path) if db_path is not None else None
+        self._sources: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        if self.db_path is not None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS kb_sources (
+                        table_name TEXT NOT NULL,
+                        content_id TEXT NOT NULL,
+                        PRIMARY KEY (table_name, content_id)
+                    )
+                ''')
+                for table_name, content_id in conn.execute('SELECT table_name, content_id FROM kb_sources'):
+                    self._sources.setdefault(table_name, set()).add(content_id)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def add(self, table_name: str, content_id: str):
+        with self._lock:
+            self._sources.setdefault(table_name, set()).add(content_id)
+            if self.db_path is not None:
+                with self._connect() as conn:
+                    conn.execute('INSERT OR IGNORE INTO kb_sources (table_name, content_id) VALUES (?, ?)',
+                                 (table_name, content_id))
+
+    def clear(self, table_name: str):
+        with self._lock:
+            self._sources.pop(table_name, None)
+            if self.db_path is not None:
+                with self._connect() as conn:
+                    conn.execute('DELETE FROM kb_sources WHERE table_name = ?', (table_name,))
+
+    def copy(self, source_table: str, table_name: str):
+        """A table created as a copy of another holds the same sources."""
+        with self._lock:
+            self._sources[table_name] = set(self._sources.get(source_table, ()))
+            if self.db_path is not None:
+                with self._connect() as conn:
+                    conn.execute('DELETE FROM kb_sources WHERE table_name = ?', (table_name,))
+                    conn.execute('INSERT INTO kb_sources (table_name, content_id) '
+                                 'SELECT ?, content_id FROM kb_sources WHERE table_name = ?', (table_name, source_table))
+
+    def version(self, table_name: str) -> str:
+        with self._lock:
+            sources = sorted(self._sources.get(table_name, ()))
+        # Different tables (e.g. knowledge-base snapshots) never share a version
+        return hashlib.sha256("\n".join([table_name, *sources]).encode()).hexdigest()[:16]
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    scope: tuple
+    created_at: float
+    embedding: Optional[np.ndarray] = None
+    hits: int = 0
+
+
+@dataclass
+class CacheHit:
+    answer: str
+    kind: str  # "exact" or "semantic"
+    similarity: float = 1.0
+
+
+@dataclass
+class AnswerCacheStats:
+    exact_hits: int = 0
+    semantic_hits: int = 0
+    misses: int = 0
+    bypassed: int = 0
+    stores: int = 0
+    evictions: int = 0
+
+    def as_dict(self) -> Dict[str, float]:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        stats = dict(self.__dict__)
+        stats["hit_rate"] = round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+class AnswerCache:
+    """Thread-safe LRU/TTL cache of knowledge-agent answers."""
+
+    def __init__(self, max_entries: int = 256, ttl_s: float = 24 * 3600, similarity_threshold: float = 0.97):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.similarity_threshold = similarity_threshold
+        self.stats = AnswerCacheStats()
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _scope(llm_model: str, embeddings_model: str, kb_version: str) -> tuple:
+        return (llm_model, embeddings_model, kb_version)
+
+    @staticmethod
+    def _key(prompt: str, scope: tuple) -> str:
+        digest = hashlib.sha256(prompt.encode("utf-8", errors="replace")).hexdigest()
+        return "|".join([digest, *map(str, scope)])
+
+    @staticmethod
+    def _normalize(embedding: Optional[List[float]]) -> Optional[np.ndarray]:
+        if not embedding:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def get(self, prompt: str, llm_model: str, embeddings_model: str, kb_version: str,
+            prompt_embedding: Optional[List[float]] = None) -> Optional[CacheHit]:
+        """Exact lookup, then (if an embedding is given) the most similar prompt in the same scope."""
+        scope = self._scope(llm_model, embeddings_model, kb_version)
+        key = self._key(prompt, scope)
+        with self._lock:
+            self._expire_locked()
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.hits += 1
+                self._entries.move_to_end(key)
+                self.stats.exact_hits += 1
+                return CacheHit(entry.answer, "exact")
+
+            query = self._normalize(prompt_embedding)
+            if query is not None:
+                best_key, best_similarity = None, -1.0
+                for candidate_key, candidate in self._entries.items():
+                    if candidate.scope != scope or candidate.embedding is None:
+                        continue
+                    if candidate.embedding.shape != query.shape:
+                        continue
+                    similarity = float(candidate.embedding @ query)
+                    if similarity > best_similarity:
+                        best_key, best_similarity = candidate_key, similarity
+                if best_key is not None and best_similarity >= self.similarity_threshold:
+                    entry = self._entries[best_key]
+                    entry.hits += 1
+                    self._entries.move_to_end(best_key)
+                    self.stats.semantic_hits += 1
+                    return CacheHit(entry.answer, "semantic", round(best_similarity, 4))
+
+            self.stats.misses += 1
+            return None
+
+    def put(self, prompt: str, answer: str, llm_model: str, embeddings_model: str, kb_version: str,
+            prompt_embedding: Optional[List[float]] = None):
+        scope = self._scope(llm_model, embeddings_model, kb_version)
+        entry = CachedAnswer(answer=answer, scope=scope, created_at=time.time(),
+                             embedding=self._normalize(prompt_embedding))
+        key = self._key(prompt, scope)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self.stats.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def record_bypass(self):
+        with self._lock:
+            self.stats.bypassed += 1
+
+    def clear(self) -> int:
+        with self._lock:
+            removed = len(self._entries)
+            self._entries.clear()
+            return removed
+
+    def summary(self) -> Dict:
+        with self._lock:
+            self._expire_locked()
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "similarity_threshold": self.similarity_threshold,
+                **self.stats.as_dict(),
+            }
+
+    def _expire_locked(self):
+        deadline = time.time() - self.ttl_s
+        expired = [key for key, entry in self._entries.items() if entry.created_at < deadline]
+        for key in expired:
+            del self._entries[key]
+            self.stats.evictions += 1
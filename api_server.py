@@ -1,6 +1,8 @@
-from typing import List, Optional, IO, Annotated
-from fastapi import FastAPI, HTTPException, UploadFile, Form, File, Body
-from fastapi.responses import HTMLResponse
+from typing import Dict, List, Optional, IO, Annotated
+from fastapi import FastAPI, HTTPException, UploadFile, Form, File, Body, Request
+from fastapi.responses import HTMLResponse, StreamingResponse, PlainTextResponse
+from starlette.routing import Match
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from phi.agent import Agent
 from phi.document import Document
@@ -8,11 +10,11 @@ from phi.document.reader.pdf import PDFReader
 from phi.document.reader.website import WebsiteReader
 from phi.document.reader.text import TextReader
 from phi.utils.log import logger
-from assistant import get_rag_assistant, get_rag_agent  # type: ignore
+from assistant import get_rag_assistant, get_rag_agent, get_embedder, get_knowledge  # type: ignore
 import shutil
 from pathlib import Path
 from statement import Model
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from phi.vectordb.pgvector import PgVector
 from phi.knowledge.website import WebsiteKnowledgeBase
 import requests
@@ -20,10 +22,96 @@ from bs4 import BeautifulSoup
 from phi.document.base import Document
 from phi.agent import AgentKnowledge
 from phi.embedder.ollama import OllamaEmbedder
+from ingest_cache import IngestCache, content_hash, insert_embedded_documents
+from sessions import SessionRegistry, SessionState, DEFAULT_SESSION_ID
+from chat_history import ChatHistoryStore
+from worker_pool import WorkerPool
+from agent_pool import AgentPool, parse_model_pairs
+from agent_storage import agent_storage_lag, close_agent_storages
+from answer_cache import AnswerCache, KnowledgeBaseVersions, ANSWER_CACHE_MODES
+from chunking import HeadingChunking, html_to_text
+from embeddings import embed_documents
+from embedding_cache import get_embedding_cache
+from retrieval_cache import get_retrieval_cache
+from crawler import Crawler, extract_links
+from kb_snapshots import KnowledgeBaseSnapshots, Snapshot
+from kb_indexes import IndexManager, ANN_INDEX
+from vector_store import get_vector_db, VECTOR_STORE, BM25HybridDb
+from db import DB_URL, get_engine, pool_stats
+from context_assembly import context_usage
+from admission import AdmissionController, Overloaded, PRIORITIES, parse_model_limits
+from metrics import (Gauge, Counter, registry, http_request_duration, http_requests_in_flight, observe_stage,
+                     observe_stages, record_agent_run)
+from ingest_jobs import IngestJob, IngestJobQueue, read_pdf_pages, INGEST_STEP_SIZE
+from near_dups import NearDuplicateDetector
+from phi.vectordb.pgvector import SearchType
+import hashlib
+import os
+import json
+import time
+import asyncio
 
 app = FastAPI()
-DB_URL = "postgresql+psycopg2://ai:ai@localhost:5532/ai"  # adjust your DB URL
-engine = create_engine(DB_URL)
+# One shared connection pool (RAG_DB_URL, RAG_DB_POOL_SIZE, ...) for every component of the server
+engine = get_engine(DB_URL)
+ingest_cache = IngestCache()
+
+# Pages and Markdown uploads are split on headings into chunks of at most RAG_CHUNK_SIZE characters,
+# embedded RAG_EMBED_BATCH_SIZE chunks per embedder request
+chunker = HeadingChunking(
+    chunk_size=int(os.getenv("RAG_CHUNK_SIZE", "1500")),
+    overlap=int(os.getenv("RAG_CHUNK_OVERLAP", "200")),
+)
+EMBED_BATCH_SIZE = int(os.getenv("RAG_EMBED_BATCH_SIZE", "32"))
+
+# Stage names of the ingestion timings in the rag_stage_duration_seconds histogram
+INGEST_STAGES = {"fetch_s": "scrape", "parse_s": "parse", "chunk_s": "chunk", "embed_s": "embed", "insert_s": "insert"}
+
+# Uploads and /add_url/ run as background jobs on RAG_INGEST_WORKERS threads; see /jobs/{id}
+ingest_jobs = IngestJobQueue(on_finish=lambda job: observe_stages(job.timings, INGEST_STAGES))
+
+# Near-duplicate chunks (mirrors, re-uploads) are skipped before embedding; RAG_NEAR_DUP_MODE=report only counts them
+near_dups = NearDuplicateDetector()
+
+# Pooled HTTP client for knowledge sources; /add_urls/ fetches up to RAG_CRAWL_WORKERS pages at once
+crawler = Crawler(
+    max_workers=int(os.getenv("RAG_CRAWL_WORKERS", "8")),
+    timeout=float(os.getenv("RAG_CRAWL_TIMEOUT_S", "30")),
+)
+
+# Live sessions are capped; the least recently used / idle ones are evicted
+MAX_SESSIONS = int(os.getenv("RAG_MAX_SESSIONS", "8"))
+SESSION_TTL_S = float(os.getenv("RAG_SESSION_TTL_S", "3600"))
+# Number of agent runs (LLM round trips) executed concurrently; further /ask/ calls wait in the queue
+ASK_WORKERS = int(os.getenv("RAG_ASK_WORKERS", "4"))
+ask_pool = WorkerPool(max_workers=ASK_WORKERS)
+# Admission control per LLM model: RAG_ADMISSION_MAX_IN_FLIGHT runs, RAG_ADMISSION_MAX_QUEUE waiting, then 429;
+# RAG_ADMISSION_MODEL_LIMITS ("llama3.1:70b=1/4,...") overrides both for single models
+admission = AdmissionController(model_limits=parse_model_limits(os.getenv("RAG_ADMISSION_MODEL_LIMITS", "")))
+# Constructed agents are reused across sessions, up to RAG_AGENT_POOL_IDLE idle agents per model pair;
+# RAG_PREWARM_MODELS ("llm_model=embeddings_model,...") lists the pairs built at startup
+agent_pool = AgentPool(max_idle=int(os.getenv("RAG_AGENT_POOL_IDLE", "2")))
+PREWARM_MODELS = parse_model_pairs(os.getenv("RAG_PREWARM_MODELS", ""))
+
+# Opt-in answer cache, keyed by prompt, models and the content version of the knowledge base
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv("RAG_ANSWER_CACHE_SIZE", "256")),
+    ttl_s=float(os.getenv("RAG_ANSWER_CACHE_TTL_S", str(24 * 3600))),
+    similarity_threshold=float(os.getenv("RAG_ANSWER_CACHE_SIMILARITY", "0.97")),
+)
+kb_versions = KnowledgeBaseVersions()
+# Knowledge searches of the agents are cached until their table changes
+retrieval_cache = get_retrieval_cache()
+
+# Versioned knowledge-base snapshots; gc keeps the RAG_KB_KEEP_VERSIONS newest versions of every name
+kb_snapshots = KnowledgeBaseSnapshots(engine, DB_URL)
+KB_KEEP_VERSIONS = int(os.getenv("RAG_KB_KEEP_VERSIONS", "3"))
+KB_MAX_AGE_DAYS = float(os.getenv("RAG_KB_MAX_AGE_DAYS")) if os.getenv("RAG_KB_MAX_AGE_DAYS") else None
+
+# ANN (RAG_ANN_INDEX) and full-text indexes of the knowledge-base tables; RAG_BUILD_INDEXES=1 builds
+# the missing ones in the background on startup
+index_manager = IndexManager(engine)
+BUILD_INDEXES_ON_STARTUP = os.getenv("RAG_BUILD_INDEXES", "0") == "1"
 
 
 # CORS middleware to allow requests from your frontend (if applicable)
@@ -35,16 +123,101 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory state management
-class SessionState:
-    def __init__(self):
-        self.rag_assistant: Optional[Agent] = None
-        self.messages = []  # Initialize with an empty list
-        self.rag_assistant_run_id: Optional[str] = None
-        self.llm_model: Optional[str] = None
-        self.embeddings_model: Optional[str] = None
+def route_template(request: Request) -> str:
+    """Path template of the matched route (/jobs/{job_id}), so the endpoint label has a bounded set of values."""
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", request.url.path)
+    return "unmatched"
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    endpoint = route_template(request)
+    http_requests_in_flight.inc(endpoint=endpoint)
+    started_at = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        http_requests_in_flight.dec(endpoint=endpoint)
+        # Streaming responses are timed until their headers are sent
+        http_request_duration.observe(time.perf_counter() - started_at,
+                                      endpoint=endpoint, method=request.method, status=str(status))
+
+# In-memory state management, one SessionState per client session
+def release_agent(session_state: SessionState):
+    """Give the session's agent back to the pool, pointed at its base knowledge table again."""
+    agent, key = session_state.rag_assistant, session_state.agent_key
+    session_state.rag_assistant = None
+    session_state.agent_key = None
+    # An agent still running a request is not shared; it is dropped with the session
+    if agent is None or key is None or session_state.in_flight > 0:
+        return
+    if session_state.kb_snapshot is not None:
+        agent.knowledge = get_knowledge(session_state.embeddings_model)
+    agent_pool.release(key, agent)
+
+sessions = SessionRegistry(max_sessions=MAX_SESSIONS, ttl_s=SESSION_TTL_S, on_close=release_agent,
+                           history_store=ChatHistoryStore())
+
+def get_session(session_id: Optional[str]) -> SessionState:
+    """Resolve the session of a request. Clients that send no session id share the default session."""
+    if session_id is None:
+        return sessions.get_or_create(DEFAULT_SESSION_ID)
+    session_state = sessions.get(session_id)
+    if session_state is None:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found or expired")
+    return session_state
+
+def get_initialized_session(session_id: Optional[str]) -> SessionState:
+    session_state = get_session(session_id)
+    if session_state.rag_assistant is None:
+        raise HTTPException(status_code=400, detail="Agent not initialized")
+    return session_state
+
+def get_kb_session(session_id: Optional[str]) -> SessionState:
+    """Initialized session whose knowledge base the ingest, clear and snapshot endpoints change."""
+    session_state = get_initialized_session(session_id)
+    if session_state.embeddings_model is None:
+        # /initialize2/ agents choose their table from the model; there is no table to load into
+        raise HTTPException(status_code=400, detail="Session has no embeddings model: initialize it with "
+                                                    "/initialize/ to manage its knowledge base")
+    return session_state
 
-session_state = SessionState()
+def resolve_init_session(session_id: Optional[str], new_session: bool) -> SessionState:
+    """Session targeted by an initialize call: a fresh one, the given one, or the default one."""
+    if new_session:
+        return sessions.create()
+    return sessions.get_or_create(session_id or DEFAULT_SESSION_ID)
+
+def prewarm_agents():
+    for llm_model, embeddings_model in PREWARM_MODELS:
+        try:
+            agent_pool.prewarm((llm_model, embeddings_model),
+                               lambda: get_rag_assistant(llm_model=llm_model, embeddings_model=embeddings_model))
+        except Exception as e:
+            logger.warning(f"Could not prewarm an agent for {llm_model} / {embeddings_model}: {e}")
+
+@app.on_event("startup")
+async def start_prewarm():
+    if PREWARM_MODELS:
+        asyncio.get_running_loop().run_in_executor(None, prewarm_agents)
+
+@app.on_event("startup")
+async def build_indexes():
+    if BUILD_INDEXES_ON_STARTUP and VECTOR_STORE == "pgvector":
+        asyncio.get_running_loop().run_in_executor(None, index_manager.build_all)
+
+@app.on_event("shutdown")
+def shutdown_workers():
+    crawler.close()
+    ask_pool.shutdown(wait=False)
+    ingest_jobs.shutdown(wait=False)
+    # Write the queued agent sessions before exiting
+    close_agent_storages()
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
@@ -61,50 +234,384 @@ async def read_root():
     """
 
 @app.post("/initialize2/")
-async def initialize_agent(model: Model, use_rag: Annotated[bool, Body()]):
+async def initialize_agent(
+    model: Model,
+    use_rag: Annotated[bool, Body()],
+    session_id: Annotated[Optional[str], Body()] = None,
+    new_session: Annotated[bool, Body()] = False,
+):
     """Initialize the RAG agent with the selected model."""
-    if session_state.rag_assistant is None or session_state.llm_model != model.name:
+    session_state = resolve_init_session(session_id, new_session)
+    key = ("agent", model.name, str(model.host), use_rag)
+    init = {"warm": None, "init_ms": 0.0}
+    if session_state.rag_assistant is None or session_state.agent_key != key:
         logger.info(f"---*--- Creating {model.name} Agent ---*---")
-        session_state.rag_assistant = get_rag_agent(model, use_rag)
+        release_agent(session_state)
+        agent, warm, elapsed = await asyncio.to_thread(agent_pool.acquire, key, lambda: get_rag_agent(model, use_rag))
+        session_state.rag_assistant = agent
+        session_state.agent_key = key
         session_state.llm_model = model.name
-        session_state.rag_assistant_run_id = session_state.rag_assistant.create_session()
+        session_state.embeddings_model = None
+        session_state.kb_snapshot = None
+        session_state.rag_assistant_run_id = agent.session_id
+        init = {"warm": warm, "init_ms": round(elapsed * 1000, 1)}
 
-        session_state.messages = [{"role": "assistant", "content": "Upload a doc and ask me questions..."}]
+        session_state.history.reset(greeting="Upload a doc and ask me questions...")
     
-    return {"status": "Agent initialized"}
+    return {"status": "Agent initialized", "session_id": session_state.session_id, **init}
 
 @app.post("/initialize/")
-async def initialize_assistant(llm_model: str = Form(...), embeddings_model: str = Form(...)):
-    """Initialize the RAG assistant with selected models."""
-    if session_state.rag_assistant is None or session_state.llm_model != llm_model or session_state.embeddings_model != embeddings_model:
+async def initialize_assistant(
+    llm_model: str = Form(...),
+    embeddings_model: str = Form(...),
+    session_id: Optional[str] = Form(None),
+    new_session: bool = Form(False),
+):
+    """
+    Initialize the RAG assistant with selected models.
+
+    Pass new_session=true to get a private session; the returned session_id must then
+    be sent with every other call. Without it the shared default session is used.
+    """
+    session_state = resolve_init_session(session_id, new_session)
+    key = (llm_model, embeddings_model)
+    init = {"warm": None, "init_ms": 0.0}
+    if session_state.rag_assistant is None or session_state.agent_key != key:
         logger.info(f"---*--- Creating {llm_model} Agent ---*---")
-        session_state.rag_assistant = get_rag_assistant(llm_model=llm_model, embeddings_model=embeddings_model)
+        snapshot = session_state.kb_snapshot
+        release_agent(session_state)
+        agent, warm, elapsed = await asyncio.to_thread(
+            agent_pool.acquire, key, lambda: get_rag_assistant(llm_model=llm_model, embeddings_model=embeddings_model)
+        )
+        session_state.rag_assistant = agent
+        session_state.agent_key = key
         session_state.llm_model = llm_model
         session_state.embeddings_model = embeddings_model
-        session_state.rag_assistant_run_id = session_state.rag_assistant.create_session()
+        session_state.kb_snapshot = None
+        session_state.rag_assistant_run_id = agent.session_id
+        # Keep the pinned snapshot across re-initialization when it matches the embedder
+        if snapshot is not None and snapshot.embeddings_model == embeddings_model:
+            switch_knowledge_base(session_state, snapshot)
+        init = {"warm": warm, "init_ms": round(elapsed * 1000, 1)}
         
         # Initialize messages with a default message
-        session_state.messages = [{"role": "assistant", "content": "Upload a doc and ask me questions..."}]
+        session_state.history.reset(greeting="Upload a doc and ask me questions...")
+
+    return {"status": "Agent initialized", "session_id": session_state.session_id, **init}
 
-    return {"status": "Agent initialized"}
+def client_key(request: Request, client_id: Optional[str], session_state: SessionState) -> str:
+    """Client a request is queued under for fair queuing: explicit id, X-Client-Id, private session or address."""
+    if client_id:
+        return client_id
+    if request.headers.get("X-Client-Id"):
+        return request.headers["X-Client-Id"]
+    if session_state.session_id != DEFAULT_SESSION_ID:
+        return session_state.session_id
+    return request.client.host if request.client else "unknown"
+
+async def admit(request: Request, session_state: SessionState, client_id: Optional[str], priority: str) -> float:
+    """Wait for a run slot of the session's model; 429 with Retry-After when the model is saturated."""
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+    try:
+        return await admission.acquire(session_state.llm_model or "default", client_key(request, client_id, session_state),
+                                       priority)
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
 @app.post("/ask/")
-async def ask_question(prompt: str = Form(...)):
-    """Send a question to the assistant and get a response."""
-    if session_state.rag_assistant is None:
-        raise HTTPException(status_code=400, detail="Agent not initialized")
+async def ask_question(
+    request: Request,
+    prompt: str = Form(...),
+    session_id: Optional[str] = Form(None),
+    cache: str = Form("off"),
+    priority: str = Form("interactive"),
+    client_id: Optional[str] = Form(None),
+):
+    """
+    Send a question to the assistant and get a response.
 
-    # Append user prompt to messages
-    session_state.messages.append({"role": "user", "content": prompt})
-    
-    # Generate response
-    #response = ""
-    #for delta in session_state.rag_assistant.run(prompt):
-    #    response += delta  # type: ignore
-    response = session_state.rag_assistant.run(prompt)
-    session_state.messages.append({"role": "assistant", "content": response.content})
+    cache selects the answer cache mode: "off" (default), "exact", "semantic" (also reuse
+    answers of near-identical prompts) or "refresh" (skip the lookup, store the new answer).
+
+    Runs are admitted per model: priority "interactive" (default) goes before "batch", clients
+    (client_id, X-Client-Id header, session or address) are served round-robin, and a saturated
+    model answers 429 with Retry-After.
+    """
+    if cache not in ANSWER_CACHE_MODES:
+        raise HTTPException(status_code=400, detail=f"cache must be one of {', '.join(ANSWER_CACHE_MODES)}")
+    session_state = get_initialized_session(session_id)
+
+    kb_version = kb_versions.version(kb_table_name(session_state))
+    prompt_embedding = None
+    if cache in ("exact", "semantic"):
+        lookup_started = time.perf_counter()
+        if cache == "semantic":
+            prompt_embedding = await asyncio.to_thread(embed_prompt, session_state, prompt)
+        hit = answer_cache.get(prompt, session_state.llm_model, session_state.embeddings_model,
+                               kb_version, prompt_embedding)
+        if hit is not None:
+            session_state.history.append("user", prompt)
+            session_state.history.append("assistant", hit.answer)
+            timings = {"cache_lookup_s": round(time.perf_counter() - lookup_started, 4)}
+            return {"response": hit.answer, "cache": f"hit-{hit.kind}", "similarity": hit.similarity, "timings": timings}
+    elif cache == "refresh":
+        answer_cache.record_bypass()
+
+    # Cache hits are served above without taking a run slot. The session counts as in flight while the
+    # request waits for admission too, so it is not evicted (and its agent dropped) in the meantime.
+    session_state.in_flight += 1
+    run_started = None
+    try:
+        admission_wait_s = await admit(request, session_state, client_id, priority)
+        run_started = time.perf_counter()
+        observe_stage("admission", admission_wait_s)
+
+        # Append user prompt to messages
+        session_state.history.append("user", prompt)
+
+        # Generate response on the worker pool so the event loop keeps serving other clients
+        #response = ""
+        #for delta in session_state.rag_assistant.run(prompt):
+        #    response += delta  # type: ignore
+        (response, context), timings = await ask_pool.run(run_agent, session_state, prompt)
+        observe_stage("queue", timings["queue_wait_s"])
+        timings["admission_wait_s"] = round(admission_wait_s, 4)
+    finally:
+        session_state.in_flight -= 1
+        if run_started is not None:
+            admission.release(session_state.llm_model or "default", time.perf_counter() - run_started)
+    session_state.history.append("assistant", response.content)
+
+    if cache != "off" and isinstance(response.content, str):
+        answer_cache.put(prompt, response.content, session_state.llm_model, session_state.embeddings_model,
+                         kb_version, prompt_embedding)
     
-    return {"response": response.content}
+    return {"response": response.content, "cache": "miss" if cache != "off" else "off", "timings": timings,
+            "context": context}
+
+def kb_table_name(session_state: SessionState) -> str:
+    if session_state.kb_snapshot is not None:
+        return session_state.kb_snapshot.table_name
+    return f"local_rag_documents_{session_state.embeddings_model}"
+
+def switch_knowledge_base(session_state: SessionState, snapshot: Optional[Snapshot]):
+    """Point the session's agent at a snapshot table (or back at the base table); no rows are moved."""
+    session_state.kb_snapshot = snapshot
+    session_state.rag_assistant.knowledge = get_knowledge(session_state.embeddings_model, kb_table_name(session_state))
+
+def embed_prompt(session_state: SessionState, prompt: str) -> Optional[List[float]]:
+    """Embed a prompt with the session's knowledge embedder, for semantic answer-cache lookups."""
+    knowledge = session_state.rag_assistant.knowledge
+    if knowledge is None or knowledge.vector_db is None:
+        return None
+    return knowledge.vector_db.embedder.get_embedding(prompt)
+
+@app.get("/answer_cache/")
+async def answer_cache_stats():
+    """Size, hit/miss counters and settings of the answer cache."""
+    return answer_cache.summary()
+
+@app.post("/answer_cache/clear/")
+async def clear_answer_cache():
+    return {"status": "Answer cache cleared", "removed": answer_cache.clear()}
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/ask_stream/")
+async def ask_question_stream(
+    request: Request,
+    prompt: str = Form(...),
+    session_id: Optional[str] = Form(None),
+    priority: str = Form("interactive"),
+    client_id: Optional[str] = Form(None),
+):
+    """
+    Streaming variant of /ask/: the answer is sent as server-sent events while it is generated.
+    Admission works as for /ask/; a saturated model answers 429 before the stream starts.
+
+    Events: "token" ({"delta": ...}) for each generated chunk, then "done" ({"timings": ..., "context": ...},
+    timings including time_to_first_token_s) or "error" ({"detail": ...}).
+    """
+    session_state = get_initialized_session(session_id)
+    model = session_state.llm_model or "default"
+    run = None
+    started_at = None
+    finished = False
+
+    def finish():
+        # Frees the run slot and the session exactly once: when the run ends, or when the stream
+        # ends (or fails, or is never iterated) without having started the run
+        nonlocal finished
+        if finished:
+            return
+        finished = True
+        session_state.in_flight -= 1
+        if started_at is not None:
+            admission.release(model, time.perf_counter() - started_at)
+
+    async def finish_unless_running():
+        if run is None:
+            finish()
+
+    # In flight while waiting for admission as well, so the session is not evicted meanwhile
+    session_state.in_flight += 1
+    try:
+        admission_wait_s = await admit(request, session_state, client_id, priority)
+        started_at = time.perf_counter()
+        observe_stage("admission", admission_wait_s)
+        session_state.history.append("user", prompt)
+    except BaseException:
+        finish()
+        raise
+
+    loop = asyncio.get_running_loop()
+    deltas: asyncio.Queue = asyncio.Queue()
+
+    def produce():
+        # Runs on the worker pool; chunks are handed back to the event loop as they arrive
+        with session_state.lock, context_usage() as usage:
+            for chunk in session_state.rag_assistant.run(prompt, stream=True):
+                if isinstance(chunk.content, str) and chunk.content:
+                    loop.call_soon_threadsafe(deltas.put_nowait, (time.perf_counter(), chunk.content))
+            record_agent_run(session_state.rag_assistant, usage.as_dict())
+        return usage.as_dict()
+
+    async def events():
+        nonlocal run
+        first_token_at = None
+        content = ""
+        try:
+            run = asyncio.ensure_future(ask_pool.run(produce))
+            run.add_done_callback(lambda _: deltas.put_nowait(None))
+            # The run slot is freed when the run ends, even if the client disconnected mid-stream
+            run.add_done_callback(lambda _: finish())
+            while (item := await deltas.get()) is not None:
+                produced_at, delta = item
+                if first_token_at is None:
+                    first_token_at = produced_at
+                content += delta
+                yield sse_event("token", {"delta": delta})
+
+            try:
+                context, timings = run.result()
+                observe_stage("queue", timings["queue_wait_s"])
+            except Exception as e:
+                logger.error(f"Streaming run failed: {e}")
+                yield sse_event("error", {"detail": str(e)})
+                return
+
+            if first_token_at is not None:
+                timings["time_to_first_token_s"] = round(first_token_at - started_at, 4)
+            session_state.history.append("assistant", content)
+            timings["admission_wait_s"] = round(admission_wait_s, 4)
+            yield sse_event("done", {"timings": timings, "context": context})
+        finally:
+            if run is None:
+                finish()
+
+    try:
+        # The background task covers streams that are never iterated (client gone before the first read)
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 background=BackgroundTask(finish_unless_running))
+    except BaseException:
+        finish()
+        raise
+
+def run_agent(session_state: SessionState, prompt: str):
+    """
+    Run the session's agent; runs of one session are serialized since an Agent is not thread-safe.
+    Returns the response and the knowledge context it spent (tokens, passages).
+    """
+    with session_state.lock, context_usage() as usage:
+        response = session_state.rag_assistant.run(prompt)
+        record_agent_run(session_state.rag_assistant, usage.as_dict())
+        return response, usage.as_dict()
+
+@app.get("/embedding_cache/")
+async def embedding_cache_stats():
+    """Hit rate and size of the local embedding cache."""
+    return get_embedding_cache().stats()
+
+@app.get("/retrieval_cache/")
+async def retrieval_cache_stats():
+    """Hit/miss counters and latency of the knowledge-search cache."""
+    return retrieval_cache.summary()
+
+@app.post("/retrieval_cache/clear/")
+async def clear_retrieval_cache():
+    return {"status": "Retrieval cache cleared", "removed": retrieval_cache.clear()}
+
+def server_metrics() -> List:
+    """Gauges and counters read from the pools and queues of the server at scrape time."""
+    ask_stats = ask_pool.stats()
+    ask_queue = Gauge("rag_ask_queue_depth", "Agent runs waiting for a worker.")
+    ask_queue.set(ask_stats["queued"])
+    ask_running = Gauge("rag_ask_running", "Agent runs executing on the worker pool.")
+    ask_running.set(ask_stats["running"])
+    jobs = Gauge("rag_ingest_jobs", "Ingestion jobs kept for /jobs/, by status.", ("status",))
+    job_stats = ingest_jobs.stats()
+    for status in ("queued", "running", "done", "failed"):
+        jobs.set(job_stats[status], status=status)
+    live_sessions = Gauge("rag_sessions_live", "Live API sessions.")
+    live_sessions.set(len(sessions.list()))
+    checked_out = Gauge("rag_db_pool_checked_out", "Database connections in use.", ("url",))
+    checkouts = Counter("rag_db_pool_checkouts_total", "Database connection checkouts.", ("url",))
+    wait = Counter("rag_db_pool_wait_seconds_total", "Time spent waiting for database connections.", ("url",))
+    timeouts = Counter("rag_db_pool_timeouts_total", "Checkouts that timed out waiting for a connection.", ("url",))
+    for pool in pool_stats():
+        checked_out.set(pool["checked_out"], url=pool["url"])
+        checkouts.inc(pool["checkouts"], url=pool["url"])
+        wait.inc(pool["total_wait_s"], url=pool["url"])
+        timeouts.inc(pool["timeouts"], url=pool["url"])
+    storage_pending = Gauge("rag_agent_storage_pending", "Agent sessions not yet written to Postgres.", ("table",))
+    for storage in agent_storage_lag():
+        storage_pending.set(storage["pending"], table=storage["table"])
+    admission_running = Gauge("rag_admission_running", "Admitted agent runs per model.", ("model",))
+    admission_queued = Gauge("rag_admission_queued", "Requests waiting for admission.", ("model", "priority"))
+    admission_rejected = Counter("rag_admission_rejected_total", "Requests answered 429.", ("model", "reason"))
+    for model, lane in admission.stats()["models"].items():
+        admission_running.set(lane["running"], model=model)
+        for priority, queued in lane["queued"].items():
+            admission_queued.set(queued, model=model, priority=priority)
+        for reason, rejected in lane["rejected"].items():
+            admission_rejected.inc(rejected, model=model, reason=reason)
+    return [ask_queue, ask_running, jobs, live_sessions, checked_out, checkouts, wait, timeouts, storage_pending,
+            admission_running, admission_queued, admission_rejected]
+
+registry.register_collector(server_metrics)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    return PlainTextResponse(registry.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/metrics/json")
+async def metrics_summary():
+    """All metrics as JSON, histograms summarized as count, average and p50/p95/p99."""
+    return registry.summary()
+
+@app.get("/db_pool/")
+async def db_pool_stats():
+    """Connection pool usage and checkout wait times; high waits mean the pool is too small."""
+    return {"pools": pool_stats()}
+
+@app.get("/near_dups/")
+async def near_dup_stats():
+    """Mode, threshold, duplicate ratio since startup and the stored signatures per table."""
+    return await asyncio.to_thread(near_dups.stats)
+
+@app.get("/admission/")
+async def admission_stats():
+    """Limits, running and queued requests per model, and the 429s by reason (queue_full, shed, queue_timeout)."""
+    return admission.stats()
+
+@app.get("/worker_pool/")
+async def worker_pool_stats():
+    """Concurrency limit, queue depth and counters of the /ask/ worker pool."""
+    return ask_pool.stats()
 
 def load_knowledge_base_old(url: str, table_name: str):
     """
@@ -115,66 +622,203 @@ def load_knowledge_base_old(url: str, table_name: str):
         max_links=2,  # adjust depth if needed
         vector_db=PgVector(
             table_name=table_name,
-            db_url=DB_URL,
+            db_engine=engine,
         ),
     )
     knowledge_base.load()
 
-def load_knowledge_base(url: str, table_name:str):
-    # Headers from your working manual test
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
-    # Fetch and parse
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    
-    soup = BeautifulSoup(response.content, 'html.parser')
-    title = soup.title.string if soup.title else url.split('/')[-1]
-    
-    # Clean text (remove scripts/styles/nav)
-    for tag in soup(["script", "style", "nav", "footer"]):
-        tag.decompose()
-    text = soup.get_text(separator='\n', strip=True)
-    
-    doc = Document(
-        content=text,
-        metadata={"source": url, "title": title}
-    )
-    
-    
-    # Define the embedder based on the embeddings model
-    if session_state.embeddings_model == "nomic-embed-text":
-        embedder = OllamaEmbedder(model=session_state.embeddings_model, dimensions=768)
-    else:
-        embedder = OllamaEmbedder(model=session_state.embeddings_model)
+def load_knowledge_base(url: str, table_name:str, embeddings_model: str):
+    """
+    Scrape the website URL and load it into the pgvector knowledge base.
 
-    # Load to KB
-    kb = AgentKnowledge(
-        vector_db=PgVector(
-            schema="ai",
-            table_name=table_name,
-            db_url=DB_URL,
-            embedder=embedder
-        )
+    Sources are looked up in the ingest cache first: an unchanged page costs one
+    conditional GET and the cached embedded rows are copied into the table.
+    Returns the cache outcome, per-stage timings and the links found on the page.
+    """
+    timings = {"fetch_s": 0.0, "parse_s": 0.0, "chunk_s": 0.0, "embed_s": 0.0, "insert_s": 0.0}
+    embedder = get_embedder(embeddings_model)
+    # Cached rows depend on the chunking parameters as well as on the embedder
+    profile = f"{embeddings_model}@{chunker.profile}"
+
+    cached = ingest_cache.lookup(url, profile)
+    vector_db = get_vector_db(
+        schema="ai",
+        table_name=table_name,
+        db_url=DB_URL,
+        embedder=embedder,
+        # Same backend as the agent's knowledge, so a BM25 index is kept up to date
+        search_type=SearchType.hybrid
     )
-    kb.load_documents([doc])  # Add more docs for crawling/multi-URL
+
+    # Fetch and parse
+    started_at = time.perf_counter()
+    response = crawler.get(url, headers=ingest_cache.conditional_headers(cached))
+    timings["fetch_s"] += time.perf_counter() - started_at
+
+    documents = []
+    links = []
+    report = None
+    if cached is not None and response.status_code == 304:
+        documents = ingest_cache.get_documents(cached.content_hash, profile)
+        if documents:
+            links = cached.links
+            ingest_cache.remember(url, profile, cached.content_hash, len(documents),
+                                  response.headers.get("ETag") or cached.etag,
+                                  response.headers.get("Last-Modified") or cached.last_modified, links)
+            cache_status = "not-modified"
+        else:
+            # The cached rows are gone, fetch the full page again
+            started_at = time.perf_counter()
+            response = crawler.get(url)
+            timings["fetch_s"] += time.perf_counter() - started_at
+
+    if not documents:
+        response.raise_for_status()
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+
+        started_at = time.perf_counter()
+        soup = BeautifulSoup(response.content, 'html.parser')
+        title = soup.title.string if soup.title else url.split('/')[-1]
+        links = extract_links(soup, response.url or url)
+        text = html_to_text(soup)
+        text_hash = content_hash(text)
+        timings["parse_s"] += time.perf_counter() - started_at
+
+        # Same text already embedded (possibly under another URL)
+        documents = ingest_cache.get_documents(text_hash, profile)
+        if documents:
+            ingest_cache.remember(url, profile, text_hash, len(documents), etag, last_modified, links)
+            cache_status = "unchanged"
+        else:
+            started_at = time.perf_counter()
+            doc = Document(
+                name=title,
+                content=text,
+                meta_data={"source": url, "title": title}
+            )
+            documents = chunker.chunk(doc)
+            chunks_hash = documents_hash(documents)
+            documents, report = near_dups.filter(table_name, documents, vector_db)
+            timings["chunk_s"] += time.perf_counter() - started_at
+
+            started_at = time.perf_counter()
+            embed_documents(embedder, documents, EMBED_BATCH_SIZE)
+            timings["embed_s"] += time.perf_counter() - started_at
+            # Chunks skipped as duplicates of other sources are not in the cache entry; such a page is
+            # not cached, so it is loaded in full again once those sources are gone
+            if not report.existing:
+                ingest_cache.store(url, profile, text_hash, documents, etag, last_modified, links)
+            cache_status = "miss"
+
+    if report is None:
+        chunks_hash = documents_hash(documents)
+        documents, report = near_dups.filter(table_name, documents, vector_db)
+
+    # Load to KB; cached rows already carry their embeddings so the embedder is never called
+    started_at = time.perf_counter()
+    insert_embedded_documents(vector_db, documents)
+    near_dups.register(table_name, report)
+    timings["insert_s"] += time.perf_counter() - started_at
+    observe_stages(timings, INGEST_STAGES)
+    return {
+        "cache": cache_status,
+        "documents": len(documents),
+        "content_hash": chunks_hash,
+        "near_duplicates": report.as_dict(),
+        "timings": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+        "links": links,
+    }
+
+def documents_hash(documents: List[Document]) -> str:
+    """Content id of a loaded source, used for the knowledge-base version."""
+    return hashlib.sha256("\n".join(doc.content for doc in documents).encode("utf-8", errors="replace")).hexdigest()
+
+def embed_and_insert(job: IngestJob, vector_db, embedder, documents: List[Document]):
+    """Embed and insert the chunks of a job INGEST_STEP_SIZE at a time, reporting progress after every step."""
+    job.update(chunks=len(documents), chunks_done=0)
+    for start in range(0, len(documents), INGEST_STEP_SIZE):
+        step = documents[start:start + INGEST_STEP_SIZE]
+        job.set_stage("embed")
+        embed_documents(embedder, step, EMBED_BATCH_SIZE)
+        job.set_stage("insert")
+        insert_embedded_documents(vector_db, step)
+        # The embeddings are in the table now; only the content is kept (for the version hash)
+        for doc in step:
+            doc.embedding = None
+        job.advance(len(step))
+
+def finish_ingest(table_name: str, content_hash: str):
+    kb_versions.add(table_name, content_hash)
+    retrieval_cache.invalidate(table_name)
+
+def queued_job(job: IngestJob) -> Dict:
+    return {"status": "queued", "job_id": job.id, "table": job.table, "job_url": f"/jobs/{job.id}"}
 
 @app.post("/add_url/")
-async def add_url(url: str = Form(...)):
-    """Add a URL to the RAG knowledge base using load_knowledge_base logic."""
-    if session_state.rag_assistant is None:
-        raise HTTPException(status_code=400, detail="Agent not initialized")
+async def add_url(url: str = Form(...), session_id: Optional[str] = Form(None)):
+    """Queue a job adding a URL to the RAG knowledge base; poll /jobs/{job_id} for its outcome."""
+    session_state = get_kb_session(session_id)
 
     # Construct table name dynamically based on embeddings model
-    table_name = f"local_rag_documents_{session_state.embeddings_model}"
+    table_name = kb_table_name(session_state)
+    embeddings_model = session_state.embeddings_model
 
-    try:
-        load_knowledge_base(url, table_name)
-        return {"status": "URL added", "url": url, "table": table_name}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Could not load knowledge base: {str(e)}")
+    def ingest(job: IngestJob) -> Dict:
+        job.set_stage("load")
+        result = load_knowledge_base(url, table_name, embeddings_model)
+        result.pop("links")
+        job.update(chunks=result["documents"], chunks_done=result["documents"])
+        finish_ingest(table_name, result["content_hash"])
+        return {"url": url, **result}
+
+    return queued_job(ingest_jobs.submit("url", url, table_name, ingest))
+
+@app.post("/add_urls/")
+async def add_urls(
+    urls: List[str] = Form(...),
+    max_depth: int = Form(0),
+    max_links: int = Form(0),
+    session_id: Optional[str] = Form(None),
+):
+    """
+    Crawl a list of URLs concurrently into the RAG knowledge base.
+
+    Links on the same host are followed up to max_depth levels deep, at most max_links
+    of them in total. Reports the cache outcome and fetch/parse/embed timings of every page.
+    """
+    session_state = get_kb_session(session_id)
+    table_name = kb_table_name(session_state)
+    embeddings_model = session_state.embeddings_model
+
+    started_at = time.perf_counter()
+    # Create the table once, before concurrent inserts
+    get_vector_db(schema="ai", table_name=table_name, db_url=DB_URL, embedder=get_embedder(embeddings_model)).create()
+    pages = await asyncio.to_thread(
+        crawler.crawl, urls, lambda url: load_knowledge_base(url, table_name, embeddings_model),
+        max_depth=max_depth, max_links=max_links,
+    )
+    for page in pages:
+        if page["status"] == "ok":
+            kb_versions.add(table_name, page["content_hash"])
+    retrieval_cache.invalidate(table_name)
+
+    loaded = [page for page in pages if page["status"] == "ok"]
+    summary = {
+        "pages": len(pages),
+        "errors": len(pages) - len(loaded),
+        "documents": sum(page["documents"] for page in loaded),
+        "elapsed_s": round(time.perf_counter() - started_at, 4),
+    }
+    for status in ("miss", "unchanged", "not-modified"):
+        summary[status] = sum(1 for page in loaded if page["cache"] == status)
+    chunks = sum(page["near_duplicates"]["chunks"] for page in loaded)
+    duplicates = sum(page["near_duplicates"]["duplicates"] for page in loaded)
+    summary["near_duplicates"] = duplicates
+    summary["near_duplicate_ratio"] = round(duplicates / chunks, 4) if chunks else 0.0
+    for stage in ("fetch_s", "parse_s", "chunk_s", "embed_s", "insert_s"):
+        summary[stage] = round(sum(page["timings"][stage] for page in loaded), 4)
+    return {"status": "URLs added", "table": table_name, "summary": summary, "pages": pages}
 
 '''
 ......................................................
@@ -195,10 +839,9 @@ async def add_url(url: str = Form(...)):
 '''
 
 @app.post("/upload_md/")
-async def upload_md(file: UploadFile = File(...)):
-    """Upload a Markdown file to the knowledge base."""
-    if session_state.rag_assistant is None:
-        raise HTTPException(state_code=400, detail="Agent not initialized")
+async def upload_md(file: UploadFile = File(...), session_id: Optional[str] = Form(None)):
+    """Queue a job uploading a Markdown file to the knowledge base; poll /jobs/{job_id} for its outcome."""
+    session_state = get_kb_session(session_id)
 
     path = Path("./test_knowledge/" + file.filename)
     try:
@@ -207,42 +850,123 @@ async def upload_md(file: UploadFile = File(...)):
     except Exception:
         raise HTTPException(status_code=400, detail="Could not save Markdown file")
 
-    reader = TextReader()
-    rag_documents: List[Document] = reader.read(path)
-    if rag_documents:
-        session_state.rag_assistant.knowledge.load_documents(rag_documents, upsert=True)
-        return {"status": "Markdown file uploaded"}
-    else:
-        raise HTTPException(status_code=400, detail="Could not read Markdown file")
+    table_name = kb_table_name(session_state)
+    vector_db = session_state.rag_assistant.knowledge.vector_db
+    embedder = get_embedder(session_state.embeddings_model)
+
+    def ingest(job: IngestJob) -> Dict:
+        job.set_stage("parse")
+        text = path.read_text(encoding="utf-8", errors="replace")
+        doc = Document(name=path.stem, content=text, meta_data={"source": file.filename, "title": path.stem})
+        job.set_stage("chunk")
+        rag_documents: List[Document] = chunker.chunk(doc)
+        if not rag_documents:
+            raise ValueError("Could not read Markdown file")
+        content_hash = documents_hash(rag_documents)
+        kept, report = near_dups.filter(table_name, rag_documents, vector_db)
+        embed_and_insert(job, vector_db, embedder, kept)
+        near_dups.register(table_name, report)
+        finish_ingest(table_name, content_hash)
+        return {"documents": len(kept), "content_hash": content_hash, "near_duplicates": report.as_dict()}
+
+    return queued_job(ingest_jobs.submit("markdown", file.filename, table_name, ingest))
 
 @app.post("/upload_pdf/")
-async def upload_pdf(file: UploadFile = File(...)):
-    """Upload a PDF to the knowledge base."""
-    if session_state.rag_assistant is None:
-        raise HTTPException(status_code=400, detail="Agent not initialized")
+async def upload_pdf(file: UploadFile = File(...), session_id: Optional[str] = Form(None)):
+    """
+    Queue a job uploading a PDF to the knowledge base; poll /jobs/{job_id} for its outcome.
 
-    reader = PDFReader()
-    rag_documents: List[Document] = reader.read(file.file)
-    if rag_documents:
-        session_state.rag_assistant.knowledge.load_documents(rag_documents, upsert=True)
-        return {"status": "PDF uploaded"}
-    else:
+    Pages are parsed in parallel, split into chunks and embedded in batches. Pages that
+    cannot be parsed are reported in the job errors and skipped.
+    """
+    session_state = get_kb_session(session_id)
+
+    data = await file.read()
+    if not data.startswith(b"%PDF"):
         raise HTTPException(status_code=400, detail="Could not read PDF")
 
+    table_name = kb_table_name(session_state)
+    vector_db = session_state.rag_assistant.knowledge.vector_db
+    embedder = get_embedder(session_state.embeddings_model)
+    name = Path(file.filename or "pdf").stem.replace(" ", "_")
+
+    def ingest(job: IngestJob) -> Dict:
+        job.set_stage("parse")
+        pages, errors = read_pdf_pages(data, lambda parsed, total: job.update(pages=total, pages_parsed=parsed))
+        for error in errors:
+            job.add_error(error)
+        job.set_stage("chunk")
+        rag_documents: List[Document] = []
+        for page_number, text in pages:
+            if text.strip():
+                doc = Document(name=name, content=text,
+                               meta_data={"source": file.filename, "title": name, "page": page_number})
+                rag_documents.extend(chunker.chunk(doc))
+        if not rag_documents:
+            raise ValueError("Could not read PDF: no text found")
+        content_hash = documents_hash(rag_documents)
+        kept, report = near_dups.filter(table_name, rag_documents, vector_db)
+        embed_and_insert(job, vector_db, embedder, kept)
+        near_dups.register(table_name, report)
+        finish_ingest(table_name, content_hash)
+        return {"pages": len(pages), "documents": len(kept), "content_hash": content_hash,
+                "near_duplicates": report.as_dict()}
+
+    return queued_job(ingest_jobs.submit("pdf", file.filename, table_name, ingest))
+
+@app.get("/jobs/")
+async def list_jobs(status: Optional[str] = None):
+    """Recent ingestion jobs, optionally only those with the given status (queued, running, done, failed)."""
+    return {**ingest_jobs.stats(), "jobs": ingest_jobs.list(status)}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Stage, progress, throughput, timings and errors of an ingestion job."""
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job.describe()
+
 
 @app.post("/clear_knowledge_base/")
-async def clear_knowledge_base():
-    """Clear the knowledge base for the current embeddings model."""
-    if session_state.rag_assistant is None:
-        raise HTTPException(status_code=400, detail="Agent not initialized")
+async def clear_knowledge_base(
+    purge_cache: bool = Form(False),
+    snapshot: Optional[str] = Form(None),
+    session_id: Optional[str] = Form(None),
+):
+    """
+    Clear the knowledge base for the current embeddings model.
 
-    table_name = f"local_rag_documents_{session_state.embeddings_model}"
+    The clear is logical: only the serving table is emptied, the embedded rows stay
+    in the ingest cache so the next /add_url/ restores a source without re-embedding.
+    Pass purge_cache=true to drop the cached rows as well.
+
+    With snapshot=<name> nothing is truncated: the session switches to a new, empty
+    version of that snapshot, and runs using other tables are unaffected.
+    """
+    session_state = get_kb_session(session_id)
+
+    if snapshot:
+        result = await create_snapshot(name=snapshot, copy_current=False, session_id=session_state.session_id)
+        purged = ingest_cache.purge(session_state.embeddings_model) if purge_cache else 0
+        return {"status": "Knowledge base cleared", **result, "purged_sources": purged}
+
+    table_name = kb_table_name(session_state)
 
     try:
-        with engine.begin() as conn:
-            sql_stmt = text(f'TRUNCATE TABLE "{table_name}" RESTART IDENTITY CASCADE')
-            conn.execute(sql_stmt)
-        return {"status": "Knowledge base cleared", "table": table_name}
+        if VECTOR_STORE == "local":
+            session_state.rag_assistant.knowledge.vector_db.delete()
+        else:
+            with engine.begin() as conn:
+                sql_stmt = text(f'TRUNCATE TABLE "{table_name}" RESTART IDENTITY CASCADE')
+                conn.execute(sql_stmt)
+            if isinstance(session_state.rag_assistant.knowledge.vector_db, BM25HybridDb):
+                session_state.rag_assistant.knowledge.vector_db.clear_index()
+        kb_versions.clear(table_name)
+        retrieval_cache.invalidate(table_name)
+        near_dups.clear(table_name)
+        purged = ingest_cache.purge(session_state.embeddings_model) if purge_cache else 0
+        return {"status": "Knowledge base cleared", "table": table_name, "purged_sources": purged}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Could not clear knowledge base: {str(e)}")
 
@@ -260,15 +984,137 @@ async def clear_knowledge_base():
         raise HTTPException(status_code=400, detail="No knowledge base to clear")
 '''
 
+@app.post("/kb/snapshots/")
+async def create_snapshot(
+    name: str = Form(...),
+    copy_current: bool = Form(False),
+    session_id: Optional[str] = Form(None),
+):
+    """
+    Create the next version of a named knowledge-base snapshot and switch the session to it.
+
+    The new version starts empty, or as a copy of the session's current knowledge base
+    with copy_current=true. It becomes the version that /kb/switch/ resolves the name to.
+    """
+    session_state = get_kb_session(session_id)
+    source_table = f"ai.{kb_table_name(session_state)}" if copy_current else None
+    try:
+        snapshot = await asyncio.to_thread(
+            kb_snapshots.create, name, session_state.embeddings_model,
+            get_embedder(session_state.embeddings_model), source_table,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if copy_current:
+        kb_versions.copy(source_table.split(".", 1)[1], snapshot.table_name)
+        near_dups.copy(source_table.split(".", 1)[1], snapshot.table_name)
+    switch_knowledge_base(session_state, snapshot)
+    dropped = await asyncio.to_thread(collect_snapshots)
+    return {"status": "Snapshot created", "snapshot": snapshot.describe(), "gc_dropped": dropped}
+
+@app.post("/kb/switch/")
+async def switch_snapshot(
+    name: Optional[str] = Form(None),
+    version: Optional[int] = Form(None),
+    session_id: Optional[str] = Form(None),
+):
+    """
+    Pin the session to a prepared snapshot: the given version, or the current one of the name.
+    Without a name the session goes back to the base table of its embeddings model.
+    """
+    session_state = get_kb_session(session_id)
+    snapshot = None
+    if name:
+        try:
+            snapshot = await asyncio.to_thread(kb_snapshots.resolve, name, session_state.embeddings_model, version)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if snapshot is None:
+            raise HTTPException(status_code=404, detail=f"Unknown snapshot {name} for {session_state.embeddings_model}")
+    switch_knowledge_base(session_state, snapshot)
+    return {"status": "Knowledge base switched", "table": kb_table_name(session_state),
+            "snapshot": snapshot.describe() if snapshot else None}
+
+@app.get("/kb/snapshots/")
+async def list_snapshots(embeddings_model: Optional[str] = None):
+    return {"snapshots": await asyncio.to_thread(kb_snapshots.list, embeddings_model)}
+
+@app.post("/kb/snapshots/gc/")
+async def gc_snapshots(keep_versions: int = Form(KB_KEEP_VERSIONS), max_age_days: Optional[float] = Form(KB_MAX_AGE_DAYS)):
+    """Drop old snapshot versions; current versions and those used by live sessions are kept."""
+    dropped = await asyncio.to_thread(collect_snapshots, keep_versions, max_age_days)
+    return {"status": "Snapshots collected", "dropped": dropped}
+
+def collect_snapshots(keep_versions: int = KB_KEEP_VERSIONS, max_age_days: Optional[float] = KB_MAX_AGE_DAYS) -> List[Dict]:
+    in_use = {session["kb_table"] for session in sessions.list() if session["kb_table"]}
+    dropped = kb_snapshots.gc(in_use, keep_versions=keep_versions, max_age_days=max_age_days)
+    for snapshot in dropped:
+        kb_versions.clear(snapshot["table"].split(".", 1)[1])
+        retrieval_cache.invalidate(snapshot["table"].split(".", 1)[1])
+        near_dups.clear(snapshot["table"].split(".", 1)[1])
+    return dropped
+
+@app.get("/kb/indexes/")
+async def list_indexes():
+    """Row counts, table sizes and index sizes of the knowledge-base tables."""
+    if VECTOR_STORE != "pgvector":
+        raise HTTPException(status_code=400, detail="Index management needs the pgvector store")
+    return {"ann_index": ANN_INDEX, "tables": await asyncio.to_thread(index_manager.report)}
+
+@app.post("/kb/indexes/")
+async def build_indexes_now(
+    table: Optional[str] = Form(None),
+    kind: str = Form(ANN_INDEX),
+    rebuild: bool = Form(False),
+):
+    """Build (or with rebuild, recreate) the ANN and GIN indexes of one table, or of all of them."""
+    if VECTOR_STORE != "pgvector":
+        raise HTTPException(status_code=400, detail="Index management needs the pgvector store")
+    if kind not in ("hnsw", "ivfflat", "none"):
+        raise HTTPException(status_code=400, detail=f"Unknown ANN index '{kind}'")
+    if table:
+        table = table.split(".", 1)[-1]
+        if table not in await asyncio.to_thread(index_manager.tables):
+            raise HTTPException(status_code=404, detail=f"Unknown knowledge-base table {table}")
+        results = [await asyncio.to_thread(index_manager.build, table, kind=kind, rebuild=rebuild)]
+    else:
+        results = await asyncio.to_thread(index_manager.build_all, kind=kind, rebuild=rebuild)
+    return {"status": "Indexes built", "results": results}
+
 @app.get("/chat_history/")
-async def get_chat_history():
-    """Get the chat history."""
-    return {"messages": session_state.messages}
+async def get_chat_history(
+    session_id: Optional[str] = None,
+    cursor: int = 0,
+    limit: int = 100,
+    metadata_only: bool = False,
+):
+    """
+    Get a page of the chat history: up to limit messages after the message with id cursor.
+
+    Pass the returned next_cursor to get the next page (it is null on the last one).
+    metadata_only=true returns id, role, length and created_at without the contents.
+    """
+    session_state = get_session(session_id)
+    return session_state.history.page(cursor=cursor, limit=limit, metadata_only=metadata_only)
 
 @app.post("/new_run/")
-async def new_run():
-    """Start a new run."""
-    session_state.rag_assistant = None
-    session_state.messages = [{"role": "assistant", "content": "Upload a doc and ask me questions..."}]
+async def new_run(session_id: Optional[str] = Form(None)):
+    """Start a new run: the session is dropped and its agent goes back to the pool for the next /initialize/."""
+    sessions.remove(session_id or DEFAULT_SESSION_ID)
     return {"status": "New run started"}
 
+@app.get("/agent_storage/")
+async def agent_storage_stats():
+    """Storage-lag gauge of the write-behind agent storage: queued sessions and age of the oldest write."""
+    return {"storages": agent_storage_lag()}
+
+@app.get("/agent_pool/")
+async def agent_pool_stats():
+    """Idle agents and cold vs. warm initialization latency per model pair."""
+    return agent_pool.summary()
+
+@app.get("/sessions/")
+async def list_sessions():
+    """List the live sessions."""
+    return {"sessions": sessions.list(), "max_sessions": sessions.max_sessions, "ttl_s": sessions.ttl_s}
+
@@ -1,6 +1,8 @@
-from typing import Optional
+import time
+from typing import Any, Dict, List, Optional
 from phi.agent import Agent
 from phi.agent import AgentKnowledge
+from phi.document import Document
 from phi.llm.ollama import OllamaTools
 from phi.model.ollama import Ollama
 from phi.embedder.ollama import OllamaEmbedder
@@ -11,10 +13,17 @@ from phi.model.openai import OpenAIChat
 from phi.embedder.openai import OpenAIEmbedder
 from better_shell import BetterShellTools
 from statement import Model
+from embedding_cache import CachedEmbedder
+from vector_store import get_vector_db
+from retrieval_cache import get_retrieval_cache
+from agent_storage import get_agent_storage
+from context_assembly import budgeted_retriever
+from metrics import stage
 from phi.model.google import Gemini
+from db import DB_URL
 
 
-db_url = "postgresql+psycopg://ai:ai@localhost:5532/ai"
+db_url = DB_URL
 
 description = "You are an AI called 'RAGit'. You provide instructions that a user should take to solve issues with their Kubernetes configurations."
 task = "Provide the user with instructions and shell commands to solve the user's problem."
@@ -46,6 +55,56 @@ guidelines = [
     #"When writing out your commands, use the **real name** of the Kubernetes resource instead of placeholder names. For example, if the command you are about to suggest is `kubectl get pods -n <namespace>`, run `kubectl get namespaces` first to get available namespaces. Another example is if your command is `kubectl describe <node-name>`, then run `kubectl get nodes` first to get the available nodes.",
 ]
 
+def get_embedder(embeddings_model: str = "nomic-embed-text") -> CachedEmbedder:
+    """Ollama embedder backed by the local embedding cache."""
+    # Define the embedder based on the embeddings model
+    if embeddings_model == "nomic-embed-text":
+        embedder = OllamaEmbedder(model=embeddings_model, dimensions=768)
+    else:
+        embedder = OllamaEmbedder(model=embeddings_model)
+    return CachedEmbedder(embedder=embedder)
+
+class CachedKnowledge(AgentKnowledge):
+    """Knowledge base whose search results are served from the retrieval cache while the table is unchanged."""
+
+    # Table searched by vector_db, the retrieval cache key
+    table_name: str = ""
+
+    def search(
+        self, query: str, num_documents: Optional[int] = None, filters: Optional[Dict[str, Any]] = None
+    ) -> List[Document]:
+        with stage("retrieve"):
+            cache = get_retrieval_cache()
+            limit = num_documents or self.num_documents
+            documents = cache.get(self.table_name, query, limit, filters)
+            if documents is not None:
+                return documents
+            version = cache.version(self.table_name)
+            started_at = time.perf_counter()
+            documents = super().search(query=query, num_documents=limit, filters=filters)
+            # Failed searches come back empty; only real results are cached
+            if documents:
+                cache.put(self.table_name, query, limit, filters, documents, time.perf_counter() - started_at, version)
+            return documents
+
+def get_knowledge(embeddings_model: str = "nomic-embed-text", table_name: Optional[str] = None) -> AgentKnowledge:
+    """Knowledge base of the RAG assistant; table_name selects a knowledge-base snapshot table."""
+    table_name = table_name or f"local_rag_documents_{embeddings_model}"
+    # Define the knowledge base
+    return CachedKnowledge(
+        table_name=table_name,
+        # pgvector, or the in-process store when RAG_VECTOR_STORE=local
+        vector_db=get_vector_db(
+            db_url=db_url,
+            schema="ai",
+            table_name=table_name,
+            embedder=get_embedder(embeddings_model),
+            search_type=SearchType.hybrid
+        ),
+        # 3 documents when context assembly is off (RAG_CONTEXT_BUDGET_TOKENS=0)
+        num_documents=3,
+    )
+
 def get_rag_agent(
     model: Model, 
     use_rag: bool = True,
@@ -61,12 +120,14 @@ def get_rag_agent(
     embedder, embeddings_model_clean = model.to_embedder()
 
     if use_rag:
-        # Define the knowledge base
-        knowledge = AgentKnowledge(
-            vector_db=PgVector(
+        table_name = f"local_rag_documents_{embeddings_model_clean}"
+        # Define the knowledge base; searches go through the retrieval cache like the assistant's
+        knowledge = CachedKnowledge(
+            table_name=table_name,
+            vector_db=get_vector_db(
                 db_url=db_url,
                 schema="ai",
-                table_name=f"local_rag_documents_{embeddings_model_clean}",
+                table_name=table_name,
                 embedder=embedder,
                 search_type=SearchType.hybrid
             ),
@@ -80,11 +141,13 @@ def get_rag_agent(
             user_id=user_id,
             model=llm,
             knowledge=knowledge,
+            # Searches return the best passages that fit the context token budget
+            retriever=budgeted_retriever,
             use_default_system_message=True,
             use_default_user_message=True,
             add_context=False,
             add_context_instructions=True,
-            storage=PgAgentStorage(table_name="ai.local_rag_agent", db_url=db_url),
+            storage=get_agent_storage("ai.local_rag_agent", db_url),
             #tools=[BetterShellTools()],
             show_tool_calls=False,
             #read_chat_history=True,
@@ -104,7 +167,7 @@ def get_rag_agent(
             run_id=run_id,
             user_id=user_id,
             model=llm,
-            storage=PgAgentStorage(table_name="ai.local_agent", db_url=db_url),
+            storage=get_agent_storage("ai.local_agent", db_url),
             tools=[BetterShellTools()],
             description=description,
             task=task,
@@ -133,25 +196,8 @@ def get_rag_assistant(
     else:
         llm = Ollama(id=llm_model)
     
-    # Define the embedder based on the embeddings model
-    if embeddings_model == "nomic-embed-text":
-        embedder = OllamaEmbedder(model=embeddings_model, dimensions=768)
-    else:
-        embedder = OllamaEmbedder(model=embeddings_model)
-
     """ model = """
-    # Define the knowledge base
-    knowledge = AgentKnowledge(
-        vector_db=PgVector(
-            db_url=db_url,
-            schema="ai",
-            table_name=f"local_rag_documents_{embeddings_model}",
-            embedder=embedder,
-            search_type=SearchType.hybrid
-        ),
-        # 3 references are added to the prompt
-        num_documents=3,
-    )
+    knowledge = get_knowledge(embeddings_model)
 
     return Agent(
         name="local_rag_assistant",
@@ -160,11 +206,13 @@ def get_rag_assistant(
         #llm=OllamaTools(model=llm_model),
         model=llm,
         knowledge=knowledge,
+        # Searches return the best passages that fit the context token budget
+        retriever=budgeted_retriever,
         use_default_system_message=True,
         use_default_user_message=True,
         add_context=True,
         add_context_instructions=True,
-        storage=PgAgentStorage(table_name="ai.local_rag_assistant", db_url=db_url),
+        storage=get_agent_storage("ai.local_rag_assistant", db_url),
         tools=[BetterShellTools()],
         show_tool_calls=False,
         #read_chat_history=True,
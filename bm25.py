@@ -0,0 +1,207 @@
+"""
+In-process BM25 inverted index for the lexical leg of hybrid retrieval.
+
+Postings are kept per term as two compact arrays (document numbers as uint32, term
+frequencies as uint16). Documents can be added, replaced and removed without a
+rebuild; removed documents are tombstoned and purged from the postings once they make
+up a quarter of the index. The tokenizer keeps Kubernetes identifiers whole and also
+indexes their parts, so `CrashLoopBackOff` matches both `crashloopbackoff` and `crash
+loop back off`, and `targetPort:` matches `targetport`, `target` and `port`.
+"""
+import math
+import os
+import pickle
+import re
+import threading
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Identifiers may contain inner '_', '.', '-', '/' and ':' (kube-system, apps/v1, nginx:1.19)
+TOKEN = re.compile(r"[A-Za-z0-9](?:[A-Za-z0-9_.\-/:]*[A-Za-z0-9])?")
+SEPARATORS = re.compile(r"[_.\-/:]+")
+CAMEL_CASE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have if in into is it its of on or that the their then there "
+    "these this to was were will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for match in TOKEN.finditer(text):
+        word = match.group()
+        lowered = word.lower()
+        if lowered not in STOPWORDS:
+            tokens.append(lowered)
+        parts = [sub for part in SEPARATORS.split(word) for sub in CAMEL_CASE.findall(part)]
+        if len(parts) > 1:
+            for part in parts:
+                part = part.lower()
+                if part != lowered and part not in STOPWORDS:
+                    tokens.append(part)
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.doc_ids: List[Optional[str]] = []
+            self.doc_numbers: Dict[str, int] = {}
+            self.doc_lengths = array("I")
+            self.live = bytearray()
+            self.payloads: List[Optional[Dict]] = []
+            self.postings: Dict[str, Tuple[array, array]] = {}
+            self.total_length = 0
+            self.removed = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_numbers)
+
+    def add(self, doc_id: str, text: str, payload: Optional[Dict] = None):
+        """Index a document; adding an id that is already indexed replaces it."""
+        with self.lock:
+            self.remove(doc_id)
+            terms = Counter(tokenize(text))
+            number = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+            self.doc_numbers[doc_id] = number
+            length = sum(terms.values())
+            self.doc_lengths.append(length)
+            self.live.append(1)
+            self.payloads.append(payload)
+            self.total_length += length
+            for term, frequency in terms.items():
+                docs, frequencies = self.postings.setdefault(term, (array("I"), array("H")))
+                docs.append(number)
+                frequencies.append(min(frequency, 65535))
+
+    def remove(self, doc_id: str) -> bool:
+        with self.lock:
+            number = self.doc_numbers.pop(doc_id, None)
+            if number is None:
+                return False
+            self.live[number] = 0
+            self.doc_ids[number] = None
+            self.payloads[number] = None
+            self.total_length -= self.doc_lengths[number]
+            self.removed += 1
+            if self.removed > 1000 and self.removed * 4 > len(self.doc_ids):
+                self.compact()
+            return True
+
+    def compact(self):
+        """Renumber the live documents and drop removed ones from every posting list."""
+        with self.lock:
+            mapping = np.full(len(self.doc_ids), -1, dtype=np.int64)
+            live = np.frombuffer(bytes(self.live), dtype=np.uint8).astype(bool)
+            mapping[live] = np.arange(int(live.sum()))
+            postings = {}
+            for term, (docs, frequencies) in self.postings.items():
+                numbers = mapping[np.frombuffer(docs, dtype=np.uint32).copy()]
+                keep = numbers >= 0
+                if keep.any():
+                    postings[term] = (array("I", numbers[keep].astype(np.uint32).tobytes()),
+                                      array("H", np.frombuffer(frequencies, dtype=np.uint16)[keep].tobytes()))
+            self.postings = postings
+            self.doc_ids = [doc_id for doc_id in self.doc_ids if doc_id is not None]
+            self.doc_numbers = {doc_id: number for number, doc_id in enumerate(self.doc_ids)}
+            self.doc_lengths = array("I", np.frombuffer(self.doc_lengths, dtype=np.uint32)[live].tobytes())
+            self.payloads = [payload for payload, is_live in zip(self.payloads, live) if is_live]
+            self.live = bytearray(b"\x01" * len(self.doc_ids))
+            self.removed = 0
+
+    def search(self, query: str, limit: int = 5, filters: Optional[Dict] = None) -> List[Tuple[str, float]]:
+        """The limit best (doc_id, score) pairs; filters must match the payload's "filters" entry."""
+        with self.lock:
+            count = len(self.doc_numbers)
+            if count == 0 or limit <= 0:
+                return []
+            live = np.frombuffer(bytes(self.live), dtype=np.uint8).astype(bool)
+            lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32).astype(np.float32)
+            average_length = self.total_length / count or 1.0
+            scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+            for term in set(tokenize(query)):
+                if term not in self.postings:
+                    continue
+                docs, frequencies = self.postings[term]
+                docs = np.frombuffer(docs, dtype=np.uint32).copy()
+                frequencies = np.frombuffer(frequencies, dtype=np.uint16).astype(np.float32)
+                document_frequency = int(live[docs].sum())
+                idf = math.log(1 + (count - document_frequency + 0.5) / (document_frequency + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * lengths[docs] / average_length)
+                scores[docs] += idf * frequencies * (self.k1 + 1) / (frequencies + norm)
+            scores[~live] = 0
+            if filters:
+                for number in np.flatnonzero(scores):
+                    doc_filters = (self.payloads[number] or {}).get("filters") or {}
+                    if any(doc_filters.get(key) != value for key, value in filters.items()):
+                        scores[number] = 0
+            candidates = np.flatnonzero(scores > 0)
+            if candidates.size > limit:
+                candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+            candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+            return [(self.doc_ids[number], float(scores[number])) for number in candidates]
+
+    def payload(self, doc_id: str) -> Optional[Dict]:
+        with self.lock:
+            number = self.doc_numbers.get(doc_id)
+            return self.payloads[number] if number is not None else None
+
+    def save(self, path: Path):
+        """Write the index atomically."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            state = {key: getattr(self, key) for key in
+                     ("k1", "b", "doc_ids", "doc_lengths", "live", "payloads", "postings", "total_length", "removed")}
+            tmp_path = path.with_suffix(path.suffix + ".tmp")
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        index = cls(state.pop("k1"), state.pop("b"))
+        for key, value in state.items():
+            setattr(index, key, value)
+        index.doc_numbers = {doc_id: number for number, doc_id in enumerate(index.doc_ids) if doc_id is not None}
+        return index
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60,
+                           weights: Optional[Sequence[float]] = None) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists: score(id) = sum of weight / (k + rank)."""
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def linear_fusion(results: Sequence[Sequence[Tuple[str, float]]],
+                  weights: Optional[Sequence[float]] = None) -> List[Tuple[str, float]]:
+    """Fuse scored lists: min-max normalize each list, then sum the weighted scores."""
+    weights = weights or [1.0] * len(results)
+    scores: Dict[str, float] = {}
+    for scored, weight in zip(results, weights):
+        if not scored:
+            continue
+        values = [score for _, score in scored]
+        low, high = min(values), max(values)
+        for doc_id, score in scored:
+            normalized = (score - low) / (high - low) if high > low else 1.0
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight * normalized
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
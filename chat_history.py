@@ -0,0 +1,168 @@
+"""
+Bounded chat history of the RAG API sessions.
+
+Each session keeps only its last RAG_CHAT_HISTORY_MEMORY messages in memory, in a ring
+buffer, so memory per session stays constant however long the server runs. Every
+message is also appended to a SQLite store (kb_cache/chat_history.db) from which older
+pages are read. Messages are numbered per conversation; /initialize/ starts a new
+conversation. Pages are read forward from a cursor (the id of the last message seen).
+
+The store is pruned as it is written: each session keeps at most RAG_CHAT_HISTORY_MAX_ROWS
+stored messages (its oldest are deleted first), and messages older than
+RAG_CHAT_HISTORY_TTL_S seconds are dropped; 0 disables either limit. Pruning runs every
+PRUNE_EVERY appends of a session, so a session may briefly exceed its cap by that much.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+CHAT_HISTORY_PATH = Path(os.getenv("RAG_CHAT_HISTORY_DB", Path(__file__).parent / "kb_cache" / "chat_history.db"))
+CHAT_HISTORY_MEMORY = int(os.getenv("RAG_CHAT_HISTORY_MEMORY", "50"))
+CHAT_HISTORY_MAX_ROWS = int(os.getenv("RAG_CHAT_HISTORY_MAX_ROWS", "10000"))
+CHAT_HISTORY_TTL_S = float(os.getenv("RAG_CHAT_HISTORY_TTL_S", str(30 * 24 * 3600)))
+PRUNE_EVERY = 100
+MAX_PAGE_SIZE = 500
+
+
+def message_metadata(message: Dict) -> Dict:
+    return {key: message[key] for key in ("id", "role", "length", "created_at")}
+
+
+class ChatHistoryStore:
+    """SQLite store of the messages of every conversation, capped per session and by age."""
+
+    def __init__(self, db_path: Path = CHAT_HISTORY_PATH, max_rows: int = CHAT_HISTORY_MAX_ROWS,
+                 ttl_s: float = CHAT_HISTORY_TTL_S):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_rows = max_rows
+        self.ttl_s = ttl_s
+        self._local = threading.local()
+        self._appends: Dict[str, int] = {}
+        self._appends_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    conversation_id TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    session_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (conversation_id, id)
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS messages_created_at ON messages (created_at)')
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; appends happen on the request path
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def append(self, conversation_id: str, session_id: str, message: Dict):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO messages (conversation_id, id, session_id, role, content, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (conversation_id, message["id"], session_id, message["role"], message["content"], message["created_at"]),
+            )
+            with self._appends_lock:
+                appends = self._appends.get(session_id, 0)
+                self._appends[session_id] = (appends + 1) % PRUNE_EVERY
+            # Also on the first append of a session, so restarts don't postpone it
+            if appends == 0:
+                self._prune(conn, session_id)
+
+    def _prune(self, conn: sqlite3.Connection, session_id: str):
+        if self.ttl_s > 0:
+            conn.execute('DELETE FROM messages WHERE created_at < ?', (time.time() - self.ttl_s,))
+        if self.max_rows > 0:
+            # Rowids grow with insertion order, so the oldest messages of the session go first
+            conn.execute(
+                'DELETE FROM messages WHERE session_id = ? AND rowid <= ('
+                'SELECT rowid FROM messages WHERE session_id = ? ORDER BY rowid DESC LIMIT 1 OFFSET ?)',
+                (session_id, session_id, self.max_rows),
+            )
+
+    def page(self, conversation_id: str, cursor: int, limit: int, metadata_only: bool = False) -> List[Dict]:
+        """Messages with an id greater than cursor, oldest first."""
+        content = "length(content)" if metadata_only else "content"
+        rows = self._connect().execute(
+            f'SELECT id, role, {content}, created_at FROM messages '
+            'WHERE conversation_id = ? AND id > ? ORDER BY id LIMIT ?',
+            (conversation_id, cursor, limit),
+        ).fetchall()
+        if metadata_only:
+            return [{"id": id, "role": role, "length": length, "created_at": created_at}
+                    for id, role, length, created_at in rows]
+        return [{"id": id, "role": role, "content": text, "length": len(text), "created_at": created_at}
+                for id, role, text, created_at in rows]
+
+
+class ChatHistory:
+    """Chat messages of one session: a ring buffer of the latest ones over the persistent store."""
+
+    def __init__(self, session_id: str, store: Optional[ChatHistoryStore] = None,
+                 max_in_memory: int = CHAT_HISTORY_MEMORY):
+        self.session_id = session_id
+        self.store = store
+        self.recent: deque = deque(maxlen=max(max_in_memory, 1))
+        self.conversation_id = uuid4().hex
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def reset(self, greeting: Optional[str] = None):
+        """Start a new conversation (optionally with an assistant greeting); earlier ones stay in the store."""
+        with self._lock:
+            self.recent.clear()
+            self.conversation_id = uuid4().hex
+            self.count = 0
+        if greeting is not None:
+            self.append("assistant", greeting)
+
+    def append(self, role: str, content: str):
+        if not isinstance(content, str):
+            content = "" if content is None else str(content)
+        with self._lock:
+            message = {"id": self.count + 1, "role": role, "content": content, "length": len(content),
+                       "created_at": time.time()}
+            self.count += 1
+            self.recent.append(message)
+            conversation_id = self.conversation_id
+        if self.store is not None:
+            self.store.append(conversation_id, self.session_id, message)
+
+    def page(self, cursor: int = 0, limit: int = 100, metadata_only: bool = False) -> Dict:
+        """
+        Up to limit messages after the message with id cursor, oldest first, with the cursor
+        of the next page (None once the end is reached). Pages within the ring buffer are
+        served from memory, older ones from the store.
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        cursor = max(cursor, 0)
+        with self._lock:
+            first_in_memory = self.recent[0]["id"] if self.recent else self.count + 1
+            total = self.count
+            conversation_id = self.conversation_id
+            if cursor + 1 >= first_in_memory or self.store is None:
+                messages = [message for message in self.recent if message["id"] > cursor][:limit]
+                if metadata_only:
+                    messages = [message_metadata(message) for message in messages]
+                else:
+                    messages = [dict(message) for message in messages]
+            else:
+                messages = None
+        if messages is None:
+            messages = self.store.page(conversation_id, cursor, limit, metadata_only)
+        next_cursor = messages[-1]["id"] if messages and messages[-1]["id"] < total else None
+        return {"messages": messages, "next_cursor": next_cursor, "total": total}
@@ -0,0 +1,124 @@
+"""
+Heading-aware chunking for the knowledge-base ingestion path.
+
+Scraped pages are converted to text with markdown-style heading lines, so the same
+chunker handles web pages and uploaded Markdown. Chunks never cross a heading, are
+packed up to chunk_size characters on line boundaries, and repeat the trailing
+overlap characters of the previous chunk of the same section.
+"""
+import re
+from typing import List, Tuple
+
+from bs4 import BeautifulSoup
+from phi.document import Document
+from phi.document.chunking.strategy import ChunkingStrategy
+
+HEADING = re.compile(r"^(#{1,6})\s+(.*\S)\s*$")
+FENCE = re.compile(r"^\s*(```|~~~)")
+
+
+def html_to_text(soup: BeautifulSoup) -> str:
+    """Extract the readable text of a page, keeping headings as '#' lines."""
+    # Clean text (remove scripts/styles/nav)
+    for tag in soup(["script", "style", "nav", "footer"]):
+        tag.decompose()
+    for level in range(1, 7):
+        for heading in soup.find_all(f"h{level}"):
+            title = heading.get_text(" ", strip=True)
+            heading.replace_with(soup.new_string(f"\n{'#' * level} {title}\n" if title else ""))
+    return soup.get_text(separator='\n', strip=True)
+
+
+class HeadingChunking(ChunkingStrategy):
+    """Split a document on its headings, then pack every section into overlapping chunks."""
+
+    def __init__(self, chunk_size: int = 1500, overlap: int = 200):
+        # overlap must be lesser than chunk size
+        if overlap >= chunk_size:
+            raise ValueError(f"Invalid parameters: overlap ({overlap}) must be less than chunk size ({chunk_size}).")
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+
+    @property
+    def profile(self) -> str:
+        """Identifies the chunking parameters, since different parameters produce different rows."""
+        return f"heading-{self.chunk_size}-{self.overlap}"
+
+    def chunk(self, document: Document) -> List[Document]:
+        chunked_documents: List[Document] = []
+        chunk_number = 1
+        for section, lines in self.split_sections(document.content):
+            # The heading path is repeated in every chunk and counts towards its size
+            budget = max(self.chunk_size - len(section) - 1, self.overlap + 1)
+            for body in self.pack(lines, budget):
+                content = f"{section}\n{body}" if section else body
+                meta_data = document.meta_data.copy()
+                meta_data["section"] = section
+                meta_data["chunk"] = chunk_number
+                meta_data["chunk_size"] = len(content)
+                chunked_documents.append(Document(name=document.name, meta_data=meta_data, content=content))
+                chunk_number += 1
+        return chunked_documents
+
+    @staticmethod
+    def split_sections(text: str) -> List[Tuple[str, List[str]]]:
+        """Group lines under their heading path, e.g. 'Troubleshooting > Pods'."""
+        sections: List[Tuple[str, List[str]]] = []
+        path: List[Tuple[int, str]] = []
+        lines: List[str] = []
+        in_fence = False
+
+        def flush():
+            if any(line.strip() for line in lines):
+                sections.append((" > ".join(title for _, title in path), list(lines)))
+            lines.clear()
+
+        for line in text.splitlines():
+            if FENCE.match(line):
+                in_fence = not in_fence
+            heading = None if in_fence else HEADING.match(line)
+            if heading:
+                flush()
+                level = len(heading.group(1))
+                path = [(lvl, title) for lvl, title in path if lvl < level]
+                path.append((level, heading.group(2)))
+            else:
+                lines.append(line)
+        flush()
+        return sections
+
+    def pack(self, lines: List[str], chunk_size: int) -> List[str]:
+        """Pack lines into chunks of at most chunk_size characters with a line-aligned overlap."""
+        pieces: List[str] = []
+        for line in lines:
+            # Lines longer than a chunk are split on whitespace
+            while len(line) > chunk_size:
+                cut = line.rfind(" ", 0, chunk_size)
+                cut = cut if cut > 0 else chunk_size
+                pieces.append(line[:cut])
+                line = line[cut:].lstrip()
+            pieces.append(line)
+
+        chunks: List[str] = []
+        current: List[str] = []
+        size = 0
+        for piece in pieces:
+            if current and size + len(piece) + 1 > chunk_size:
+                chunks.append("\n".join(current))
+                # Carry the last lines of the previous chunk over, up to `overlap` characters
+                carried: List[str] = []
+                carried_size = 0
+                for previous in reversed(current):
+                    if carried_size + len(previous) + 1 > self.overlap:
+                        break
+                    carried.insert(0, previous)
+                    carried_size += len(previous) + 1
+                # The carried lines give way to the next piece if both don't fit in one chunk
+                while carried and carried_size + len(piece) + 1 > chunk_size:
+                    carried_size -= len(carried.pop(0)) + 1
+                current, size = carried, carried_size
+            current.append(piece)
+            size += len(piece) + 1
+        if any(line.strip() for line in current):
+            chunks.append("\n".join(current))
+        return chunks
@@ -0,0 +1,265 @@
+"""
+Token-budgeted context assembly for the RAG agents.
+
+Knowledge searches used to hand the model num_documents whole documents; with
+whole-page documents that is tens of thousands of input tokens per question. The
+assembler retrieves a few more candidates instead, splits them into passages,
+drops passages that overlap ones already kept (chunk overlap, the same page under
+two URLs), ranks the rest by BM25 relevance to the query fused with the retrieval
+rank, and packs the best ones into RAG_CONTEXT_BUDGET_TOKENS tokens (e.g. 2000; the
+default 0 keeps assembly off). Passages are returned grouped per document, in
+document order.
+
+Tokens are counted locally: with tiktoken when it is installed, else with a regex
+approximation of a BPE tokenizer. Every search of a run is recorded in the thread's
+ContextUsage, which /ask/ reports.
+"""
+import math
+import os
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from phi.document import Document
+from phi.utils.log import logger
+
+from bm25 import BM25Index, reciprocal_rank_fusion
+
+# Opt-in: with 0 (the default) the agent gets num_documents whole documents as before
+CONTEXT_BUDGET_TOKENS = int(os.getenv("RAG_CONTEXT_BUDGET_TOKENS", "0"))
+# Documents retrieved per search before passages are ranked and packed
+CONTEXT_CANDIDATES = int(os.getenv("RAG_CONTEXT_CANDIDATES", "8"))
+CONTEXT_PASSAGE_TOKENS = int(os.getenv("RAG_CONTEXT_PASSAGE_TOKENS", "200"))
+# Passages sharing this fraction of their shingles with a kept passage are duplicates
+CONTEXT_DEDUPE_THRESHOLD = float(os.getenv("RAG_CONTEXT_DEDUPE", "0.8"))
+CONTEXT_TOKENIZER = os.getenv("RAG_CONTEXT_TOKENIZER", "auto")
+
+PIECES = re.compile(r"\s*[A-Za-z]+|\s*\d{1,3}|\s*[^\sA-Za-z\d]|\s+")
+PARAGRAPHS = re.compile(r"\n\s*\n")
+WORDS = re.compile(r"\w+")
+SHINGLE_SIZE = 5
+
+
+def _regex_token_count(text: str) -> int:
+    """Approximate BPE count: digits in groups of 3, punctuation alone, long words split every ~6 letters."""
+    count = 0
+    for piece in PIECES.findall(text):
+        letters = len(piece.strip())
+        count += max(1, math.ceil(letters / 6)) if letters > 4 and piece.strip().isalpha() else 1
+    return count
+
+
+def _load_tokenizer():
+    if CONTEXT_TOKENIZER in ("auto", "tiktoken"):
+        try:
+            import tiktoken
+
+            encoding = tiktoken.get_encoding(os.getenv("RAG_CONTEXT_ENCODING", "cl100k_base"))
+            return "tiktoken", lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception as e:
+            if CONTEXT_TOKENIZER == "tiktoken":
+                logger.warning(f"tiktoken unavailable ({e}), counting tokens with the regex tokenizer")
+    return "regex", _regex_token_count
+
+
+TOKENIZER_NAME, count_tokens = _load_tokenizer()
+
+
+@dataclass
+class Passage:
+    doc_rank: int
+    position: int
+    content: str
+    tokens: int
+    shingles: frozenset = field(repr=False)
+
+
+@dataclass
+class ContextUsage:
+    """Context spent by the knowledge searches of one run."""
+
+    searches: int = 0
+    candidates: int = 0
+    passages: int = 0
+    duplicates: int = 0
+    selected: int = 0
+    candidate_tokens: int = 0
+    context_tokens: int = 0
+
+    def add(self, stats: Dict[str, int]):
+        for name in ("candidates", "passages", "duplicates", "selected", "candidate_tokens", "context_tokens"):
+            setattr(self, name, getattr(self, name) + stats.get(name, 0))
+        self.searches += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "searches": self.searches,
+            "budget_tokens": CONTEXT_BUDGET_TOKENS,
+            "tokenizer": TOKENIZER_NAME,
+            "candidates": self.candidates,
+            "passages": self.passages,
+            "duplicates": self.duplicates,
+            "selected": self.selected,
+            "candidate_tokens": self.candidate_tokens,
+            "context_tokens": self.context_tokens,
+        }
+
+
+_local = threading.local()
+
+
+@contextmanager
+def context_usage() -> Iterator[ContextUsage]:
+    """Collect the context spent by the agent runs in this block (on this thread)."""
+    usage = ContextUsage()
+    previous = getattr(_local, "usage", None)
+    _local.usage = usage
+    try:
+        yield usage
+    finally:
+        _local.usage = previous
+
+
+def _shingles(text: str) -> frozenset:
+    """Hashed word 5-grams; only compared within one assembly, so the process-local hash() is enough."""
+    words = WORDS.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return frozenset([hash(tuple(words))]) if words else frozenset()
+    return frozenset(hash(tuple(words[i:i + SHINGLE_SIZE])) for i in range(len(words) - SHINGLE_SIZE + 1))
+
+
+def _split_long(text: str, max_tokens: int) -> List[Tuple[str, int]]:
+    """Split a line without breaks (minified text, long tables) into word windows of at most max_tokens."""
+    pieces: List[Tuple[str, int]] = []
+    words: List[str] = []
+    tokens = 0
+    for word in text.split():
+        word_tokens = count_tokens(" " + word)
+        if words and tokens + word_tokens > max_tokens:
+            pieces.append((" ".join(words), tokens))
+            words, tokens = [], 0
+        words.append(word)
+        tokens += word_tokens
+    if words:
+        pieces.append((" ".join(words), tokens))
+    return pieces
+
+
+def split_passages(text: str, max_tokens: int = CONTEXT_PASSAGE_TOKENS) -> List[Tuple[str, int]]:
+    """Split text on blank lines (then lines) and pack the pieces into passages of at most max_tokens."""
+    pieces: List[Tuple[str, int]] = []
+    for paragraph in PARAGRAPHS.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        tokens = count_tokens(paragraph)
+        if tokens <= max_tokens:
+            pieces.append((paragraph, tokens))
+        else:
+            for line in paragraph.splitlines():
+                if line.strip():
+                    line_tokens = count_tokens(line)
+                    pieces.extend([(line, line_tokens)] if line_tokens <= max_tokens else _split_long(line, max_tokens))
+
+    passages: List[Tuple[str, int]] = []
+    current: List[str] = []
+    current_tokens = 0
+    for piece, tokens in pieces:
+        if current and current_tokens + tokens > max_tokens:
+            passages.append(("\n\n".join(current), current_tokens))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        passages.append(("\n\n".join(current), current_tokens))
+    return passages
+
+
+def assemble(query: str, documents: List[Document], budget_tokens: int = CONTEXT_BUDGET_TOKENS,
+             passage_tokens: int = CONTEXT_PASSAGE_TOKENS,
+             dedupe_threshold: float = CONTEXT_DEDUPE_THRESHOLD) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Pack the most relevant, non-overlapping passages of documents (in retrieval order)
+    into budget_tokens. Returns one reference dict per document that kept a passage,
+    and the assembly stats.
+    """
+    passages: List[Passage] = []
+    # shingle -> kept passages containing it, so overlaps are counted without comparing every pair
+    owners: Dict[Any, List[int]] = {}
+    duplicates = 0
+    candidate_tokens = 0
+    for doc_rank, doc in enumerate(documents):
+        for position, (content, tokens) in enumerate(split_passages(doc.content, passage_tokens)):
+            candidate_tokens += tokens
+            shingles = _shingles(content)
+            shared = Counter(number for shingle in shingles for number in owners.get(shingle, ()))
+            # Overlap relative to the smaller passage, so a passage contained in a kept one is a duplicate
+            if any(
+                count / min(len(shingles), len(passages[number].shingles)) >= dedupe_threshold
+                for number, count in shared.items()
+            ):
+                duplicates += 1
+                continue
+            for shingle in shingles:
+                owners.setdefault(shingle, []).append(len(passages))
+            passages.append(Passage(doc_rank, position, content, tokens, shingles))
+
+    # Relevance of the passage to the query, fused with the rank of its document
+    index = BM25Index()
+    for number, passage in enumerate(passages):
+        index.add(str(number), passage.content)
+    lexical = [doc_id for doc_id, _ in index.search(query, limit=len(passages))]
+    retrieval = [str(number) for number in range(len(passages))]
+    ranked = [int(doc_id) for doc_id, _ in reciprocal_rank_fusion([lexical, retrieval])]
+
+    selected: List[Passage] = []
+    spent = 0
+    for number in ranked:
+        passage = passages[number]
+        # Greedy packing: a passage that does not fit leaves room for smaller, lower-ranked ones
+        if spent + passage.tokens <= budget_tokens:
+            selected.append(passage)
+            spent += passage.tokens
+
+    references = []
+    for doc_rank, doc in enumerate(documents):
+        kept = sorted((passage for passage in selected if passage.doc_rank == doc_rank), key=lambda p: p.position)
+        if kept:
+            references.append({
+                "name": doc.name,
+                "meta_data": doc.meta_data,
+                "content": "\n...\n".join(passage.content for passage in kept),
+            })
+    stats = {
+        "candidates": len(documents),
+        "passages": len(passages) + duplicates,
+        "duplicates": duplicates,
+        "selected": len(selected),
+        "candidate_tokens": candidate_tokens,
+        "context_tokens": spent,
+    }
+    return references, stats
+
+
+def budgeted_retriever(agent, query: str, num_documents: Optional[int] = None, **kwargs) -> Optional[List[Dict]]:
+    """phi Agent retriever: search CONTEXT_CANDIDATES documents and return the assembled context."""
+    if agent.knowledge is None:
+        return None
+    if CONTEXT_BUDGET_TOKENS <= 0:
+        documents = agent.knowledge.search(query=query, num_documents=num_documents, **kwargs)
+        references = [doc.to_dict() for doc in documents]
+        stats = {"candidates": len(documents), "selected": len(documents),
+                 "context_tokens": sum(count_tokens(doc.content) for doc in documents)}
+    else:
+        candidates = max(num_documents or agent.knowledge.num_documents, CONTEXT_CANDIDATES)
+        documents = agent.knowledge.search(query=query, num_documents=candidates, **kwargs)
+        references, stats = assemble(query, documents)
+        logger.debug(f"Context for '{query[:60]}': {stats['selected']} passages, "
+                     f"{stats['context_tokens']}/{stats['candidate_tokens']} tokens")
+    usage = getattr(_local, "usage", None)
+    if usage is not None:
+        usage.add(stats)
+    return references or None
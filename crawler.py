@@ -0,0 +1,99 @@
+"""
+Concurrent crawler for knowledge sources.
+
+Pages are fetched over one pooled requests.Session (keep-alive connections are
+reused across pages of the same site), with a timeout on every request. A crawl
+starts from a list of seed URLs and follows links breadth first: every depth level
+is fetched concurrently, up to max_depth levels and max_links followed links.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urldefrag, urljoin, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+from phi.utils.log import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Headers from your working manual test
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+
+def extract_links(soup: BeautifulSoup, base_url: str) -> List[str]:
+    """Absolute http(s) links of a page on the same host, without fragments, in page order."""
+    host = urlparse(base_url).netloc
+    links = []
+    for anchor in soup.find_all("a", href=True):
+        link, _ = urldefrag(urljoin(base_url, anchor["href"]))
+        parsed = urlparse(link)
+        if parsed.scheme in ("http", "https") and parsed.netloc == host and link not in links:
+            links.append(link)
+    return links
+
+
+class Crawler:
+    def __init__(self, max_workers: int = 8, timeout: float = 30.0, retries: int = 2):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': USER_AGENT})
+        adapter = HTTPAdapter(
+            pool_connections=max_workers,
+            pool_maxsize=max_workers,
+            max_retries=Retry(total=retries, backoff_factor=0.5, status_forcelist=[502, 503, 504],
+                              allowed_methods=["GET", "HEAD"]),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="crawler")
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        return self.session.get(url, headers=headers, timeout=self.timeout)
+
+    def crawl(self, seeds: List[str], ingest: Callable[[str], Dict], max_depth: int = 0,
+              max_links: int = 0) -> List[Dict]:
+        """
+        Run ingest(url) for every seed and every followed link; returns one report per page.
+
+        ingest returns a dict describing the page; its "links" entry (if any) is used to
+        discover the next level and is not included in the report.
+        """
+        frontier = list(dict.fromkeys(seeds))
+        seen = set(frontier)
+        followed = 0
+        reports: List[Dict] = []
+        depth = 0
+        while frontier:
+            started_at = time.perf_counter()
+            futures = {self.executor.submit(ingest, url): url for url in frontier}
+            page_links: Dict[str, List[str]] = {}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    result = dict(future.result())
+                except Exception as e:
+                    logger.warning(f"Could not ingest {url}: {e}")
+                    reports.append({"url": url, "depth": depth, "status": "error", "error": str(e)})
+                    continue
+                page_links[url] = result.pop("links", None) or []
+                reports.append({"url": url, "depth": depth, "status": "ok", **result})
+            # Follow links in page order so a capped crawl is deterministic
+            discovered = [link for url in frontier for link in page_links.get(url, [])] if depth < max_depth else []
+            logger.info(f"Crawled {len(frontier)} pages at depth {depth} in {time.perf_counter() - started_at:.2f}s")
+
+            frontier = []
+            for link in discovered:
+                if followed >= max_links:
+                    break
+                if link not in seen:
+                    seen.add(link)
+                    frontier.append(link)
+                    followed += 1
+            depth += 1
+        return reports
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
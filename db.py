@@ -0,0 +1,109 @@
+"""
+Process-wide SQLAlchemy engines.
+
+Every component that talks to Postgres (api_server, the agents' PgVector knowledge
+and PgAgentStorage, knowledge-base snapshots and indexes) gets its engine from
+get_engine(), so a process holds one connection pool per database URL instead of
+one per PgVector/storage object. The pool is tunable through RAG_DB_* variables and
+records how long every checkout waited for a connection, which makes connection
+starvation under concurrency visible (pool_stats()).
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+DB_URL = os.getenv("RAG_DB_URL", "postgresql+psycopg://ai:ai@localhost:5532/ai")
+DB_POOL_SIZE = int(os.getenv("RAG_DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("RAG_DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT_S = float(os.getenv("RAG_DB_POOL_TIMEOUT_S", "30"))
+# Connections older than this are replaced; pre-ping tests a connection before handing it out
+DB_POOL_RECYCLE_S = int(os.getenv("RAG_DB_POOL_RECYCLE_S", "1800"))
+DB_POOL_PRE_PING = os.getenv("RAG_DB_POOL_PRE_PING", "1") == "1"
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records the wait of every checkout (including pre-ping and new connections)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait_s = 0.0
+        self.max_wait_s = 0.0
+        self.recent_waits: deque = deque(maxlen=1000)
+
+    def connect(self):
+        started_at = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started_at
+            with self._stats_lock:
+                self.checkouts += 1
+                self.total_wait_s += waited
+                self.max_wait_s = max(self.max_wait_s, waited)
+                self.recent_waits.append(waited)
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            waits = np.array(self.recent_waits) * 1000
+            return {
+                "pool_size": self.size(),
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": self.overflow(),
+                "max_overflow": self._max_overflow,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "total_wait_s": round(self.total_wait_s, 6),
+                "avg_wait_ms": round(self.total_wait_s / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait_s * 1000, 3),
+                "p50_wait_ms": round(float(np.percentile(waits, 50)), 3) if waits.size else 0.0,
+                "p95_wait_ms": round(float(np.percentile(waits, 95)), 3) if waits.size else 0.0,
+                "p99_wait_ms": round(float(np.percentile(waits, 99)), 3) if waits.size else 0.0,
+            }
+
+
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(db_url: Optional[str] = None) -> Engine:
+    """The shared engine (and connection pool) of a database URL."""
+    db_url = db_url or DB_URL
+    with _engines_lock:
+        engine = _engines.get(db_url)
+        if engine is None:
+            engine = _engines[db_url] = create_engine(
+                db_url,
+                poolclass=TimedQueuePool,
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT_S,
+                pool_recycle=DB_POOL_RECYCLE_S,
+                pool_pre_ping=DB_POOL_PRE_PING,
+            )
+        return engine
+
+
+def pool_stats() -> List[Dict]:
+    """Size, usage and checkout wait times of every pool of this process."""
+    with _engines_lock:
+        engines = list(_engines.values())
+    return [
+        {"url": engine.url.render_as_string(hide_password=True), **engine.pool.stats()}
+        for engine in engines if isinstance(engine.pool, TimedQueuePool)
+    ]
@@ -22,15 +22,26 @@ from phi.agent import AgentKnowledge
 from phi.vectordb.pgvector import PgVector, SearchType
 from phi.storage.agent.postgres import PgAgentStorage
 from phi.knowledge.website import WebsiteKnowledgeBase
+from phi.embedder.openai import OpenAIEmbedder
+from pathlib import Path
+# The shared storage modules (embedding_cache, vector_store, ...) live in the repo root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from embedding_cache import CachedEmbedder
+from vector_store import get_vector_db
 
 
 from rag_api import (
     BASE_URL,
     initialize_assistant,
     ask_question,
+    ask_question_stream,
+    iter_bash_blocks,
     add_url,
+    add_urls,
     upload_pdf,
     clear_knowledge_base,
+    create_snapshot,
+    switch_snapshot,
     get_chat_history,
     start_new_run
 )
@@ -68,29 +79,63 @@ class AgentAPI(Agent):
     def __init__(self, agentType, config):
         super().__init__(agentType, config)
         self.response = None
+        # Queue wait / execution time reported by the RAG server for the last question
+        self.timings = None
+        # Commands of the ```bash blocks seen while streaming the answer (None when not streaming)
+        self.bashCommands = None
+        # Private session on the RAG server, so concurrent runs do not share an agent
+        self.sessionId = None
 
     def prepareAgent(self):
         """ Prepare the API Agent based on the config specifications """
         try:
-            if self.agentProperties["new-run"]:
-                new_run_response = start_new_run()
+            if self.agentProperties["new-run"] and self.sessionId is not None:
+                new_run_response = start_new_run(self.sessionId)
                 print("New Run Response:", new_run_response)
+                self.sessionId = None
             
-            initialize_response = initialize_assistant(self.agentProperties["model"], self.agentProperties["embedder"] )
+            initialize_response = initialize_assistant(self.agentProperties["model"], self.agentProperties["embedder"],
+                                                       session_id=self.sessionId, new_session=self.sessionId is None)
             print("Initialize Response:", initialize_response)
-
-            if self.agentProperties["clear-knowledge"]:
-                clear_kb_response = clear_knowledge_base()
+            self.sessionId = initialize_response["session_id"]
+
+            # A named snapshot is prepared once; later runs switch to it instead of reloading
+            snapshotName = self.agentProperties.get("kb-snapshot")
+            if snapshotName:
+                switch_response = switch_snapshot(snapshotName, session_id=self.sessionId)
+                print("Switch Knowledge Base Response:", switch_response)
+                if switch_response.get("snapshot"):
+                    return
+                create_response = create_snapshot(snapshotName, session_id=self.sessionId)
+                print("Create Snapshot Response:", create_response)
+            elif self.agentProperties["clear-knowledge"]:
+                clear_kb_response = clear_knowledge_base(self.sessionId)
                 print("Clear Knowledge Base Response:", clear_kb_response)
             
-            for source in self.agentProperties.get("knowledge", []):
-                add_url_response = add_url(source)
-                print("Add URL Response:", add_url_response)
+            knowledgeSources = self.agentProperties.get("knowledge", [])
+            if knowledgeSources:
+                add_urls_response = add_urls(knowledgeSources,
+                                             max_depth=self.agentProperties.get("knowledge-depth", 0),
+                                             max_links=self.agentProperties.get("knowledge-max-links", 0),
+                                             session_id=self.sessionId)
+                print("Add URLs Response:", add_urls_response.get("summary", add_urls_response))
             
         except Exception as e:
             print(f"Error preparing knowledge agent (API Agent): {e}")
+            self.endSession()
             sys.exit()
 
+    def endSession(self):
+        """ End the private session on the RAG server, so its agent goes back to the server's pool """
+        if self.sessionId is None:
+            return
+        try:
+            new_run_response = start_new_run(self.sessionId)
+            print("New Run Response:", new_run_response)
+        except Exception as e:
+            print(f"Error ending knowledge agent session: {e}")
+        self.sessionId = None
+
     def preparePrompt(self):
         """ Prepare the knowledge prompt according to the config file """
         try:
@@ -103,15 +148,54 @@ class AgentAPI(Agent):
             print(f"Error creating knowledge (API) agent prompt: {e}")
             sys.exit()
 
-    def askQuestion(self):
+    def askQuestion(self, onStep=None):
         """ Ask the formatted prepared question to the knowledge (API) agent """
+        if self.agentProperties.get("stream"):
+            return self.askQuestionStreaming(onStep)
         try:
-            self.response = ask_question(self.prompt)
+            self.response = ask_question(self.prompt, self.sessionId, cache=self.agentProperties.get("answer-cache", "off"))
+            self.timings = self.response.pop("timings", None)
+            print("Knowledge agent answer cache:", self.response.pop("cache", None))
+            self.response.pop("similarity", None)
+            # Token-budget stats of the retrieved context; not part of the answer given to the debug agent
+            print("Knowledge agent context:", self.response.pop("context", None))
+            print("Knowledge agent timings:", self.timings)
             #print("RAG assistant Response:", self.response)
         except Exception as e:
             print(f"Error asking question to knowledge agent: {e}")
             sys.exit()
 
+    def askQuestionStreaming(self, onStep=None):
+        """
+        Stream the answer of the knowledge (API) agent, collecting bash steps as soon as they are complete;
+        onStep(command) is called with every step while the rest of the answer is still arriving
+        """
+        try:
+            chunks = []
+
+            def deltas():
+                for event, data in ask_question_stream(self.prompt, self.sessionId):
+                    if event == "token":
+                        chunks.append(data["delta"])
+                        yield data["delta"]
+                    elif event == "done":
+                        self.timings = data["timings"]
+                    elif event == "error":
+                        raise Exception(data["detail"])
+
+            self.bashCommands = []
+            for command in iter_bash_blocks(deltas()):
+                print(f"Knowledge agent step ready: {command}")
+                self.bashCommands.append(command)
+                if onStep is not None:
+                    onStep(command)
+
+            self.response = {"response": "".join(chunks)}
+            print("Knowledge agent timings:", self.timings)
+        except Exception as e:
+            print(f"Error asking question to knowledge agent: {e}")
+            sys.exit()
+
 
 class AgentDebug(Agent):
     def __init__(self, agentType, config):
@@ -274,10 +358,15 @@ class AgentDebugStepByStep(Agent):
             print(f"Error creating debug agent prompt: {e}")
             sys.exit()
 
-    def formProblemSolvingSteps(self):
+    def formProblemSolvingSteps(self, bashCommands=None):
         """ From the resonse generate a list of steps that the debug agent will execute one by one """
         self.steps = []
 
+        # Steps already collected while the knowledge agent's answer was streaming
+        if bashCommands is not None:
+            self.steps = list(bashCommands)
+            return
+
         try:    
             knowledgeAIRespnseString = str(self.agentAPIResponse)
 
@@ -294,8 +383,11 @@ class AgentDebugStepByStep(Agent):
 
     @withTimeout(False)
     @timeout_decorator.timeout(480)
-    def executeProblemSteps(self):
-        """ Once we have formed all of the steps based on the knowledge agent, then we can start to execute each step one by one """
+    def executeProblemSteps(self, steps=None):
+        """
+        Once we have formed all of the steps based on the knowledge agent, then we can start to execute each step one by one.
+        steps (an iterable of steps still arriving, e.g. while the knowledge agent's answer streams) replaces self.steps
+        """
         # Define tool usage rules once
         tool_rules = (
            "### Tool Usage Rules\n"
@@ -306,14 +398,21 @@ class AgentDebugStepByStep(Agent):
         )
 
         try:
-            numSteps = len(self.steps)
-            for i, step in enumerate(self.steps, start=1):
+            numSteps = len(self.steps) if steps is None else None
+            if steps is not None:
+                self.steps = []
+            for i, step in enumerate(self.steps if steps is None else steps, start=1):
+                if steps is not None:
+                    self.steps.append(step)
                 prompt = f'Perform the action suggested here: \n{step}\n'
                 prompt += f'If you struggle within one of the steps try to figure out the solution until you see the pod running fine with kubectl describe.'
                 prompt += f"\nThe relevant configuration file is located in this path: {self.config['test-directory']+self.config['yaml-file-name']}\n"
                 prompt += "You can update these files if necessary. If any files are updated, make sure to delete and reapply the configuration file.\n"
                 prompt += "If you need to update a pod then use kubectl replace --force [POD_NAME]"
-                prompt += f"\nThis is step {i} out of {numSteps}."
+                if numSteps is not None:
+                    prompt += f"\nThis is step {i} out of {numSteps}."
+                else:
+                    prompt += f"\nThis is step {i}; the next steps are still being written."
                 prompt += "Do not use live feed flags when checking the logs such as 'kubectl logs -f'"
                 
                 # Append the tool usage rules
@@ -356,9 +455,11 @@ class SingleAgent(Agent):
                 # Number of links to follow from the seed URLs
                 max_links=10,
                 # Table name: ai.website_documents
-                vector_db=PgVector(
+                vector_db=get_vector_db(
                     table_name="ai.local_rag_documents_singleAgent",
                     db_url="postgresql+psycopg://ai:ai@localhost:5532/ai",
+                    # Pages and queries embedded in earlier runs are served from the local embedding cache
+                    embedder=CachedEmbedder(embedder=OpenAIEmbedder()),
                 ),
             )
 
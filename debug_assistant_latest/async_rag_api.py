@@ -0,0 +1,219 @@
+"""
+asyncio client of the RAG API server, with the operations of rag_api.py as coroutines.
+
+All calls share one httpx connection pool, and at most max_concurrency requests are
+in flight at a time, so a campaign runner can prepare and query many test cases
+concurrently against a multi-session server:
+
+    async with AsyncRagClient(max_concurrency=8) as rag:
+        async def prepare(case):
+            session = await rag.initialize_assistant(llm_model, embeddings_model, new_session=True)
+            await rag.add_url(case["url"], session_id=session["session_id"])
+            return await rag.ask_question(case["prompt"], session_id=session["session_id"], priority="batch")
+        answers = await asyncio.gather(*(prepare(case) for case in cases))
+
+Timeouts, retries and latency records work as in rag_api.RagClient; waiting for an
+ingestion job raises rag_api.JobTimeout after JOB_TIMEOUT_S seconds.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+
+import httpx
+
+from rag_api import (
+    BASE_URL,
+    CONNECT_TIMEOUT_S,
+    JOB_TIMEOUT_S,
+    READ_TIMEOUT_S,
+    RETRIES,
+    RETRY_STATUSES,
+    JobTimeout,
+    backoff_delay,
+    _with_session,
+)
+
+# Requests in flight at once; the server's admission control queues (or rejects) the rest of its load
+MAX_CONCURRENCY = int(os.getenv("RAG_API_MAX_CONCURRENCY", "8"))
+
+class AsyncRagClient:
+    def __init__(self, base_url: str = None, max_concurrency: int = MAX_CONCURRENCY,
+                 connect_timeout: float = CONNECT_TIMEOUT_S, read_timeout: float = READ_TIMEOUT_S,
+                 retries: int = RETRIES):
+        self.base_url = (base_url or BASE_URL).rstrip("/")
+        self.retries = retries
+        self.http = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.calls = deque(maxlen=10000)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    def _record(self, method: str, endpoint: str, status, started_at: float, attempts: int, error: str = None):
+        self.calls.append({
+            "timestamp": time.time(),
+            "method": method,
+            "endpoint": endpoint,
+            "status": status,
+            "duration_s": round(time.perf_counter() - started_at, 4),
+            "attempts": attempts,
+            "error": error,
+        })
+
+    async def _send(self, method: str, path: str, endpoint: str = None, stream: bool = False, **kwargs) -> httpx.Response:
+        """
+        Send a request, retrying like rag_api.RagClient.request. The caller must hold the
+        semaphore; with stream=True the response body is left unread (close it with aclose()).
+        """
+        endpoint = endpoint or path
+        idempotent = method == "GET"
+        started_at = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                request = self.http.build_request(method, path, **kwargs)
+                response = await self.http.send(request, stream=stream)
+            except httpx.TransportError as e:
+                # The request never reached the server
+                not_sent = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+                if attempt >= self.retries or not (idempotent or not_sent):
+                    self._record(method, endpoint, None, started_at, attempt + 1, type(e).__name__)
+                    raise
+                delay = backoff_delay(attempt)
+            else:
+                if (response.status_code not in RETRY_STATUSES or attempt >= self.retries
+                        or not (idempotent or response.status_code == 429)):
+                    self._record(method, endpoint, response.status_code, started_at, attempt + 1)
+                    return response
+                delay = backoff_delay(attempt, response)
+                await response.aclose()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def request(self, method: str, path: str, endpoint: str = None, **kwargs) -> httpx.Response:
+        async with self.semaphore:
+            return await self._send(method, path, endpoint, **kwargs)
+
+    async def _json(self, method: str, path: str, **kwargs):
+        response = await self.request(method, path, **kwargs)
+        return response.json()
+
+    def drain(self) -> list:
+        """Remove and return the latency records of the calls made so far (for metrics_db.store_api_calls)."""
+        calls = list(self.calls)
+        self.calls.clear()
+        return calls
+
+    async def initialize_assistant(self, llm_model: str, embeddings_model: str, session_id: str = None,
+                                   new_session: bool = False):
+        """Initialize the assistant; with new_session=True the returned "session_id" must be passed to the other calls."""
+        data = {"llm_model": llm_model, "embeddings_model": embeddings_model, "new_session": new_session}
+        return await self._json("POST", "/initialize/", data=_with_session(data, session_id))
+
+    async def ask_question(self, prompt: str, session_id: str = None, cache: str = "off", priority: str = "interactive"):
+        """Ask a question to the initialized assistant (see rag_api.ask_question)."""
+        data = {"prompt": prompt, "cache": cache, "priority": priority}
+        return await self._json("POST", "/ask/", data=_with_session(data, session_id))
+
+    async def ask_question_stream(self, prompt: str, session_id: str = None, priority: str = "interactive"):
+        """Async generator of the (event, data) server-sent events of an answer; holds a slot until it ends."""
+        data = {"prompt": prompt, "priority": priority}
+        async with self.semaphore:
+            response = await self._send("POST", "/ask_stream/", data=_with_session(data, session_id), stream=True)
+            try:
+                response.raise_for_status()
+                event = "message"
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:"):
+                        yield event, json.loads(line[len("data:"):].strip())
+            finally:
+                await response.aclose()
+
+    async def get_job(self, job_id: str):
+        """Status, progress and errors of a background ingestion job."""
+        return await self._json("GET", f"/jobs/{job_id}", endpoint="/jobs/{job_id}")
+
+    async def wait_for_job(self, job_id: str, timeout: float = JOB_TIMEOUT_S, poll_interval: float = 1.0):
+        """Poll an ingestion job until it is done or failed and return its status (JobTimeout after timeout seconds)."""
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            job = await self.get_job(job_id)
+            if job.get("status") in ("done", "failed", None):
+                return job
+            if deadline is not None and time.time() >= deadline:
+                raise JobTimeout(job, timeout)
+            await asyncio.sleep(poll_interval)
+
+    async def _job_response(self, result: dict, wait: bool, timeout: float = JOB_TIMEOUT_S):
+        if wait and "job_id" in result:
+            return await self.wait_for_job(result["job_id"], timeout)
+        return result
+
+    async def add_url(self, url: str, session_id: str = None, wait: bool = True, timeout: float = JOB_TIMEOUT_S):
+        """Add a URL to the knowledge base; wait=False returns the queued job right away."""
+        result = await self._json("POST", "/add_url/", data=_with_session({"url": url}, session_id))
+        return await self._job_response(result, wait, timeout)
+
+    async def add_urls(self, urls: list, max_depth: int = 0, max_links: int = 0, session_id: str = None):
+        """Crawl several URLs into the knowledge base in one request."""
+        data = {"urls": list(urls), "max_depth": max_depth, "max_links": max_links}
+        return await self._json("POST", "/add_urls/", data=_with_session(data, session_id))
+
+    async def _upload(self, path: str, file_path: str, session_id: str, wait: bool, timeout: float):
+        content = await asyncio.to_thread(lambda: open(file_path, "rb").read())
+        files = {"file": (os.path.basename(file_path), content)}
+        result = await self._json("POST", path, files=files, data=_with_session({}, session_id))
+        return await self._job_response(result, wait, timeout)
+
+    async def upload_pdf(self, file_path: str, session_id: str = None, wait: bool = True,
+                         timeout: float = JOB_TIMEOUT_S):
+        """Upload a PDF to the knowledge base; wait=False returns the queued job right away."""
+        return await self._upload("/upload_pdf/", file_path, session_id, wait, timeout)
+
+    async def upload_md(self, file_path: str, session_id: str = None, wait: bool = True,
+                        timeout: float = JOB_TIMEOUT_S):
+        """Upload a Markdown file to the knowledge base; wait=False returns the queued job right away."""
+        return await self._upload("/upload_md/", file_path, session_id, wait, timeout)
+
+    async def clear_knowledge_base(self, session_id: str = None):
+        """Clear the knowledge base of the session."""
+        return await self._json("POST", "/clear_knowledge_base/", data=_with_session({}, session_id))
+
+    async def create_snapshot(self, name: str, copy_current: bool = False, session_id: str = None):
+        """Create a new version of a named knowledge-base snapshot and switch to it."""
+        data = {"name": name, "copy_current": copy_current}
+        return await self._json("POST", "/kb/snapshots/", data=_with_session(data, session_id))
+
+    async def switch_snapshot(self, name: str = None, version: int = None, session_id: str = None):
+        """Switch to a prepared knowledge-base snapshot (no name: back to the base table)."""
+        data = {key: value for key, value in {"name": name, "version": version}.items() if value is not None}
+        return await self._json("POST", "/kb/switch/", data=_with_session(data, session_id))
+
+    async def list_snapshots(self, embeddings_model: str = None):
+        """List the knowledge-base snapshots."""
+        params = {"embeddings_model": embeddings_model} if embeddings_model else None
+        return await self._json("GET", "/kb/snapshots/", params=params)
+
+    async def get_chat_history(self, session_id: str = None, cursor: int = 0, limit: int = 100,
+                               metadata_only: bool = False):
+        """Retrieve a page of the chat history; pass the returned next_cursor to get the next page."""
+        params = {"cursor": cursor, "limit": limit, "metadata_only": metadata_only}
+        return await self._json("GET", "/chat_history/", params=_with_session(params, session_id))
+
+    async def start_new_run(self, session_id: str = None):
+        """Start a new run for the session."""
+        return await self._json("POST", "/new_run/", data=_with_session({}, session_id))
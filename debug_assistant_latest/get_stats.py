@@ -1,6 +1,6 @@
 import sqlite3
 import os
-from metrics_db import calculate_totals, get_model_stats
+from metrics_db import calculate_totals, get_model_stats, get_api_latency_stats
 from pathlib import Path
 
 # Use relative path from script location
@@ -37,4 +37,9 @@ print(f"\tverification duration: {total_metrics['verification_duration']:.2f} se
 print(f"\tdebug cost: ${total_metrics['total_debug_cost']:.4f}")
 print(f"\tverification cost: ${total_metrics['total_verification_cost']:.4f}")
 
-
+api_stats = get_api_latency_stats(db_path)
+if api_stats:
+    print(f"\nRAG API latency:")
+    for stat in api_stats:
+        print(f"\t{stat['method']} {stat['endpoint']}: {stat['calls']} calls, avg {stat['avg_s']:.2f}s, "
+              f"p95 {stat['p95_s']:.2f}s, {stat['retried']} retried, {stat['failed']} failed")
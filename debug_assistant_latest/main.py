@@ -1,7 +1,10 @@
 from agents import AgentAPI, AgentDebug, AgentDebugStepByStep, SingleAgent, AgentVerification_v1, AgentVerification_v2
 from utils import readTheJSONConfigFile, setUpEnvironment, printFinishMessage
 import sys, os
-from metrics_db import store_metrics_entry, calculate_cost, calculate_totals
+from metrics_db import store_metrics_entry, store_api_calls, calculate_cost, calculate_totals
+import rag_api
+import queue
+import threading
 import time
 from pathlib import Path
 
@@ -35,8 +38,11 @@ def allStepsAtOnce(configFile = None):
     apiAgent.setupAgent()
     debugAgent.setupAgent()
 
-    #Run the LLMs as needed
-    apiAgent.askQuestion()
+    #Run the LLMs as needed; the knowledge agent's server session is only needed for its answer
+    try:
+        apiAgent.askQuestion()
+    finally:
+        apiAgent.endSession()
     debugAgent.agentAPIResponse = apiAgent.response
     debug_start_time = time.perf_counter()
     debug_metrics = debugAgent.askQuestion()
@@ -87,6 +93,7 @@ def allStepsAtOnce(configFile = None):
     # Store metrics entry into the database
     store_metrics_entry(db_path, debug_metrics, verification_metrics.get("task_status"))
     store_metrics_entry(db_path, verification_metrics, verification_metrics.get("task_status"))
+    store_api_calls(db_path, rag_api.client.drain(), debug_metrics.get("test_case"))
     printFinishMessage()
 
     return verificationAgent.verificationStatus  # Return verification result instead of debug agent's self-report
@@ -111,11 +118,35 @@ def stepByStep( configFile = None ):
     apiAgent.setupAgent()
     debugAgent.setupAgent()
 
-    #Run the LLMs as needed
-    apiAgent.askQuestion()
-    debugAgent.agentAPIResponse = apiAgent.response
-    debugAgent.formProblemSolvingSteps()
-    debugAgent.executeProblemSteps()
+    if apiAgent.agentProperties.get("stream"):
+        # The debug agent starts on each bash step as soon as it is complete, while the answer is still streaming
+        steps = queue.Queue()
+
+        def streamAnswer():
+            try:
+                apiAgent.askQuestion(onStep=steps.put)
+            finally:
+                apiAgent.endSession()
+                steps.put(None)
+
+        streaming = threading.Thread(target=streamAnswer, name="knowledge-stream", daemon=True)
+        streaming.start()
+        debugAgent.executeProblemSteps(iter(steps.get, None))
+        streaming.join()
+        if apiAgent.response is None:
+            print("The knowledge agent's answer stream failed")
+            sys.exit()
+        debugAgent.agentAPIResponse = apiAgent.response
+    else:
+        #Run the LLMs as needed; the knowledge agent's server session is only needed for its answer
+        try:
+            apiAgent.askQuestion()
+        finally:
+            apiAgent.endSession()
+        debugAgent.agentAPIResponse = apiAgent.response
+        debugAgent.formProblemSolvingSteps(apiAgent.bashCommands)
+        debugAgent.executeProblemSteps()
+    store_api_calls(db_path, rag_api.client.drain(), config['test-name'])
     printFinishMessage()
 
     return debugAgent.debugStatus
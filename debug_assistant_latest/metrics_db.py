@@ -62,6 +62,71 @@ def store_metrics_entry(db_path, metrics, task_status_verified):
     conn.commit()
     conn.close()
 
+def store_api_calls(db_path, calls, test_case=None):
+    """Insert the latency records of RAG API calls (rag_api.client.drain()) of a test case."""
+    if not calls:
+        return
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS api_calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            test_case TEXT,
+            method TEXT NOT NULL,
+            endpoint TEXT NOT NULL,
+            status INTEGER,
+            duration_s REAL DEFAULT 0.0,
+            attempts INTEGER DEFAULT 1,
+            error TEXT
+        )
+    ''')
+
+    cursor.executemany('''
+        INSERT INTO api_calls (timestamp, test_case, method, endpoint, status, duration_s, attempts, error)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(datetime.fromtimestamp(call["timestamp"]).isoformat(), test_case, call["method"], call["endpoint"],
+           call["status"], call["duration_s"], call["attempts"], call["error"]) for call in calls])
+
+    conn.commit()
+    conn.close()
+
+def get_api_latency_stats(db_path):
+    """Calls, average and p95 latency, retried and failed calls per RAG API endpoint."""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'api_calls'")
+    if cursor.fetchone() is None:
+        conn.close()
+        return []
+    cursor.execute('''
+        SELECT method, endpoint, duration_s, attempts, status, error
+        FROM api_calls
+        ORDER BY method, endpoint, duration_s
+    ''')
+    rows = cursor.fetchall()
+    conn.close()
+
+    grouped = {}
+    for method, endpoint, duration_s, attempts, status, error in rows:
+        grouped.setdefault((method, endpoint), []).append((duration_s, attempts, status, error))
+    stats = []
+    for (method, endpoint), calls in grouped.items():
+        durations = [call[0] for call in calls]
+        stats.append({
+            "method": method,
+            "endpoint": endpoint,
+            "calls": len(calls),
+            "avg_s": sum(durations) / len(durations),
+            "p95_s": durations[min(len(durations) - 1, int(0.95 * len(durations)))],
+            "retried": sum(1 for call in calls if call[1] > 1),
+            "failed": sum(1 for call in calls if call[3] is not None or (call[2] or 0) >= 400),
+        })
+    return stats
+
 def get_model_stats(db_path):
     os.makedirs(os.path.dirname(db_path), exist_ok=True)  # Ensure dir exists
     conn = sqlite3.connect(db_path)
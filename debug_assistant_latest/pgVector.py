@@ -1,14 +1,30 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 import pandas as pd
+import numpy as np
 from phi.knowledge.website import WebsiteKnowledgeBase
 from phi.vectordb.pgvector import PgVector
+from phi.embedder.base import Embedder
+from datetime import datetime
+import argparse
+import io
+import json
+import shutil
 import sys
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+
+# The shared storage modules (db, kb_indexes, ...) live in the repo root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from db import get_engine
+from kb_indexes import IndexManager, ANN_INDEX, HNSW_M, HNSW_EF_CONSTRUCTION, IVFFLAT_LISTS
 
 # SQLAlchemy connection string (with psycopg2 driver)
 DB_URL = "postgresql+psycopg2://ai:ai@localhost:5532/ai"
 
-# Create SQLAlchemy engine
-engine = create_engine(DB_URL)
+# Shared SQLAlchemy engine (pool settings from RAG_DB_*); bundle import needs psycopg2's copy_expert
+engine = get_engine(DB_URL)
 
 def load_knowledge_base(table_name: str):
     knowledge_base = WebsiteKnowledgeBase(
@@ -18,7 +34,7 @@ def load_knowledge_base(table_name: str):
         # Table name: ai.local_rag_documents
         vector_db=PgVector(
             table_name=table_name,
-            db_url=DB_URL,
+            db_engine=engine,
         ),
     )
     knowledge_base.load()
@@ -70,6 +86,173 @@ def truncate_table(table_name: str):
         conn.execute(sql_stmt)
     print(f"Table '{table_name}' truncated successfully.")
 
+def split_table_name(table_name: str):
+    """'schema.table' -> (schema, table); the knowledge tables live in the 'ai' schema by default."""
+    if "." in table_name:
+        schema, table = table_name.split(".", 1)
+        return schema, table
+    return "ai", table_name
+
+# Knowledge-base bundles: a .tar.gz holding manifest.json, documents.jsonl (one row per line,
+# in table order) and embeddings.f32 (the embeddings as little-endian float32, one row after another).
+# Export and import stream the rows through temporary files, so bundle size is bounded by disk, not memory.
+BUNDLE_FORMAT = "kubellm-kb-bundle"
+BUNDLE_COLUMNS = ["id", "name", "meta_data", "filters", "content", "usage", "content_hash"]
+# COPY marker for NULL; every other value is written quoted, so "" stays an empty string
+COPY_NULL = "\\N"
+
+def export_bundle(table_name: str, bundle_path: str, embedder: str = None, batch_size: int = 1000):
+    """
+    Write the documents, metadata and embeddings of a pgvector table to a compressed bundle.
+    """
+    schema, table = split_table_name(table_name)
+    started_at = time.time()
+    dimensions = None
+    rows = 0
+    query = text(
+        f'SELECT {", ".join(BUNDLE_COLUMNS)}, embedding::real[] AS embedding '
+        f'FROM "{schema}"."{table}" ORDER BY id'
+    )
+    with tempfile.TemporaryFile() as documents, tempfile.TemporaryFile() as embeddings:
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+            for row in result.mappings():
+                record = {column: row[column] for column in BUNDLE_COLUMNS}
+                embedding = row["embedding"]
+                if embedding is not None and dimensions is None:
+                    dimensions = len(embedding)
+                    # Rows without an embedding before the first one still get a (zero) vector
+                    embeddings.write(np.zeros(rows * dimensions, dtype="<f4").tobytes())
+                record["has_embedding"] = embedding is not None
+                documents.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                if dimensions is not None:
+                    vector = np.zeros(dimensions, dtype="<f4") if embedding is None else np.asarray(embedding, dtype="<f4")
+                    embeddings.write(vector.tobytes())
+                rows += 1
+        if rows and dimensions is None:
+            raise ValueError(f"Table '{table_name}' has no embeddings to export")
+
+        manifest = {
+            "format": BUNDLE_FORMAT,
+            "version": 1,
+            "table": f"{schema}.{table}",
+            "embedder": embedder,
+            "dimensions": dimensions,
+            "rows": rows,
+            "dtype": "<f4",
+            "created_at": datetime.now().isoformat(),
+        }
+        payload = json.dumps(manifest, indent=2).encode()
+        with tarfile.open(bundle_path, "w:gz") as bundle:
+            for name, fileobj, size in [("manifest.json", io.BytesIO(payload), len(payload)),
+                                        ("documents.jsonl", documents, documents.tell()),
+                                        ("embeddings.f32", embeddings, embeddings.tell())]:
+                fileobj.seek(0)
+                info = tarfile.TarInfo(name)
+                info.size = size
+                info.mtime = int(time.time())
+                bundle.addfile(info, fileobj)
+    print(f"Exported {rows} rows of '{schema}.{table}' to {bundle_path} in {time.time() - started_at:.2f}s")
+    return manifest
+
+def read_bundle(bundle_path: str, workdir: str):
+    """
+    Return the manifest, an iterator of the document records and the (rows x dimensions)
+    embedding matrix of a bundle. The embeddings are extracted to workdir and memory-mapped;
+    the records are read from the bundle as they are consumed.
+    """
+    with tarfile.open(bundle_path, "r:gz") as bundle:
+        manifest = json.load(bundle.extractfile("manifest.json"))
+        if manifest.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"{bundle_path} is not a knowledge-base bundle")
+        embeddings_path = f"{workdir}/embeddings.f32"
+        with open(embeddings_path, "wb") as out:
+            shutil.copyfileobj(bundle.extractfile("embeddings.f32"), out)
+    rows, dimensions = manifest["rows"], manifest["dimensions"] or 0
+    embeddings = None
+    if rows and dimensions:
+        embeddings = np.memmap(embeddings_path, dtype=manifest.get("dtype", "<f4"), mode="r", shape=(rows, dimensions))
+
+    def records():
+        with tarfile.open(bundle_path, "r:gz") as bundle:
+            for line in io.TextIOWrapper(bundle.extractfile("documents.jsonl"), encoding="utf-8"):
+                if line.strip():
+                    yield json.loads(line)
+
+    return manifest, records(), embeddings
+
+def copy_field(value) -> str:
+    """One CSV field for COPY: NULL as the bare COPY_NULL marker, everything else quoted."""
+    if value is None:
+        return COPY_NULL
+    return '"' + str(value).replace('"', '""') + '"'
+
+def import_bundle(bundle_path: str, table_name: str = None, replace: bool = False, batch_size: int = 5000):
+    """
+    Bulk-load a bundle into a pgvector table (by default the table it was exported from) with COPY.
+
+    Rows are copied into a temporary table and merged on id, so importing into a table
+    that already holds some of the documents updates them in place. replace=True empties
+    the table first.
+    """
+    started_at = time.time()
+    with tempfile.TemporaryDirectory() as workdir:
+        manifest, records, embeddings = read_bundle(bundle_path, workdir)
+        schema, table = split_table_name(table_name or manifest["table"])
+
+        # Create the table (and its indexes) the same way PgVector does
+        PgVector(schema=schema, table_name=table, db_engine=engine, embedder=Embedder(dimensions=manifest["dimensions"])).create()
+
+        columns = BUNDLE_COLUMNS + ["embedding"]
+        copy_sql = (f'COPY kb_bundle_import ({", ".join(columns)}) FROM STDIN '
+                    f"WITH (FORMAT csv, NULL '{COPY_NULL}')")
+        imported = 0
+        raw_conn = engine.raw_connection()
+        try:
+            cursor = raw_conn.cursor()
+            if replace:
+                cursor.execute(f'TRUNCATE TABLE "{schema}"."{table}"')
+            cursor.execute(f'CREATE TEMP TABLE kb_bundle_import (LIKE "{schema}"."{table}" INCLUDING DEFAULTS) ON COMMIT DROP')
+            buffer = io.StringIO()
+            for row, record in enumerate(records):
+                embedding = None
+                if record.get("has_embedding", True):
+                    embedding = "[" + ",".join("%.9g" % value for value in embeddings[row]) + "]"
+                buffer.write(",".join(copy_field(value) for value in [
+                    record["id"],
+                    record["name"],
+                    json.dumps(record["meta_data"]) if record["meta_data"] is not None else None,
+                    json.dumps(record["filters"]) if record["filters"] is not None else None,
+                    record["content"],
+                    json.dumps(record["usage"]) if record["usage"] is not None else None,
+                    record["content_hash"],
+                    embedding,
+                ]) + "\n")
+                imported += 1
+                if imported % batch_size == 0:
+                    buffer.seek(0)
+                    cursor.copy_expert(copy_sql, buffer)
+                    buffer = io.StringIO()
+            if buffer.tell():
+                buffer.seek(0)
+                cursor.copy_expert(copy_sql, buffer)
+            updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns if column != "id")
+            cursor.execute(
+                f'INSERT INTO "{schema}"."{table}" ({", ".join(columns)}) '
+                f'SELECT {", ".join(columns)} FROM kb_bundle_import '
+                f'ON CONFLICT (id) DO UPDATE SET {updates}'
+            )
+            raw_conn.commit()
+        except Exception:
+            raw_conn.rollback()
+            raise
+        finally:
+            raw_conn.close()
+            # The memory map must be closed before the temporary directory is removed
+            del embeddings
+    print(f"Imported {imported} rows into '{schema}.{table}' in {time.time() - started_at:.2f}s")
+    return imported
+
 def drop_table(table_name: str):
     """
     Drop a table dynamically (removes the table and all its data).
@@ -80,8 +263,98 @@ def drop_table(table_name: str):
     print(f"Table '{table_name}' dropped successfully.")
 
 
+def bundle_main(argv):
+    parser = argparse.ArgumentParser(prog="pgVector.py", description="Export/import knowledge-base bundles")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="write a table to a bundle")
+    export_parser.add_argument("table", help="table name, e.g. ai.local_rag_documents_nomic-embed-text")
+    export_parser.add_argument("bundle", help="output file, e.g. kb.tar.gz")
+    export_parser.add_argument("--embedder", help="embeddings model recorded in the manifest")
+    import_parser = commands.add_parser("import", help="bulk-load a bundle with COPY")
+    import_parser.add_argument("bundle")
+    import_parser.add_argument("--table", help="target table (default: the exported table)")
+    import_parser.add_argument("--replace", action="store_true", help="empty the table first")
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        export_bundle(args.table, args.bundle, embedder=args.embedder)
+    else:
+        import_bundle(args.bundle, table_name=args.table, replace=args.replace)
+
+
+def print_index_report(report):
+    for entry in report:
+        print(f"{entry['table']}: {entry['rows']} rows, table {entry['table_bytes'] / 1e6:.1f} MB, "
+              f"total {entry['total_bytes'] / 1e6:.1f} MB")
+        for index in entry["indexes"]:
+            print(f"    {index['name']} ({index['method']}): {index['bytes'] / 1e6:.1f} MB")
+
+
+def print_probe(probe):
+    print(f"{probe['table']}: {probe['index']} index, {probe['queries']} queries")
+    if probe["exact"]:
+        print(f"    exact (seq scan): p50 {probe['exact']['p50_ms']} ms, p95 {probe['exact']['p95_ms']} ms")
+    for result in probe["results"]:
+        print("    " + ", ".join(f"{key} {value}" for key, value in result.items()))
+
+
+def index_main(argv):
+    """
+    python pgVector.py index build [TABLE] [--kind hnsw|ivfflat|none] [--m M] [--ef-construction EF] [--lists N] [--rebuild] [--no-text]
+    python pgVector.py index report [TABLE]
+    python pgVector.py index probe TABLE [--queries N] [--k K] [--ef-search 10,40,160] [--probes 1,10]
+    """
+    parser = argparse.ArgumentParser(prog="pgVector.py index", description="Manage ANN and full-text indexes")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="create missing indexes (all ai.local_rag_* tables by default)")
+    build_parser.add_argument("table", nargs="?")
+    build_parser.add_argument("--kind", default=ANN_INDEX, choices=["hnsw", "ivfflat", "none"])
+    build_parser.add_argument("--m", type=int, default=HNSW_M)
+    build_parser.add_argument("--ef-construction", type=int, default=HNSW_EF_CONSTRUCTION)
+    build_parser.add_argument("--lists", type=int, default=IVFFLAT_LISTS, help="IVFFlat lists (0: from the row count)")
+    build_parser.add_argument("--rebuild", action="store_true", help="drop and recreate existing indexes")
+    build_parser.add_argument("--no-text", action="store_true", help="skip the GIN index on content")
+    report_parser = commands.add_parser("report", help="row counts and table/index sizes")
+    report_parser.add_argument("table", nargs="?")
+    probe_parser = commands.add_parser("probe", help="recall@k and latency of the ANN index vs. an exact scan")
+    probe_parser.add_argument("table")
+    probe_parser.add_argument("--queries", type=int, default=50)
+    probe_parser.add_argument("--k", type=int, default=5)
+    probe_parser.add_argument("--ef-search", default="10,20,40,80,160")
+    probe_parser.add_argument("--probes", default="1,5,10,20")
+    probe_parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    manager = IndexManager(engine)
+    table = split_table_name(args.table)[1] if args.table else None
+    if args.command == "build":
+        options = dict(kind=args.kind, m=args.m, ef_construction=args.ef_construction, lists=args.lists,
+                       text_index=not args.no_text, rebuild=args.rebuild)
+        results = [manager.build(table, **options)] if table else manager.build_all(**options)
+        for result in results:
+            print(result)
+        print_index_report(manager.report([table] if table else None))
+    elif args.command == "report":
+        print_index_report(manager.report([table] if table else None))
+    else:
+        probe = manager.probe(table, queries=args.queries, k=args.k,
+                              ef_search=[int(value) for value in args.ef_search.split(",")],
+                              probes=[int(value) for value in args.probes.split(",")])
+        if args.json:
+            print(json.dumps(probe, indent=2))
+        else:
+            print_probe(probe)
+
+
 if __name__ == "__main__":
-    
+    # python pgVector.py export <table> <bundle> | python pgVector.py import <bundle> [--table T] [--replace]
+    if len(sys.argv) > 1 and sys.argv[1] in ("export", "import"):
+        bundle_main(sys.argv[1:])
+        sys.exit()
+    # python pgVector.py index build|report|probe ...
+    if len(sys.argv) > 1 and sys.argv[1] == "index":
+        index_main(sys.argv[2:])
+        sys.exit()
+
     print("📌 Tables with pgvector columns:")
     print(list_pgvector_tables())
     
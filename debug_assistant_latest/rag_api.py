@@ -1,58 +1,298 @@
 import requests
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 
 # Base URL for your FastAPI app
-BASE_URL = "http://10.242.128.44:8501"
+BASE_URL = os.getenv("RAG_API_URL", "http://10.242.128.44:8501")
+# Seconds to connect, and to wait for the next bytes of a response (agent runs take minutes)
+CONNECT_TIMEOUT_S = float(os.getenv("RAG_API_CONNECT_TIMEOUT_S", "5"))
+READ_TIMEOUT_S = float(os.getenv("RAG_API_READ_TIMEOUT_S", "600"))
+# Attempts after the first one, with full-jitter exponential backoff between them
+RETRIES = int(os.getenv("RAG_API_RETRIES", "3"))
+BACKOFF_S = float(os.getenv("RAG_API_BACKOFF_S", "0.5"))
+MAX_BACKOFF_S = float(os.getenv("RAG_API_MAX_BACKOFF_S", "30"))
+RETRY_STATUSES = (429, 502, 503, 504)
+# Seconds to wait for a background ingestion job before giving up on it
+JOB_TIMEOUT_S = float(os.getenv("RAG_API_JOB_TIMEOUT_S", "900"))
 
-def initialize_assistant(llm_model: str, embeddings_model: str):
+class JobTimeout(TimeoutError):
+    """An ingestion job did not finish in time; .job is its last known status."""
+
+    def __init__(self, job: dict, timeout: float):
+        super().__init__(f"Job {job.get('job_id')} still {job.get('status')} after {timeout:g}s")
+        self.job = job
+
+def backoff_delay(attempt: int, response=None) -> float:
+    """Seconds before the next attempt: the server's Retry-After, else full-jitter exponential backoff."""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), MAX_BACKOFF_S)
+    return random.uniform(0, min(MAX_BACKOFF_S, BACKOFF_S * 2 ** attempt))
+
+class RagClient:
+    """
+    HTTP client of the RAG API server: one keep-alive connection pool, connect/read
+    timeouts on every call and bounded retries.
+
+    GETs are retried on connection errors, timeouts and 429/502/503/504. Other calls
+    are only retried when the server cannot have processed them: the connection was
+    never established, or the server answered 429 (admission control rejected it).
+    Every call's latency is kept in .calls until drain() hands it to the metrics DB.
+    """
+
+    def __init__(self, base_url: str = None, connect_timeout: float = CONNECT_TIMEOUT_S,
+                 read_timeout: float = READ_TIMEOUT_S, retries: int = RETRIES, pool_size: int = 8):
+        self.base_url = (base_url or BASE_URL).rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.calls = deque(maxlen=10000)
+        self._lock = threading.Lock()
+
+    def _record(self, method: str, endpoint: str, status, started_at: float, attempts: int, error: str = None):
+        with self._lock:
+            self.calls.append({
+                "timestamp": time.time(),
+                "method": method,
+                "endpoint": endpoint,
+                "status": status,
+                "duration_s": round(time.perf_counter() - started_at, 4),
+                "attempts": attempts,
+                "error": error,
+            })
+
+    def request(self, method: str, path: str, endpoint: str = None, timeout=None, **kwargs) -> requests.Response:
+        """
+        Send a request to base_url + path. endpoint names the call in the latency records
+        (path templates like /jobs/{job_id}); timeout overrides (connect, read) of this call.
+        """
+        endpoint = endpoint or path
+        idempotent = method == "GET"
+        started_at = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, self.base_url + path, timeout=timeout or self.timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                reason = getattr(e.args[0], "reason", None) if e.args else None
+                not_sent = isinstance(e, requests.exceptions.ConnectTimeout) or isinstance(reason, NewConnectionError)
+                retryable = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                if attempt >= self.retries or not retryable or not (idempotent or not_sent):
+                    self._record(method, endpoint, None, started_at, attempt + 1, type(e).__name__)
+                    raise
+                delay = backoff_delay(attempt)
+            else:
+                if (response.status_code not in RETRY_STATUSES or attempt >= self.retries
+                        or not (idempotent or response.status_code == 429)):
+                    self._record(method, endpoint, response.status_code, started_at, attempt + 1)
+                    return response
+                delay = backoff_delay(attempt, response)
+                response.close()
+            attempt += 1
+            time.sleep(delay)
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def drain(self) -> list:
+        """Remove and return the latency records of the calls made so far."""
+        with self._lock:
+            calls = list(self.calls)
+            self.calls.clear()
+        return calls
+
+    def close(self):
+        self.session.close()
+
+# Shared by the functions below; replace it (e.g. RagClient(base_url=...)) to talk to another server
+client = RagClient()
+
+def _with_session(data: dict, session_id: str = None):
+    """Add the session id to a request payload; without one the server uses its default session."""
+    if session_id is not None:
+        data["session_id"] = session_id
+    return data
+
+def initialize_assistant(llm_model: str, embeddings_model: str, session_id: str = None, new_session: bool = False):
     """
     Initialize the assistant with the specified LLM and embeddings model.
+    With new_session=True the server creates a private session; its id is
+    returned as "session_id" and must be passed to the other calls.
     """
-    response = requests.post(f"{BASE_URL}/initialize/", data={
+    response = client.post("/initialize/", data=_with_session({
         "llm_model": llm_model, 
         "embeddings_model": embeddings_model,
-    })
+        "new_session": new_session,
+    }, session_id))
     return response.json()
 
-def ask_question(prompt: str):
+def ask_question(prompt: str, session_id: str = None, cache: str = "off", priority: str = "interactive"):
     """
     Ask a question to the initialized assistant.
+    cache opts into the server's answer cache: "off", "exact", "semantic" or "refresh".
+    priority "batch" (benchmark runs) yields to "interactive" requests when the server is busy.
+    """
+    data = {"prompt": prompt, "cache": cache, "priority": priority}
+    response = client.post("/ask/", data=_with_session(data, session_id))
+    return response.json()
+
+def ask_question_stream(prompt: str, session_id: str = None, priority: str = "interactive"):
+    """
+    Ask a question and yield the server-sent events of the answer as (event, data) tuples:
+    ("token", {"delta": ...}) while it is generated, then ("done", {"timings": ...})
+    or ("error", {"detail": ...}).
+    """
+    data = {"prompt": prompt, "priority": priority}
+    with client.post("/ask_stream/", data=_with_session(data, session_id), stream=True) as response:
+        response.raise_for_status()
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                yield event, json.loads(line[len("data:"):].strip())
+
+BASH_BLOCK = re.compile(r"```bash\s*\n(.*?)```", re.DOTALL)
+
+def iter_bash_blocks(deltas):
+    """
+    Yield the command of every ```bash block in a stream of text deltas
+    as soon as its closing fence has arrived.
+    """
+    text = ""
+    position = 0
+    for delta in deltas:
+        text += delta
+        match = BASH_BLOCK.search(text, position)
+        while match:
+            yield match.group(1).strip()
+            position = match.end()
+            match = BASH_BLOCK.search(text, position)
+
+def get_job(job_id: str):
     """
-    response = requests.post(f"{BASE_URL}/ask/", data={"prompt": prompt})
+    Status, progress and errors of a background ingestion job.
+    """
+    response = client.get(f"/jobs/{job_id}", endpoint="/jobs/{job_id}")
     return response.json()
 
-def add_url(url: str):
+def wait_for_job(job_id: str, timeout: float = JOB_TIMEOUT_S, poll_interval: float = 1.0):
+    """
+    Poll an ingestion job until it is done or failed and return its status.
+    Raises JobTimeout if it is still queued or running after timeout seconds (None waits forever).
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    while True:
+        job = get_job(job_id)
+        if job.get("status") in ("done", "failed", None):
+            return job
+        if deadline is not None and time.time() >= deadline:
+            raise JobTimeout(job, timeout)
+        time.sleep(poll_interval)
+
+def _job_response(response, wait: bool, timeout: float = JOB_TIMEOUT_S):
+    """Uploads return a queued job; with wait=True the final job status is returned instead."""
+    result = response.json()
+    if wait and "job_id" in result:
+        return wait_for_job(result["job_id"], timeout)
+    return result
+
+def _upload(file_path: str):
+    """File field of an upload; read into memory so a retried request sends the whole file again."""
+    with open(file_path, "rb") as file:
+        return {"file": (os.path.basename(file_path), file.read())}
+
+def add_url(url: str, session_id: str = None, wait: bool = True, timeout: float = JOB_TIMEOUT_S):
     """
     Add a URL to the knowledge base.
+    The server loads it in the background; wait=False returns the job id right away,
+    otherwise JobTimeout is raised if the job takes longer than timeout seconds.
     """
-    response = requests.post(f"{BASE_URL}/add_url/", data={"url": url})
+    response = client.post("/add_url/", data=_with_session({"url": url}, session_id))
+    return _job_response(response, wait, timeout)
+
+def add_urls(urls: list, max_depth: int = 0, max_links: int = 0, session_id: str = None):
+    """
+    Crawl several URLs into the knowledge base in one request.
+    """
+    data = {"urls": list(urls), "max_depth": max_depth, "max_links": max_links}
+    response = client.post("/add_urls/", data=_with_session(data, session_id))
     return response.json()
 
-def upload_pdf(file_path: str):
+def upload_pdf(file_path: str, session_id: str = None, wait: bool = True, timeout: float = JOB_TIMEOUT_S):
     """
     Upload a PDF to the knowledge base.
+    The server ingests it in the background; wait=False returns the job id right away,
+    otherwise JobTimeout is raised if the job takes longer than timeout seconds.
     """
-    with open(file_path, "rb") as file:
-        response = requests.post(f"{BASE_URL}/upload_pdf/", files={"file": file})
-        return response.json()
+    response = client.post("/upload_pdf/", files=_upload(file_path), data=_with_session({}, session_id))
+    return _job_response(response, wait, timeout)
+
+def upload_md(file_path: str, session_id: str = None, wait: bool = True, timeout: float = JOB_TIMEOUT_S):
+    """
+    Upload a Markdown file to the knowledge base.
+    The server ingests it in the background; wait=False returns the job id right away,
+    otherwise JobTimeout is raised if the job takes longer than timeout seconds.
+    """
+    response = client.post("/upload_md/", files=_upload(file_path), data=_with_session({}, session_id))
+    return _job_response(response, wait, timeout)
 
-def clear_knowledge_base():
+def clear_knowledge_base(session_id: str = None):
     """
     Clear the entire knowledge base.
     """
-    response = requests.post(f"{BASE_URL}/clear_knowledge_base/")
+    response = client.post("/clear_knowledge_base/", data=_with_session({}, session_id))
+    return response.json()
+
+def create_snapshot(name: str, copy_current: bool = False, session_id: str = None):
+    """
+    Create a new version of a named knowledge-base snapshot and switch to it.
+    """
+    data = {"name": name, "copy_current": copy_current}
+    response = client.post("/kb/snapshots/", data=_with_session(data, session_id))
+    return response.json()
+
+def switch_snapshot(name: str = None, version: int = None, session_id: str = None):
+    """
+    Switch to a prepared knowledge-base snapshot (no name: back to the base table).
+    """
+    data = {key: value for key, value in {"name": name, "version": version}.items() if value is not None}
+    response = client.post("/kb/switch/", data=_with_session(data, session_id))
+    return response.json()
+
+def list_snapshots(embeddings_model: str = None):
+    """
+    List the knowledge-base snapshots.
+    """
+    params = {"embeddings_model": embeddings_model} if embeddings_model else None
+    response = client.get("/kb/snapshots/", params=params)
     return response.json()
 
-def get_chat_history():
+def get_chat_history(session_id: str = None, cursor: int = 0, limit: int = 100, metadata_only: bool = False):
     """
-    Retrieve the chat history.
+    Retrieve a page of the chat history; pass the returned next_cursor to get the next page.
     """
-    response = requests.get(f"{BASE_URL}/chat_history/")
+    params = {"cursor": cursor, "limit": limit, "metadata_only": metadata_only}
+    response = client.get("/chat_history/", params=_with_session(params, session_id))
     return response.json()
 
-def start_new_run():
+def start_new_run(session_id: str = None):
     """
     Start a new session or run for the assistant.
     """
-    response = requests.post(f"{BASE_URL}/new_run/")
+    response = client.post("/new_run/", data=_with_session({}, session_id))
     return response.json()
 
@@ -0,0 +1,196 @@
+"""
+Persistent local embedding cache.
+
+Embeddings are stored in SQLite keyed by (embedder model, dimensions, text hash),
+so text that was embedded before (re-ingested pages, repeated queries) is served
+from disk instead of calling the embedder again. The default database lives under
+~/.cache/kubellm and is shared by every process on the machine (api_server and the
+debug harness), and it is bounded to a maximum number of entries with least
+recently used eviction.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from phi.embedder.base import Embedder
+from phi.utils.log import logger
+
+EMBEDDING_CACHE_PATH = Path(os.getenv("RAG_EMBEDDING_CACHE", Path.home() / ".cache" / "kubellm" / "embeddings.db"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("RAG_EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", errors="replace")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed embedding store with hit/miss counters and LRU eviction."""
+
+    def __init__(self, db_path: Path = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.db_path = Path(db_path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    dimensions INTEGER NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, dimensions, text_hash)
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get_many(self, model: str, dimensions: int, texts: List[str]) -> List[Optional[List[float]]]:
+        """Cached embedding of every text, or None where it is not cached."""
+        hashes = [text_hash(text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        with self._connect() as conn:
+            # Stay well below SQLite's limit on bound parameters
+            for start in range(0, len(hashes), 500):
+                batch = list(set(hashes[start:start + 500]))
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f'SELECT text_hash, embedding FROM embeddings '
+                    f'WHERE model = ? AND dimensions = ? AND text_hash IN ({placeholders})',
+                    (model, dimensions, *batch),
+                ).fetchall()
+                for digest, blob in rows:
+                    found[digest] = array("f", blob).tolist()
+            if found:
+                conn.executemany(
+                    'UPDATE embeddings SET last_used = ? WHERE model = ? AND dimensions = ? AND text_hash = ?',
+                    [(time.time(), model, dimensions, digest) for digest in found],
+                )
+        results = [found.get(digest) for digest in hashes]
+        with self._lock:
+            self.hits += sum(1 for result in results if result is not None)
+            self.misses += sum(1 for result in results if result is None)
+        return results
+
+    def put_many(self, model: str, dimensions: int, texts: List[str], embeddings: List[List[float]]):
+        now = time.time()
+        rows = [
+            (model, dimensions, text_hash(text), array("f", embedding).tobytes(), now, now)
+            for text, embedding in zip(texts, embeddings) if embedding
+        ]
+        if not rows:
+            return
+        with self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?)', rows)
+            evicted = self._evict(conn)
+        with self._lock:
+            self.stores += len(rows)
+            self.evictions += evicted
+
+    def _evict(self, conn: sqlite3.Connection) -> int:
+        """Delete the least recently used entries once the cache holds more than max_entries."""
+        (count,) = conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()
+        if count <= self.max_entries:
+            return 0
+        # Evict down to 90% of the bound so eviction does not run on every insert
+        excess = count - int(self.max_entries * 0.9)
+        conn.execute(
+            'DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)',
+            (excess,),
+        )
+        logger.info(f"Evicted {excess} entries from the embedding cache")
+        return excess
+
+    def clear(self, model: Optional[str] = None) -> int:
+        with self._connect() as conn:
+            if model is None:
+                return conn.execute('DELETE FROM embeddings').rowcount
+            return conn.execute('DELETE FROM embeddings WHERE model = ?', (model,)).rowcount
+
+    def stats(self) -> Dict:
+        with self._connect() as conn:
+            (entries,) = conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()
+            per_model = conn.execute('SELECT model, dimensions, COUNT(*) FROM embeddings GROUP BY model, dimensions').fetchall()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": str(self.db_path),
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "size_bytes": self.db_path.stat().st_size if self.db_path.exists() else 0,
+                "models": [{"model": m, "dimensions": d, "entries": n} for m, d, n in per_model],
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_shared_cache: Optional[EmbeddingCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """The process-wide cache on EMBEDDING_CACHE_PATH."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = EmbeddingCache()
+        return _shared_cache
+
+
+class CachedEmbedder(Embedder):
+    """Wraps any phi embedder; embeddings are looked up in the local cache before calling it."""
+
+    embedder: Embedder
+    cache: Optional[EmbeddingCache] = None
+
+    def model_post_init(self, __context) -> None:
+        self.dimensions = self.embedder.dimensions
+        if self.cache is None:
+            self.cache = get_embedding_cache()
+
+    @property
+    def cache_model(self) -> str:
+        return f"{type(self.embedder).__name__}:{getattr(self.embedder, 'model', '')}"
+
+    def get_embedding(self, text: str) -> List[float]:
+        return self.get_embeddings([text])[0]
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
+        return self.get_embedding(text), None
+
+    def get_embeddings(self, texts: List[str],
+                       embed_fn: Optional[Callable[[List[str]], List[List[float]]]] = None) -> List[List[float]]:
+        """
+        Embed many texts, calling the wrapped embedder only for cache misses.
+
+        embed_fn embeds the missing texts (e.g. in batches); by default they are embedded one by one.
+        """
+        dimensions = self.dimensions or 0
+        results = self.cache.get_many(self.cache_model, dimensions, texts)
+        # Texts repeated within the call are embedded once
+        missing_texts = list(dict.fromkeys(texts[i] for i, result in enumerate(results) if result is None))
+        if missing_texts:
+            if embed_fn is None:
+                embeddings = [self.embedder.get_embedding(text) for text in missing_texts]
+            else:
+                embeddings = embed_fn(missing_texts)
+            self.cache.put_many(self.cache_model, dimensions, missing_texts, embeddings)
+            embedded = dict(zip(missing_texts, embeddings))
+            results = [embedded[text] if result is None else result for text, result in zip(texts, results)]
+        return results
@@ -0,0 +1,52 @@
+"""
+Batched embedding helpers for the ingestion path.
+
+phi embedders expose one request per text. Ollama (/api/embed) and OpenAI both
+accept a list of inputs, so chunks are embedded in batches instead, which keeps
+ingest throughput proportional to page size rather than to the number of chunks.
+"""
+from typing import List
+
+from phi.document import Document
+from phi.embedder.base import Embedder
+from phi.embedder.ollama import OllamaEmbedder
+from phi.embedder.openai import OpenAIEmbedder
+from phi.utils.log import logger
+
+from embedding_cache import CachedEmbedder
+
+
+def embed_batch(embedder: Embedder, texts: List[str]) -> List[List[float]]:
+    """Embed a list of texts with a single request when the embedder supports it."""
+    if isinstance(embedder, OllamaEmbedder):
+        kwargs = {"options": embedder.options} if embedder.options is not None else {}
+        response = embedder.client.embed(model=embedder.model, input=texts, **kwargs)
+        return [list(embedding) for embedding in response["embeddings"]]
+    if isinstance(embedder, OpenAIEmbedder):
+        params = {"input": texts, "model": embedder.model, "encoding_format": "float"}
+        if embedder.model.startswith("text-embedding-3"):
+            params["dimensions"] = embedder.dimensions
+        response = embedder.client.embeddings.create(**params)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    return [embedder.get_embedding(text) for text in texts]
+
+
+def embed_texts(embedder: Embedder, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+    if isinstance(embedder, CachedEmbedder):
+        # Only the texts missing from the local cache are sent to the embedder
+        return embedder.get_embeddings(texts, lambda missing: embed_texts(embedder.embedder, missing, batch_size))
+    embeddings: List[List[float]] = []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        embeddings.extend(embed_batch(embedder, batch))
+        logger.debug(f"Embedded batch of {len(batch)} texts ({start + len(batch)}/{len(texts)})")
+    return embeddings
+
+
+def embed_documents(embedder: Embedder, documents: List[Document], batch_size: int = 32) -> None:
+    """Set the embedding of every document, raising if the embedder returned nothing for one of them."""
+    embeddings = embed_texts(embedder, [doc.content for doc in documents], batch_size)
+    for doc, embedding in zip(documents, embeddings):
+        if not embedding:
+            raise ValueError(f"Embedder returned no embedding for a chunk of '{doc.name}'")
+        doc.embedding = list(embedding)
@@ -0,0 +1,234 @@
+"""
+Content-addressed ingestion cache for the knowledge sources added through api_server.
+
+Every source URL is remembered together with the validators returned by the web
+server (ETag / Last-Modified) and the hash of its extracted text. The embedded rows
+are stored once per (content hash, embedder model), so re-adding an unchanged source
+costs one conditional GET and no embedding calls: the cached rows are copied
+straight into the serving pgvector table.
+"""
+import json
+import sqlite3
+import hashlib
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime
+from hashlib import md5
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from phi.document import Document
+from phi.utils.log import logger
+from phi.vectordb.base import VectorDb
+from phi.vectordb.pgvector import PgVector
+from sqlalchemy.dialects import postgresql
+
+from vector_store import BM25HybridDb
+
+INGEST_CACHE_PATH = Path(__file__).parent / "kb_cache" / "ingest_cache.db"
+
+
+@dataclass
+class CachedSource:
+    url: str
+    embedder: str
+    content_hash: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    num_documents: int
+    # Links found on the page, so a crawl can follow them after a 304
+    links: List[str] = field(default_factory=list)
+
+
+def content_hash(text: str) -> str:
+    """Hash of the extracted text of a source, used as its content address."""
+    return hashlib.sha256(text.encode("utf-8", errors="replace")).hexdigest()
+
+
+class IngestCache:
+    """SQLite-backed cache of fetched sources and their embedded rows."""
+
+    def __init__(self, db_path: Path = INGEST_CACHE_PATH):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sources (
+                    url TEXT NOT NULL,
+                    embedder TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    num_documents INTEGER DEFAULT 0,
+                    fetched_at TEXT NOT NULL,
+                    links TEXT,
+                    PRIMARY KEY (url, embedder)
+                )
+            ''')
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(sources)')]
+            if "links" not in columns:
+                conn.execute('ALTER TABLE sources ADD COLUMN links TEXT')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS documents (
+                    content_hash TEXT NOT NULL,
+                    embedder TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    name TEXT,
+                    meta_data TEXT,
+                    content TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    usage TEXT,
+                    PRIMARY KEY (content_hash, embedder, position)
+                )
+            ''')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def lookup(self, url: str, embedder: str) -> Optional[CachedSource]:
+        """Return the cache entry for a source, if it was ingested before with this embedder."""
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT url, embedder, content_hash, etag, last_modified, num_documents, links '
+                'FROM sources WHERE url = ? AND embedder = ?',
+                (url, embedder),
+            ).fetchone()
+        if row is None:
+            return None
+        return CachedSource(*row[:6], links=json.loads(row[6]) if row[6] else [])
+
+    @staticmethod
+    def conditional_headers(entry: Optional[CachedSource]) -> Dict[str, str]:
+        """Request headers that let the web server answer 304 Not Modified."""
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def get_documents(self, content_hash: str, embedder: str) -> List[Document]:
+        """Rebuild the embedded documents stored for a content hash."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT name, meta_data, content, embedding, usage FROM documents '
+                'WHERE content_hash = ? AND embedder = ? ORDER BY position',
+                (content_hash, embedder),
+            ).fetchall()
+
+        documents = []
+        for name, meta_data, content, embedding, usage in rows:
+            vector = array("f")
+            vector.frombytes(embedding)
+            documents.append(Document(
+                name=name,
+                meta_data=json.loads(meta_data) if meta_data else {},
+                content=content,
+                embedding=vector.tolist(),
+                usage=json.loads(usage) if usage else None,
+            ))
+        return documents
+
+    def store(self, url: str, embedder: str, content_hash: str, documents: List[Document],
+              etag: Optional[str] = None, last_modified: Optional[str] = None, links: Optional[List[str]] = None):
+        """Remember a freshly embedded source and its rows."""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM documents WHERE content_hash = ? AND embedder = ?', (content_hash, embedder))
+            conn.executemany('''
+                INSERT INTO documents (content_hash, embedder, position, name, meta_data, content, embedding, usage)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (content_hash, embedder, position, doc.name, json.dumps(doc.meta_data), doc.content,
+                 array("f", doc.embedding or []).tobytes(), json.dumps(doc.usage) if doc.usage else None)
+                for position, doc in enumerate(documents)
+            ])
+            self._upsert_source(conn, url, embedder, content_hash, len(documents), etag, last_modified, links)
+
+    def remember(self, url: str, embedder: str, content_hash: str, num_documents: int,
+                 etag: Optional[str] = None, last_modified: Optional[str] = None, links: Optional[List[str]] = None):
+        """Point a source at already cached rows and refresh its validators."""
+        with self._connect() as conn:
+            self._upsert_source(conn, url, embedder, content_hash, num_documents, etag, last_modified, links)
+
+    @staticmethod
+    def _upsert_source(conn, url, embedder, content_hash, num_documents, etag, last_modified, links=None):
+        conn.execute('''
+            INSERT OR REPLACE INTO sources
+                (url, embedder, content_hash, etag, last_modified, num_documents, fetched_at, links)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (url, embedder, content_hash, etag, last_modified, num_documents, datetime.now().isoformat(),
+              json.dumps(links) if links is not None else None))
+
+    def purge(self, embedder: Optional[str] = None) -> int:
+        """Drop cached sources and rows (for one embedder, or all). Returns the number of sources removed."""
+        with self._connect() as conn:
+            if embedder is None:
+                removed = conn.execute('DELETE FROM sources').rowcount
+                conn.execute('DELETE FROM documents')
+            else:
+                # Entries are keyed by "<embedder>@<chunking profile>"
+                pattern = f"{embedder}@%"
+                removed = conn.execute('DELETE FROM sources WHERE embedder = ? OR embedder LIKE ?',
+                                       (embedder, pattern)).rowcount
+                conn.execute('DELETE FROM documents WHERE embedder = ? OR embedder LIKE ?', (embedder, pattern))
+        logger.info(f"Purged {removed} cached sources from the ingest cache")
+        return removed
+
+
+def insert_embedded_documents(vector_db: VectorDb, documents: List[Document], filters: Optional[Dict] = None,
+                              batch_size: int = 500):
+    """
+    Write documents that already carry embeddings into a pgvector table.
+
+    PgVector.insert/upsert always call the embedder again, so cached rows are
+    written directly using the same record layout (id = md5 of the content).
+    """
+    if not documents:
+        return
+    if isinstance(vector_db, BM25HybridDb):
+        insert_embedded_documents(vector_db.vector_db, documents, filters, batch_size)
+        vector_db.index_documents(documents, filters)
+        return
+    if not isinstance(vector_db, PgVector):
+        # LocalVectorDb.upsert keeps embeddings that are already set
+        vector_db.upsert(documents, filters, batch_size=batch_size)
+        return
+    vector_db.create()
+    records = {}
+    for doc in documents:
+        cleaned_content = doc.content.replace("\x00", "\ufffd")
+        content_hash = md5(cleaned_content.encode()).hexdigest()
+        # Identical chunks map to the same id; one INSERT .. ON CONFLICT may only touch a row once
+        records[doc.id or content_hash] = {
+            "id": doc.id or content_hash,
+            "name": doc.name,
+            "meta_data": doc.meta_data,
+            "filters": filters,
+            "content": cleaned_content,
+            "embedding": doc.embedding,
+            "usage": doc.usage,
+            "content_hash": content_hash,
+        }
+    records = list(records.values())
+
+    with vector_db.Session() as sess, sess.begin():
+        for start in range(0, len(records), batch_size):
+            sess.execute(_upsert_statement(vector_db, records[start:start + batch_size]))
+    logger.info(f"Inserted {len(records)} cached documents into '{vector_db.table.fullname}'")
+
+
+def _upsert_statement(vector_db: PgVector, records: List[Dict]):
+    insert_stmt = postgresql.insert(vector_db.table).values(records)
+    return insert_stmt.on_conflict_do_update(
+        index_elements=["id"],
+        set_=dict(
+            name=insert_stmt.excluded.name,
+            meta_data=insert_stmt.excluded.meta_data,
+            filters=insert_stmt.excluded.filters,
+            content=insert_stmt.excluded.content,
+            embedding=insert_stmt.excluded.embedding,
+            usage=insert_stmt.excluded.usage,
+            content_hash=insert_stmt.excluded.content_hash,
+        ),
+    )
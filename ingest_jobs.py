@@ -0,0 +1,258 @@
+"""
+Background ingestion jobs for the RAG API server.
+
+/upload_pdf/, /upload_md/ and /add_url/ used to read, embed and insert inline, holding
+the HTTP connection for as long as a large PDF took to process. They now queue a job
+and return its id at once; jobs run on a small worker pool and report their stage,
+progress, throughput and errors under /jobs/{id}.
+
+PDFs are parsed page-parallel: page ranges are extracted by a pool of processes
+(text extraction is CPU bound, so threads would not help), then chunked, embedded
+and inserted batch by batch so progress is visible while the job runs.
+"""
+import io
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from phi.utils.log import logger
+
+INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", "2"))
+# Finished jobs kept for /jobs/ (oldest dropped first)
+INGEST_JOB_HISTORY = int(os.getenv("RAG_INGEST_JOB_HISTORY", "200"))
+PDF_PARSE_WORKERS = int(os.getenv("RAG_PDF_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Smaller PDFs are parsed in the job thread; a process round trip costs more than it saves
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("RAG_PDF_PARALLEL_MIN_PAGES", "16"))
+# Chunks embedded and inserted per step; progress is reported after every step
+INGEST_STEP_SIZE = int(os.getenv("RAG_INGEST_STEP_SIZE", "256"))
+
+JOB_STATES = ("queued", "running", "done", "failed")
+
+
+def _extract_pages(data: bytes, start: int, stop: int) -> List[Tuple[int, str, Optional[str]]]:
+    """(page number, text, error) of pages [start, stop); runs in a parse worker process."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(data))
+    pages = []
+    for index in range(start, stop):
+        try:
+            pages.append((index + 1, reader.pages[index].extract_text() or "", None))
+        except Exception as e:
+            pages.append((index + 1, "", f"{type(e).__name__}: {e}"))
+    return pages
+
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_lock = threading.Lock()
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=PDF_PARSE_WORKERS)
+        return _parse_pool
+
+
+def read_pdf_pages(data: bytes, progress: Optional[Callable[[int, int], None]] = None,
+                   workers: int = PDF_PARSE_WORKERS) -> Tuple[List[Tuple[int, str]], List[str]]:
+    """
+    Extract the text of every page of a PDF, in page order. Page ranges are parsed in
+    parallel by the parse process pool; progress(pages parsed, total pages) is called
+    as ranges complete. Returns the (page number, text) pairs and the page errors.
+    """
+    from pypdf import PdfReader
+
+    num_pages = len(PdfReader(io.BytesIO(data)).pages)
+    parsed = 0
+    if progress:
+        progress(parsed, num_pages)
+    if workers <= 1 or num_pages < PDF_PARALLEL_MIN_PAGES:
+        step = 8
+        results = (_extract_pages(data, start, min(start + step, num_pages)) for start in range(0, num_pages, step))
+    else:
+        # A few ranges per worker so a slow range does not leave the others idle
+        step = max(1, -(-num_pages // (workers * 4)))
+        pool = _get_parse_pool()
+        futures = [pool.submit(_extract_pages, data, start, min(start + step, num_pages))
+                   for start in range(0, num_pages, step)]
+        results = (future.result() for future in futures)
+    ranges = []
+    for pages in results:
+        ranges.append(pages)
+        parsed += len(pages)
+        if progress:
+            progress(parsed, num_pages)
+    texts, errors = [], []
+    for pages in ranges:
+        for page_number, text, error in pages:
+            if error:
+                errors.append(f"page {page_number}: {error}")
+            texts.append((page_number, text))
+    return texts, errors
+
+
+class IngestJob:
+    """Progress of one ingestion; updated by the job thread, read by /jobs/{id}."""
+
+    def __init__(self, kind: str, source: str, table: str):
+        self.id = uuid4().hex
+        self.kind = kind
+        self.source = source
+        self.table = table
+        self.status = "queued"
+        self.stage = "queued"
+        self.pages = 0
+        self.pages_parsed = 0
+        self.chunks = 0
+        self.chunks_done = 0
+        self.errors: List[str] = []
+        self.result: Dict = {}
+        self.timings: Dict[str, float] = {}
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._stage_started_at = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def set_stage(self, stage: str, **counters):
+        """Enter a stage (parse, embed, insert, ...), closing the timing of the previous one."""
+        now = time.perf_counter()
+        with self._lock:
+            if self.stage not in ("queued", stage):
+                key = f"{self.stage}_s"
+                self.timings[key] = self.timings.get(key, 0.0) + now - self._stage_started_at
+            self.stage = stage
+            self._stage_started_at = now
+            for name, value in counters.items():
+                setattr(self, name, value)
+
+    def update(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, value)
+
+    def advance(self, chunks: int):
+        with self._lock:
+            self.chunks_done += chunks
+
+    def add_error(self, error: str):
+        with self._lock:
+            self.errors.append(error)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def describe(self) -> Dict:
+        with self._lock:
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            progress = None
+            if self.status == "done":
+                progress = 1.0
+            elif self.chunks:
+                progress = self.chunks_done / self.chunks
+            elif self.pages:
+                progress = self.pages_parsed / self.pages
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "source": self.source,
+                "table": self.table,
+                "status": self.status,
+                "stage": self.stage,
+                "progress": round(progress, 4) if progress is not None else None,
+                "pages": self.pages,
+                "pages_parsed": self.pages_parsed,
+                "chunks": self.chunks,
+                "chunks_done": self.chunks_done,
+                "queue_wait_s": round((self.started_at or end) - self.created_at, 4),
+                "elapsed_s": round(elapsed, 4),
+                "pages_per_s": round(self.pages_parsed / elapsed, 2) if elapsed and self.pages_parsed else None,
+                "chunks_per_s": round(self.chunks_done / elapsed, 2) if elapsed and self.chunks_done else None,
+                "timings": {stage: round(seconds, 4) for stage, seconds in self.timings.items()},
+                "errors": list(self.errors),
+                "result": dict(self.result),
+            }
+
+
+class IngestJobQueue:
+    """Runs ingestion jobs on a fixed pool of threads and keeps the latest ones for status queries."""
+
+    def __init__(self, max_workers: int = INGEST_WORKERS, history: int = INGEST_JOB_HISTORY,
+                 on_finish: Optional[Callable[[IngestJob], None]] = None):
+        self.max_workers = max_workers
+        self.history = history
+        # Called with every finished (done or failed) job, e.g. to record its stage timings
+        self.on_finish = on_finish
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-ingest")
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, source: str, table: str, fn: Callable[[IngestJob], Optional[Dict]]) -> IngestJob:
+        """Queue fn(job); its return value becomes the job result."""
+        job = IngestJob(kind, source, table)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim_locked()
+        self.executor.submit(self._run, job, fn)
+        logger.info(f"Queued {kind} job {job.id} for {source}")
+        return job
+
+    def _run(self, job: IngestJob, fn: Callable[[IngestJob], Optional[Dict]]):
+        job.started_at = time.time()
+        job.status = "running"
+        try:
+            result = fn(job)
+            job.set_stage("done")
+            job.result = result or {}
+            job.status = "done"
+            logger.info(f"{job.kind} job {job.id} done in {time.time() - job.started_at:.1f}s")
+        except Exception as e:
+            job.add_error(f"{type(e).__name__}: {e}")
+            job.set_stage("failed")
+            job.status = "failed"
+            logger.warning(f"{job.kind} job {job.id} failed: {e}\n{traceback.format_exc()}")
+        finally:
+            job.finished_at = time.time()
+            if self.on_finish is not None:
+                try:
+                    self.on_finish(job)
+                except Exception as e:
+                    logger.warning(f"Could not record {job.kind} job {job.id}: {e}")
+
+    def _trim_locked(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, status: Optional[str] = None) -> List[Dict]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.describe() for job in jobs if status is None or job.status == status]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "max_workers": self.max_workers,
+            "pdf_parse_workers": PDF_PARSE_WORKERS,
+            **{state: sum(1 for job in jobs if job.status == state) for state in JOB_STATES},
+        }
+
+    def shutdown(self, wait: bool = False):
+        self.executor.shutdown(wait=wait)
+        with _parse_pool_lock:
+            if _parse_pool is not None:
+                _parse_pool.shutdown(wait=wait)
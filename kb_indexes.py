@@ -0,0 +1,255 @@
+"""
+ANN and full-text index management for the knowledge-base tables.
+
+PgVector creates its tables without an index on the embedding column, so every vector
+search is a sequential scan. IndexManager builds (or rebuilds) an HNSW or IVFFlat index
+on the embedding column and a GIN index on to_tsvector(content) for the text leg of every
+ai.local_rag_* table, reports table/index sizes and row counts, and probes recall@k and
+latency of the ANN index against an exact (sequential-scan) search so parameters can be
+picked from data. Index names match the ones PgVector.optimize() uses.
+
+The query-time knobs (hnsw.ef_search, ivfflat.probes) are applied by PgVector on every
+search through the index configuration returned by ann_index().
+"""
+import os
+import random
+import time
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+from phi.utils.log import logger
+from phi.vectordb.pgvector.index import HNSW, Ivfflat
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# "hnsw", "ivfflat" or "none"
+ANN_INDEX = os.getenv("RAG_ANN_INDEX", "hnsw")
+HNSW_M = int(os.getenv("RAG_HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "64"))
+HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", "40"))
+# 0 sizes the lists from the row count (rows / 1000, or sqrt(rows) above a million rows)
+IVFFLAT_LISTS = int(os.getenv("RAG_IVFFLAT_LISTS", "0"))
+IVFFLAT_PROBES = int(os.getenv("RAG_IVFFLAT_PROBES", "10"))
+CONTENT_LANGUAGE = os.getenv("RAG_CONTENT_LANGUAGE", "english")
+MAINTENANCE_WORK_MEM = os.getenv("RAG_INDEX_MAINTENANCE_WORK_MEM", "512MB")
+KB_TABLE_PREFIX = "local_rag_"
+
+
+def ann_index(kind: Optional[str] = None) -> Optional[Union[HNSW, Ivfflat]]:
+    """The PgVector index configuration; its ef_search / probes are set on every search."""
+    kind = kind or ANN_INDEX
+    if kind == "hnsw":
+        return HNSW(m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_search=HNSW_EF_SEARCH)
+    if kind == "ivfflat":
+        return Ivfflat(lists=IVFFLAT_LISTS or 100, probes=IVFFLAT_PROBES, dynamic_lists=IVFFLAT_LISTS == 0)
+    if kind == "none":
+        return None
+    raise ValueError(f"Unknown ANN index '{kind}': use 'hnsw', 'ivfflat' or 'none'")
+
+
+def ivfflat_lists(rows: int) -> int:
+    return max(int(rows / 1000) if rows < 1000000 else int(np.sqrt(rows)), 1)
+
+
+def vector_literal(embedding: Sequence[float]) -> str:
+    return "[" + ",".join("%.9g" % value for value in embedding) + "]"
+
+
+class IndexManager:
+    def __init__(self, engine: Engine, schema: str = "ai"):
+        self.engine = engine
+        self.schema = schema
+
+    def _qualified(self, table: str) -> str:
+        return f'"{self.schema}"."{table}"'
+
+    @staticmethod
+    def index_names(table: str) -> Dict[str, str]:
+        return {
+            "hnsw": f"{table}_hnsw_index",
+            "ivfflat": f"{table}_ivfflat_index",
+            "gin": f"{table}_content_gin_index",
+        }
+
+    def tables(self) -> List[str]:
+        """The knowledge-base tables (ai.local_rag_*) that have an embedding column."""
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT c.relname FROM pg_class c "
+                "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "JOIN pg_attribute a ON a.attrelid = c.oid "
+                "JOIN pg_type t ON t.oid = a.atttypid "
+                "WHERE n.nspname = :schema AND c.relkind = 'r' AND a.attname = 'embedding' "
+                "AND t.typname = 'vector' AND c.relname LIKE :prefix ORDER BY c.relname"
+            ), {"schema": self.schema, "prefix": KB_TABLE_PREFIX + "%"}).fetchall()
+        return [row[0] for row in rows]
+
+    def _existing_indexes(self, conn, table: str) -> List[str]:
+        return [row[0] for row in conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = :schema AND tablename = :table"
+        ), {"schema": self.schema, "table": table}).fetchall()]
+
+    def build(self, table: str, kind: Optional[str] = None, m: int = HNSW_M,
+              ef_construction: int = HNSW_EF_CONSTRUCTION, lists: int = IVFFLAT_LISTS,
+              text_index: bool = True, rebuild: bool = False) -> Dict:
+        """
+        Create the ANN index (and the GIN index) of a table if missing; rebuild=True
+        recreates them, e.g. after changing parameters or after a large load.
+
+        Switching kind drops the index of the other kind. lists=0 sizes IVFFlat lists
+        from the row count, so IVFFlat indexes should be rebuilt as the table grows.
+        """
+        kind = kind or ANN_INDEX
+        ann_index(kind)  # validate
+        names = self.index_names(table)
+        started_at = time.perf_counter()
+        built = []
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT set_config('maintenance_work_mem', :value, true)"), {"value": MAINTENANCE_WORK_MEM})
+            existing = self._existing_indexes(conn, table)
+            for other in ("hnsw", "ivfflat"):
+                if other != kind and names[other] in existing:
+                    conn.execute(text(f'DROP INDEX "{self.schema}"."{names[other]}"'))
+            wanted = ([kind] if kind != "none" else []) + (["gin"] if text_index else [])
+            for index in wanted:
+                if names[index] in existing:
+                    if not rebuild:
+                        continue
+                    conn.execute(text(f'DROP INDEX "{self.schema}"."{names[index]}"'))
+                if index == "hnsw":
+                    conn.execute(text(
+                        f'CREATE INDEX "{names[index]}" ON {self._qualified(table)} '
+                        f'USING hnsw (embedding vector_cosine_ops) WITH (m = {int(m)}, ef_construction = {int(ef_construction)})'
+                    ))
+                elif index == "ivfflat":
+                    rows = conn.execute(text(f"SELECT count(*) FROM {self._qualified(table)}")).scalar()
+                    conn.execute(text(
+                        f'CREATE INDEX "{names[index]}" ON {self._qualified(table)} '
+                        f'USING ivfflat (embedding vector_cosine_ops) WITH (lists = {int(lists or ivfflat_lists(rows))})'
+                    ))
+                else:
+                    conn.execute(text(
+                        f'CREATE INDEX "{names[index]}" ON {self._qualified(table)} '
+                        f"USING gin (to_tsvector('{CONTENT_LANGUAGE}', content))"
+                    ))
+                built.append(names[index])
+            conn.execute(text(f"ANALYZE {self._qualified(table)}"))
+        elapsed = time.perf_counter() - started_at
+        if built:
+            logger.info(f"Built {', '.join(built)} on {self.schema}.{table} in {elapsed:.2f}s")
+        return {"table": f"{self.schema}.{table}", "built": built, "seconds": round(elapsed, 3)}
+
+    def build_all(self, **kwargs) -> List[Dict]:
+        results = []
+        for table in self.tables():
+            try:
+                results.append(self.build(table, **kwargs))
+            except Exception as e:
+                logger.warning(f"Could not build the indexes of {self.schema}.{table}: {e}")
+                results.append({"table": f"{self.schema}.{table}", "error": str(e)})
+        return results
+
+    def drop(self, table: str):
+        with self.engine.begin() as conn:
+            for name in self.index_names(table).values():
+                conn.execute(text(f'DROP INDEX IF EXISTS "{self.schema}"."{name}"'))
+
+    def report(self, tables: Optional[List[str]] = None) -> List[Dict]:
+        """Row count, table size and every index (method, size, definition) of each table."""
+        report = []
+        with self.engine.connect() as conn:
+            for table in tables or self.tables():
+                qualified = self._qualified(table)
+                rows = conn.execute(text(f"SELECT count(*) FROM {qualified}")).scalar()
+                table_bytes, total_bytes = conn.execute(text(
+                    "SELECT pg_table_size(CAST(:table AS regclass)), pg_total_relation_size(CAST(:table AS regclass))"
+                ), {"table": qualified}).fetchone()
+                indexes = conn.execute(text(
+                    "SELECT i.relname, am.amname, pg_relation_size(i.oid), pg_get_indexdef(i.oid) "
+                    "FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid JOIN pg_am am ON am.oid = i.relam "
+                    "WHERE x.indrelid = CAST(:table AS regclass) ORDER BY i.relname"
+                ), {"table": qualified}).fetchall()
+                report.append({
+                    "table": f"{self.schema}.{table}",
+                    "rows": rows,
+                    "table_bytes": table_bytes,
+                    "total_bytes": total_bytes,
+                    "indexes": [
+                        {"name": name, "method": method, "bytes": size, "definition": definition}
+                        for name, method, size, definition in indexes
+                    ],
+                })
+        return report
+
+    def _search(self, conn, table: str, query: str, k: int, settings: Dict[str, str]) -> List[str]:
+        for name, value in settings.items():
+            conn.execute(text("SELECT set_config(:name, :value, true)"), {"name": name, "value": value})
+        return [row[0] for row in conn.execute(text(
+            f"SELECT id FROM {self._qualified(table)} ORDER BY embedding <=> CAST(:query AS vector) LIMIT :k"
+        ), {"query": query, "k": k}).fetchall()]
+
+    def probe(self, table: str, queries: int = 50, k: int = 5,
+              ef_search: Sequence[int] = (10, 20, 40, 80, 160), probes: Sequence[int] = (1, 5, 10, 20),
+              seed: int = 0) -> Dict:
+        """
+        Measure recall@k and latency of the table's ANN index against an exact search.
+
+        Query vectors are stored embeddings with a little Gaussian noise, so no embedder is
+        needed. The exact top-k comes from a sequential scan (index scans disabled); the
+        ANN search is repeated for every ef_search (HNSW) or probes (IVFFlat) value.
+        """
+        names = self.index_names(table)
+        with self.engine.connect() as conn:
+            existing = self._existing_indexes(conn, table)
+            rows = conn.execute(text(
+                f"SELECT embedding::real[] FROM {self._qualified(table)} WHERE embedding IS NOT NULL "
+                "ORDER BY random() LIMIT :n"
+            ), {"n": queries}).fetchall()
+        if names["hnsw"] in existing:
+            kind, setting, values = "hnsw", "hnsw.ef_search", ef_search
+        elif names["ivfflat"] in existing:
+            kind, setting, values = "ivfflat", "ivfflat.probes", probes
+        else:
+            kind, setting, values = "none", None, []
+        if not rows:
+            return {"table": f"{self.schema}.{table}", "index": kind, "queries": 0, "exact": None, "results": []}
+
+        rng = random.Random(seed)
+        vectors = []
+        for (embedding,) in rows:
+            vector = np.asarray(embedding, dtype=np.float32)
+            noise = np.array([rng.gauss(0, 1) for _ in range(len(vector))], dtype=np.float32)
+            vectors.append(vector_literal(vector + 0.05 * np.linalg.norm(vector) / np.sqrt(len(vector)) * noise))
+
+        def run(settings: Dict[str, str]):
+            results, latencies = [], []
+            with self.engine.connect() as conn:
+                with conn.begin():
+                    for query in vectors:
+                        started_at = time.perf_counter()
+                        results.append(self._search(conn, table, query, k, settings))
+                        latencies.append((time.perf_counter() - started_at) * 1000)
+            return results, latencies
+
+        def summary(latencies: List[float]) -> Dict:
+            return {
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+                "mean_ms": round(float(np.mean(latencies)), 3),
+            }
+
+        exact, exact_latencies = run({"enable_indexscan": "off", "enable_bitmapscan": "off"})
+        results = []
+        for value in values:
+            approximate, latencies = run({setting: str(value)})
+            recall = np.mean([
+                len(set(found) & set(truth)) / max(len(truth), 1) for found, truth in zip(approximate, exact)
+            ])
+            results.append({setting: value, f"recall@{k}": round(float(recall), 4), **summary(latencies)})
+        return {
+            "table": f"{self.schema}.{table}",
+            "index": kind,
+            "queries": len(vectors),
+            "exact": summary(exact_latencies),
+            "results": results,
+        }
@@ -0,0 +1,241 @@
+"""
+Versioned knowledge-base snapshots.
+
+Every snapshot version is its own pgvector table (ai.local_rag_kb_<id>); the registry
+table ai.kb_snapshots records the name, version and embeddings model of each table and
+ai.kb_snapshot_pointers points every name at its current version. Switching a run to a
+prepared knowledge base only changes which table its agent searches, so it costs no
+data movement, and runs on different snapshots never touch each other's rows.
+Old versions are dropped by gc() according to a keep-last-N / max-age policy.
+
+The registry, copies and gc() are Postgres statements, so snapshots need the pgvector
+store: with RAG_VECTOR_STORE=local, create() and resolve() raise ValueError.
+"""
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from phi.embedder.base import Embedder
+from phi.utils.log import logger
+from phi.vectordb.base import VectorDb
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from vector_store import VECTOR_STORE, get_vector_db
+
+SNAPSHOT_NAME = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+@dataclass
+class Snapshot:
+    id: int
+    name: str
+    version: int
+    embeddings_model: str
+    table_name: str
+    created_at: datetime
+    last_used_at: datetime
+
+    def describe(self) -> Dict:
+        return {
+            "name": self.name,
+            "version": self.version,
+            "embeddings_model": self.embeddings_model,
+            "table": f"ai.{self.table_name}",
+            "created_at": self.created_at.isoformat(),
+            "last_used_at": self.last_used_at.isoformat(),
+        }
+
+
+class KnowledgeBaseSnapshots:
+    def __init__(self, engine: Engine, db_url: str, schema: str = "ai"):
+        self.engine = engine
+        self.db_url = db_url
+        self.schema = schema
+        self._ready = False
+
+    def _ensure_tables(self):
+        if self._ready:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{self.schema}"'))
+            conn.execute(text(f'''
+                CREATE TABLE IF NOT EXISTS "{self.schema}".kb_snapshots (
+                    id SERIAL PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    embeddings_model TEXT NOT NULL,
+                    table_name TEXT NOT NULL UNIQUE,
+                    created_at TIMESTAMP NOT NULL DEFAULT now(),
+                    last_used_at TIMESTAMP NOT NULL DEFAULT now(),
+                    UNIQUE (embeddings_model, name, version)
+                )
+            '''))
+            conn.execute(text(f'''
+                CREATE TABLE IF NOT EXISTS "{self.schema}".kb_snapshot_pointers (
+                    embeddings_model TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    PRIMARY KEY (embeddings_model, name)
+                )
+            '''))
+        self._ready = True
+
+    @staticmethod
+    def _row_to_snapshot(row) -> Snapshot:
+        return Snapshot(*row)
+
+    @staticmethod
+    def _check_store():
+        if VECTOR_STORE != "pgvector":
+            raise ValueError(f"Knowledge-base snapshots need RAG_VECTOR_STORE=pgvector (configured: {VECTOR_STORE})")
+
+    def vector_db(self, snapshot: Snapshot, embedder: Embedder, **kwargs) -> VectorDb:
+        """The snapshot table on the same backend the agents search it through."""
+        return get_vector_db(table_name=snapshot.table_name, embedder=embedder, db_url=self.db_url,
+                             schema=self.schema, **kwargs)
+
+    def create(self, name: str, embeddings_model: str, embedder: Embedder,
+               copy_from: Optional[str] = None) -> Snapshot:
+        """
+        Create the next version of a named snapshot and make it the current one.
+
+        The new table is empty, or holds a copy of the rows of copy_from ("schema.table").
+        """
+        if not SNAPSHOT_NAME.match(name):
+            raise ValueError(f"Invalid snapshot name '{name}': use letters, digits, '.', '-' or '_'")
+        self._check_store()
+        self._ensure_tables()
+        with self.engine.begin() as conn:
+            # Serialize version allocation for this name
+            conn.execute(text('SELECT pg_advisory_xact_lock(hashtext(:key))'),
+                         {"key": f"kb_snapshot:{embeddings_model}:{name}"})
+            version = conn.execute(text(
+                f'SELECT COALESCE(MAX(version), 0) + 1 FROM "{self.schema}".kb_snapshots '
+                'WHERE embeddings_model = :model AND name = :name'
+            ), {"model": embeddings_model, "name": name}).scalar()
+            snapshot_id = conn.execute(text(
+                f"SELECT nextval(pg_get_serial_sequence('{self.schema}.kb_snapshots', 'id'))"
+            )).scalar()
+            table_name = f"local_rag_kb_{snapshot_id}"
+            conn.execute(text(
+                f'INSERT INTO "{self.schema}".kb_snapshots (id, name, version, embeddings_model, table_name) '
+                'VALUES (:id, :name, :version, :model, :table)'
+            ), {"id": snapshot_id, "name": name, "version": version, "model": embeddings_model, "table": table_name})
+
+        snapshot = self.get(snapshot_id)
+        vector_db = self.vector_db(snapshot, embedder)
+        vector_db.create()
+        if copy_from:
+            source = ".".join(f'"{part}"' for part in copy_from.split("."))
+            with self.engine.begin() as conn:
+                conn.execute(text(f'INSERT INTO "{self.schema}"."{table_name}" SELECT * FROM {source}'))
+        self.set_current(snapshot)
+        logger.info(f"Created knowledge-base snapshot {name} v{version} ({self.schema}.{table_name})")
+        return snapshot
+
+    def get(self, snapshot_id: int) -> Optional[Snapshot]:
+        self._ensure_tables()
+        with self.engine.connect() as conn:
+            row = conn.execute(text(
+                'SELECT id, name, version, embeddings_model, table_name, created_at, last_used_at '
+                f'FROM "{self.schema}".kb_snapshots WHERE id = :id'
+            ), {"id": snapshot_id}).fetchone()
+        return self._row_to_snapshot(row) if row else None
+
+    def resolve(self, name: str, embeddings_model: str, version: Optional[int] = None) -> Optional[Snapshot]:
+        """A given version of a snapshot, or the version its pointer designates."""
+        self._check_store()
+        self._ensure_tables()
+        with self.engine.begin() as conn:
+            if version is None:
+                version = conn.execute(text(
+                    f'SELECT version FROM "{self.schema}".kb_snapshot_pointers '
+                    'WHERE embeddings_model = :model AND name = :name'
+                ), {"model": embeddings_model, "name": name}).scalar()
+                if version is None:
+                    return None
+            row = conn.execute(text(
+                f'UPDATE "{self.schema}".kb_snapshots SET last_used_at = now() '
+                'WHERE embeddings_model = :model AND name = :name AND version = :version '
+                'RETURNING id, name, version, embeddings_model, table_name, created_at, last_used_at'
+            ), {"model": embeddings_model, "name": name, "version": version}).fetchone()
+        return self._row_to_snapshot(row) if row else None
+
+    def set_current(self, snapshot: Snapshot):
+        """Point the snapshot name at this version; runs already using another version keep it."""
+        self._ensure_tables()
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                f'INSERT INTO "{self.schema}".kb_snapshot_pointers (embeddings_model, name, version) '
+                'VALUES (:model, :name, :version) '
+                'ON CONFLICT (embeddings_model, name) DO UPDATE SET version = EXCLUDED.version'
+            ), {"model": snapshot.embeddings_model, "name": snapshot.name, "version": snapshot.version})
+
+    def list(self, embeddings_model: Optional[str] = None) -> List[Dict]:
+        """All snapshots with their row counts, marking the current version of every name."""
+        self._ensure_tables()
+        query = (
+            'SELECT s.id, s.name, s.version, s.embeddings_model, s.table_name, s.created_at, s.last_used_at, '
+            'p.version IS NOT NULL AS current, c.reltuples::bigint AS rows '
+            f'FROM "{self.schema}".kb_snapshots s '
+            f'LEFT JOIN "{self.schema}".kb_snapshot_pointers p '
+            'ON p.embeddings_model = s.embeddings_model AND p.name = s.name AND p.version = s.version '
+            'LEFT JOIN pg_class c ON c.oid = to_regclass(:schema || \'.\' || s.table_name) '
+        )
+        params = {"schema": self.schema}
+        if embeddings_model is not None:
+            query += 'WHERE s.embeddings_model = :model '
+            params["model"] = embeddings_model
+        query += 'ORDER BY s.embeddings_model, s.name, s.version'
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(query), params).fetchall()
+        return [
+            {**self._row_to_snapshot(row[:7]).describe(), "current": row[7], "estimated_rows": max(row[8] or 0, 0)}
+            for row in rows
+        ]
+
+    def drop(self, snapshot: Snapshot):
+        with self.engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS "{self.schema}"."{snapshot.table_name}" CASCADE'))
+            conn.execute(text(f'DELETE FROM "{self.schema}".kb_snapshots WHERE id = :id'), {"id": snapshot.id})
+            conn.execute(text(
+                f'DELETE FROM "{self.schema}".kb_snapshot_pointers '
+                'WHERE embeddings_model = :model AND name = :name AND version = :version'
+            ), {"model": snapshot.embeddings_model, "name": snapshot.name, "version": snapshot.version})
+        logger.info(f"Dropped knowledge-base snapshot {snapshot.name} v{snapshot.version}")
+
+    def gc(self, in_use: Set[str], keep_versions: int = 3, max_age_days: Optional[float] = None) -> List[Dict]:
+        """
+        Drop old snapshot versions.
+
+        Versions older than the keep_versions newest of their name are dropped, and so are
+        (when max_age_days is set) versions not used for max_age_days days. The current
+        version of every name and versions used by a live run (in_use tables) are kept.
+        """
+        self._ensure_tables()
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(
+                'SELECT s.id, s.name, s.version, s.embeddings_model, s.table_name, s.created_at, s.last_used_at, '
+                'p.version IS NOT NULL AS current '
+                f'FROM "{self.schema}".kb_snapshots s '
+                f'LEFT JOIN "{self.schema}".kb_snapshot_pointers p '
+                'ON p.embeddings_model = s.embeddings_model AND p.name = s.name AND p.version = s.version '
+                'ORDER BY s.embeddings_model, s.name, s.version DESC'
+            )).fetchall()
+
+        dropped = []
+        versions_seen: Dict[tuple, int] = {}
+        cutoff = datetime.now() - timedelta(days=max_age_days) if max_age_days is not None else None
+        for row in rows:
+            snapshot, current = self._row_to_snapshot(row[:7]), row[7]
+            key = (snapshot.embeddings_model, snapshot.name)
+            versions_seen[key] = rank = versions_seen.get(key, 0) + 1
+            if current or snapshot.table_name in in_use:
+                continue
+            if rank <= keep_versions and (cutoff is None or snapshot.last_used_at >= cutoff):
+                continue
+            self.drop(snapshot)
+            dropped.append(snapshot.describe())
+        return dropped
@@ -0,0 +1,274 @@
+"""
+Metrics of the RAG API server, exposed on /metrics (Prometheus text format) and
+/metrics/json (summary with percentiles).
+
+Latency histograms per endpoint and per internal stage, in-flight gauges and token
+counters per model. Metric names are stable; alerts and dashboards may rely on them:
+
+  rag_http_request_duration_seconds{endpoint,method,status}  histogram
+  rag_http_requests_in_flight{endpoint}                      gauge
+  rag_stage_duration_seconds{stage}                          histogram
+      stages: admission, queue, scrape, parse, chunk, embed, insert, retrieve, generate
+  rag_llm_requests_total{model}                              counter
+  rag_llm_input_tokens_total{model}                          counter
+  rag_llm_output_tokens_total{model}                         counter
+  rag_context_tokens_total{model}                            counter
+
+Gauges read from other components at scrape time (pools, queues) are added with
+register_collector(). No client library is needed; the registry is in-process.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from phi.utils.log import logger
+
+# Seconds; from a cached lookup up to a slow LLM answer
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# A sample: (metric name suffix, labels, value)
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [("", dict(zip(self.label_names, key)), value) for key, value in self._values.items()]
+
+    def summary(self) -> List[Dict]:
+        return [{"labels": labels, "value": value} for _, labels, value in self.samples()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket (non-cumulative, last one is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def _snapshot(self) -> List[Tuple[Dict[str, str], List[int], float, int]]:
+        with self._lock:
+            return [(dict(zip(self.label_names, key)), list(counts), total, count)
+                    for key, (counts, total, count) in self._series.items()]
+
+    def samples(self) -> List[Sample]:
+        samples: List[Sample] = []
+        for labels, counts, total, count in self._snapshot():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+        return samples
+
+    def quantile(self, counts: List[int], count: int, q: float) -> Optional[float]:
+        """Quantile estimated by linear interpolation within its bucket (as histogram_quantile does)."""
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets, counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                return lower + (bound - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+            lower = bound
+        # In the +Inf bucket: the largest finite bound is the best estimate
+        return self.buckets[-1]
+
+    def summary(self) -> List[Dict]:
+        summaries = []
+        for labels, counts, total, count in self._snapshot():
+            summaries.append({
+                "labels": labels,
+                "count": count,
+                "avg_s": round(total / count, 4) if count else None,
+                **{f"p{int(q * 100)}_s": round(self.quantile(counts, count, q), 4) for q in (0.5, 0.95, 0.99)},
+            })
+        return summaries
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], List[Metric]]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, label_names))
+
+    def gauge(self, name: str, help: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, label_names))
+
+    def histogram(self, name: str, help: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, label_names, buckets))
+
+    def register_collector(self, collector: Callable[[], List[Metric]]):
+        """collector() returns metrics filled at scrape time, e.g. gauges read from a pool's stats."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self) -> List[Metric]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                metrics.extend(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+        return metrics
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self.collect():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, Dict]:
+        return {metric.name: {"type": metric.type, "series": metric.summary()} for metric in self.collect()}
+
+
+registry = MetricsRegistry()
+
+http_request_duration = registry.histogram(
+    "rag_http_request_duration_seconds", "Latency of API requests until the response headers are sent.",
+    ("endpoint", "method", "status"),
+)
+http_requests_in_flight = registry.gauge(
+    "rag_http_requests_in_flight", "API requests currently being handled.", ("endpoint",)
+)
+stage_duration = registry.histogram(
+    "rag_stage_duration_seconds",
+    "Latency of internal stages: admission, queue, scrape, parse, chunk, embed, insert, retrieve, generate.",
+    ("stage",),
+)
+llm_requests = registry.counter("rag_llm_requests_total", "Model calls made by agent runs.", ("model",))
+llm_input_tokens = registry.counter("rag_llm_input_tokens_total", "Input tokens reported by the model.", ("model",))
+llm_output_tokens = registry.counter("rag_llm_output_tokens_total", "Output tokens reported by the model.", ("model",))
+context_tokens = registry.counter(
+    "rag_context_tokens_total", "Knowledge context tokens added to the prompts of agent runs.", ("model",)
+)
+
+
+def observe_stage(stage: str, seconds: float):
+    stage_duration.observe(seconds, stage=stage)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    with stage_duration.time(stage=name):
+        yield
+
+
+def observe_stages(timings: Dict[str, float], names: Dict[str, str]):
+    """Record the stages of a timings dict ({"embed_s": 0.4, ...}) under the mapped stage names; skipped stages are 0."""
+    for key, name in names.items():
+        seconds = timings.get(key, 0.0)
+        if seconds > 0:
+            observe_stage(name, seconds)
+
+
+def record_agent_run(agent, context: Optional[Dict] = None):
+    """Model time, model calls and tokens of the agent's last run (from phi's run metrics)."""
+    run_metrics = (agent.run_response.metrics if agent.run_response is not None else None) or {}
+    model = getattr(agent.model, "id", None) or "unknown"
+    for seconds in run_metrics.get("time", []):
+        observe_stage("generate", seconds)
+    llm_requests.inc(len(run_metrics.get("time", [])), model=model)
+    llm_input_tokens.inc(sum(run_metrics.get("input_tokens", [])), model=model)
+    llm_output_tokens.inc(sum(run_metrics.get("output_tokens", [])), model=model)
+    if context:
+        context_tokens.inc(context.get("context_tokens", 0), model=model)
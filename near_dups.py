@@ -0,0 +1,328 @@
+"""
+Near-duplicate chunk detection for the ingestion path.
+
+Mirrored sources (learnk8s / learnkube), the same PDF uploaded under another name or
+a page re-added with cosmetic changes produce chunks that are almost, but not exactly,
+the same. Their ids (content md5) differ, so they are embedded and stored again and a
+search returns several copies of one paragraph.
+
+Every chunk gets a MinHash signature of its word 5-grams. Signatures are split into
+LSH bands; chunks sharing a band are candidates, and a candidate whose estimated
+Jaccard similarity reaches RAG_NEAR_DUP_THRESHOLD is a near duplicate. Chunks are
+checked against the table they go to and against the earlier chunks of the same
+ingest, before they are embedded. RAG_NEAR_DUP_MODE selects what happens to them:
+  skip    - drop the duplicate (no embedding call, no row); its source is recorded
+            as an alias of the chunk it duplicates (default)
+  report  - keep it, only count it (to measure the dedup ratio first)
+  off     - no detection
+
+Signatures are kept per table (base or snapshot table) in memory and in SQLite
+(kb_cache/near_dups.db), so they survive restarts; clearing or dropping a table clears
+its signatures. The chunks of an ingest are only registered once they were inserted
+(register()), so a failed ingest can be retried. Tables changed behind the detector's
+back (TRUNCATE, pgVector.py import --replace, manual reloads) are caught by comparing
+row counts, and by checking that the rows a chunk duplicates still exist; the
+signatures are then rebuilt from the table, as the BM25 index is.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from hashlib import md5
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from phi.document import Document
+from phi.utils.log import logger
+from phi.vectordb.base import VectorDb
+
+from vector_store import existing_ids, table_count, table_rows
+
+NEAR_DUPS_PATH = Path(__file__).parent / "kb_cache" / "near_dups.db"
+NEAR_DUP_MODES = ("skip", "report", "off")
+NEAR_DUP_MODE = os.getenv("RAG_NEAR_DUP_MODE", "skip")
+NEAR_DUP_THRESHOLD = float(os.getenv("RAG_NEAR_DUP_THRESHOLD", "0.85"))
+# 16 bands of 8 rows: pairs with Jaccard 0.85 become candidates with probability ~0.99, pairs below 0.5 rarely
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+WORDS = re.compile(r"\w+")
+
+# Multiply-shift hash family, fixed seed so stored signatures stay comparable across restarts
+_rng = np.random.RandomState(1729)
+_A = (_rng.randint(0, 2 ** 32, NUM_PERM, dtype=np.uint64) << np.uint64(32)) | _rng.randint(
+    0, 2 ** 32, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_B = (_rng.randint(0, 2 ** 32, NUM_PERM, dtype=np.uint64) << np.uint64(32)) | _rng.randint(
+    0, 2 ** 32, NUM_PERM, dtype=np.uint64)
+
+
+def minhash(text: str) -> np.ndarray:
+    """MinHash signature (NUM_PERM uint32) of the word 5-grams of text."""
+    words = WORDS.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+    hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in set(shingles)), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        # (a * x + b) mod 2^64, top 32 bits: one hash function per permutation
+        permuted = (hashes[:, None] * _A[None, :] + _B[None, :]) >> np.uint64(32)
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def band_keys(signature: np.ndarray) -> List[bytes]:
+    return [bytes([band]) + signature[band * ROWS:(band + 1) * ROWS].tobytes() for band in range(BANDS)]
+
+
+def chunk_id(doc: Document) -> str:
+    """Row id of a chunk in the vector tables (see insert_embedded_documents)."""
+    return doc.id or md5(doc.content.replace("\x00", "\ufffd").encode()).hexdigest()
+
+
+@dataclass
+class DedupReport:
+    mode: str = NEAR_DUP_MODE
+    chunks: int = 0
+    duplicates: int = 0
+    # Duplicates of rows already in the table vs of earlier chunks of the same ingest
+    existing: int = 0
+    within_ingest: int = 0
+    skipped: int = 0
+    # Kept chunks and aliases, registered once the chunks are in the table
+    pending: "TableIndex" = field(default_factory=lambda: TableIndex(), repr=False)
+    # Stored rows the duplicates matched, checked against the table
+    matched_ids: set = field(default_factory=set, repr=False)
+    aliases: List[Tuple] = field(default_factory=list, repr=False)
+
+    def as_dict(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "chunks": self.chunks,
+            "duplicates": self.duplicates,
+            "existing": self.existing,
+            "within_ingest": self.within_ingest,
+            "skipped": self.skipped,
+            "ratio": round(self.duplicates / self.chunks, 4) if self.chunks else 0.0,
+        }
+
+
+class TableIndex:
+    """LSH index of the chunks of one table."""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.signatures: List[np.ndarray] = []
+        self.buckets: Dict[bytes, List[int]] = {}
+        self.id_numbers: Dict[str, int] = {}
+
+    def add(self, row_id: str, signature: np.ndarray):
+        if row_id in self.id_numbers:
+            return
+        number = len(self.ids)
+        self.ids.append(row_id)
+        self.signatures.append(signature)
+        self.id_numbers[row_id] = number
+        for key in band_keys(signature):
+            self.buckets.setdefault(key, []).append(number)
+
+    def best_match(self, signature: np.ndarray) -> Tuple[Optional[str], float]:
+        candidates = {number for key in band_keys(signature) for number in self.buckets.get(key, ())}
+        best_id, best_similarity = None, 0.0
+        for number in candidates:
+            similarity = float(np.mean(self.signatures[number] == signature))
+            if similarity > best_similarity:
+                best_id, best_similarity = self.ids[number], similarity
+        return best_id, best_similarity
+
+
+class NearDuplicateDetector:
+    def __init__(self, db_path: Path = NEAR_DUPS_PATH, mode: str = NEAR_DUP_MODE, threshold: float = NEAR_DUP_THRESHOLD):
+        if mode not in NEAR_DUP_MODES:
+            raise ValueError(f"Unknown near-duplicate mode '{mode}': use {', '.join(NEAR_DUP_MODES)}")
+        self.mode = mode
+        self.threshold = threshold
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._tables: Dict[str, TableIndex] = {}
+        # Tables whose signatures were compared with the table in this process
+        self._validated: set = set()
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.duplicates = 0
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS signatures (
+                    table_name TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    signature BLOB NOT NULL,
+                    PRIMARY KEY (table_name, id)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS aliases (
+                    table_name TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    source TEXT,
+                    similarity REAL NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _table_locked(self, table_name: str) -> TableIndex:
+        index = self._tables.get(table_name)
+        if index is None:
+            index = self._tables[table_name] = TableIndex()
+            with self._connect() as conn:
+                rows = conn.execute('SELECT id, signature FROM signatures WHERE table_name = ?', (table_name,)).fetchall()
+            for row_id, signature in rows:
+                index.add(row_id, np.frombuffer(signature, dtype=np.uint32))
+        return index
+
+    def _rebuild_locked(self, table_name: str, vector_db: VectorDb) -> TableIndex:
+        index = TableIndex()
+        for row in table_rows(vector_db):
+            index.add(row["id"], minhash(row["content"] or ""))
+        self._tables[table_name] = index
+        with self._connect() as conn:
+            conn.execute('DELETE FROM signatures WHERE table_name = ?', (table_name,))
+            conn.executemany('INSERT INTO signatures (table_name, id, signature) VALUES (?, ?, ?)',
+                             [(table_name, row_id, signature.tobytes())
+                              for row_id, signature in zip(index.ids, index.signatures)])
+        self._validated.add(table_name)
+        logger.info(f"Rebuilt near-duplicate signatures of {table_name} ({len(index.ids)} rows)")
+        return index
+
+    def _checked_table_locked(self, table_name: str, vector_db: Optional[VectorDb]) -> TableIndex:
+        index = self._table_locked(table_name)
+        if vector_db is None:
+            return index
+        try:
+            count = table_count(vector_db)
+        except Exception as e:
+            logger.warning(f"Could not count rows of '{table_name}': {e}")
+            return index
+        # Fewer rows than signatures: rows were removed behind the detector's back. More rows (imports,
+        # concurrent ingests not registered yet) only cost missed duplicates; they are picked up once per process.
+        if count < len(index.ids) or (table_name not in self._validated and count != len(index.ids)):
+            logger.info(f"Near-duplicate signatures of {table_name} are out of date "
+                        f"({len(index.ids)} signatures, {count} rows)")
+            index = self._rebuild_locked(table_name, vector_db)
+        self._validated.add(table_name)
+        return index
+
+    def _match(self, table_name: str, index: TableIndex, documents: List[Document],
+               signatures: List[np.ndarray]) -> Tuple[List[Document], DedupReport]:
+        report = DedupReport(mode=self.mode, chunks=len(documents))
+        kept: List[Document] = []
+        batch = report.pending
+        for doc, signature in zip(documents, signatures):
+            row_id = chunk_id(doc)
+            if row_id in index.id_numbers or row_id in batch.id_numbers:
+                match_id, similarity, stored = row_id, 1.0, row_id in index.id_numbers
+            else:
+                stored_id, stored_similarity = index.best_match(signature)
+                batch_id, batch_similarity = batch.best_match(signature)
+                stored = stored_similarity >= batch_similarity
+                match_id, similarity = (stored_id, stored_similarity) if stored else (batch_id, batch_similarity)
+            if match_id is not None and similarity >= self.threshold:
+                report.duplicates += 1
+                if stored:
+                    report.existing += 1
+                    report.matched_ids.add(match_id)
+                else:
+                    report.within_ingest += 1
+                if match_id != row_id:
+                    report.aliases.append((table_name, match_id, (doc.meta_data or {}).get("source"),
+                                           similarity, time.time()))
+                if self.mode == "skip":
+                    report.skipped += 1
+                    continue
+            else:
+                batch.add(row_id, signature)
+            kept.append(doc)
+        return kept, report
+
+    def filter(self, table_name: str, documents: List[Document],
+               vector_db: Optional[VectorDb] = None) -> Tuple[List[Document], DedupReport]:
+        """
+        Check chunks about to be added to table_name; returns the chunks to embed and insert
+        (without the near duplicates in skip mode) and the report of this ingest. Pass the
+        report to register() once the chunks were inserted. With vector_db (the table's
+        store) the signatures are checked against the table first.
+        """
+        if self.mode == "off" or not documents:
+            return documents, DedupReport(mode=self.mode, chunks=len(documents))
+        signatures = [minhash(doc.content) for doc in documents]
+        with self._lock:
+            index = self._checked_table_locked(table_name, vector_db)
+            kept, report = self._match(table_name, index, documents, signatures)
+            if vector_db is not None and report.matched_ids:
+                missing = report.matched_ids - existing_ids(vector_db, list(report.matched_ids))
+                if missing:
+                    logger.info(f"{len(missing)} rows matched in {table_name} no longer exist")
+                    index = self._rebuild_locked(table_name, vector_db)
+                    kept, report = self._match(table_name, index, documents, signatures)
+            self.checked += report.chunks
+            self.duplicates += report.duplicates
+        if report.duplicates:
+            logger.info(f"{report.duplicates}/{report.chunks} chunks for {table_name} are near duplicates "
+                        f"({report.existing} of stored rows, {report.within_ingest} within the ingest)")
+        return kept, report
+
+    def register(self, table_name: str, report: DedupReport):
+        """Add the chunks kept by filter() to the index of the table, after they were inserted."""
+        batch = report.pending
+        if not batch.ids and not report.aliases:
+            return
+        with self._lock:
+            index = self._table_locked(table_name)
+            for row_id, signature in zip(batch.ids, batch.signatures):
+                index.add(row_id, signature)
+            with self._connect() as conn:
+                conn.executemany('INSERT OR IGNORE INTO signatures (table_name, id, signature) VALUES (?, ?, ?)',
+                                 [(table_name, row_id, signature.tobytes())
+                                  for row_id, signature in zip(batch.ids, batch.signatures)])
+                conn.executemany('INSERT INTO aliases (table_name, id, source, similarity, created_at) '
+                                 'VALUES (?, ?, ?, ?, ?)', report.aliases)
+
+    def clear(self, table_name: str) -> int:
+        """Forget the signatures of a table (after it was truncated or dropped)."""
+        with self._lock:
+            self._tables.pop(table_name, None)
+            self._validated.discard(table_name)
+            with self._connect() as conn:
+                removed = conn.execute('DELETE FROM signatures WHERE table_name = ?', (table_name,)).rowcount
+                conn.execute('DELETE FROM aliases WHERE table_name = ?', (table_name,))
+        return removed
+
+    def copy(self, source_table: str, target_table: str):
+        """Give a table copied from another one (snapshot) the signatures of its rows."""
+        with self._lock:
+            self._tables.pop(target_table, None)
+            self._validated.discard(target_table)
+            with self._connect() as conn:
+                conn.execute('INSERT OR IGNORE INTO signatures (table_name, id, signature) '
+                             'SELECT ?, id, signature FROM signatures WHERE table_name = ?', (target_table, source_table))
+
+    def stats(self) -> Dict:
+        with self._connect() as conn:
+            tables = conn.execute('SELECT table_name, COUNT(*) FROM signatures GROUP BY table_name').fetchall()
+            aliases = dict(conn.execute('SELECT table_name, COUNT(*) FROM aliases GROUP BY table_name').fetchall())
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "threshold": self.threshold,
+                "checked": self.checked,
+                "duplicates": self.duplicates,
+                "ratio": round(self.duplicates / self.checked, 4) if self.checked else 0.0,
+                "tables": [{"table": table, "signatures": count, "aliases": aliases.get(table, 0)}
+                           for table, count in tables],
+            }
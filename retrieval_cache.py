@@ -0,0 +1,175 @@
+"""
+Cache of knowledge-base search results.
+
+Every agent run searches the knowledge base for its references, even when the same
+question was just asked against an unchanged knowledge base. Results are cached under
+the normalized query, the number of documents, the filters, the table and the table's
+version; the version of a table is bumped (and its entries dropped) whenever the server
+adds documents to it or clears it, so a cached result is never served for content that
+has changed. Memory is bounded by an entry count and an estimated size in bytes (LRU).
+"""
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from phi.document import Document
+
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RAG_RETRIEVAL_CACHE_SIZE", "512"))
+RETRIEVAL_CACHE_MB = float(os.getenv("RAG_RETRIEVAL_CACHE_MB", "64"))
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    return WHITESPACE.sub(" ", unicodedata.normalize("NFKC", query)).strip()
+
+
+def document_size(document: Document) -> int:
+    """Rough memory footprint of a document: its text plus a Python float list embedding."""
+    return len(document.content or "") + len(document.name or "") + 32 * len(document.embedding or ()) + 512
+
+
+@dataclass
+class CachedResult:
+    documents: List[Document]
+    size: int
+    search_s: float
+    hits: int = 0
+
+
+@dataclass
+class RetrievalCacheStats:
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    hit_s: float = 0.0
+    miss_s: float = 0.0
+    saved_s: float = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "avg_hit_ms": round(self.hit_s / self.hits * 1000, 3) if self.hits else 0.0,
+            "avg_search_ms": round(self.miss_s / self.misses * 1000, 3) if self.misses else 0.0,
+            "saved_s": round(self.saved_s, 3),
+        }
+
+
+class RetrievalCache:
+    """Thread-safe LRU cache of search results, bounded by entries and estimated bytes."""
+
+    def __init__(self, max_entries: int = RETRIEVAL_CACHE_SIZE, max_bytes: int = int(RETRIEVAL_CACHE_MB * 1024 * 1024)):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = RetrievalCacheStats()
+        self._entries: "OrderedDict[Tuple, CachedResult]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _key(self, table_name: str, query: str, limit: int, filters: Optional[Dict[str, Any]]) -> Tuple:
+        filters_key = json.dumps(filters, sort_keys=True, default=str) if filters else ""
+        return (table_name, self._versions.get(table_name, 0), normalize_query(query), limit, filters_key)
+
+    def get(self, table_name: str, query: str, limit: int,
+            filters: Optional[Dict[str, Any]] = None) -> Optional[List[Document]]:
+        """Copies of the cached documents, or None on a miss."""
+        started_at = time.perf_counter()
+        with self._lock:
+            key = self._key(table_name, query, limit, filters)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            documents = [document.model_copy() for document in entry.documents]
+            self.stats.hits += 1
+            self.stats.hit_s += time.perf_counter() - started_at
+            self.stats.saved_s += entry.search_s
+        return documents
+
+    def put(self, table_name: str, query: str, limit: int, filters: Optional[Dict[str, Any]],
+            documents: List[Document], search_s: float, version: Optional[int] = None):
+        """
+        Store the result of a search that missed and took search_s seconds.
+
+        version is the table version read before the search: a result computed while the
+        table was being changed is not stored under the new version.
+        """
+        with self._lock:
+            self.stats.misses += 1
+            self.stats.miss_s += search_s
+            if version is not None and version != self._versions.get(table_name, 0):
+                return
+            size = sum(document_size(document) for document in documents)
+            if self.max_entries <= 0 or size > self.max_bytes:
+                return
+            key = self._key(table_name, query, limit, filters)
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[key] = CachedResult([document.model_copy() for document in documents], size, search_s)
+            self._bytes += size
+            self.stats.stores += 1
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.stats.evictions += 1
+
+    def version(self, table_name: str) -> int:
+        with self._lock:
+            return self._versions.get(table_name, 0)
+
+    def invalidate(self, table_name: str) -> int:
+        """Bump the version of a table after its content changed; returns the number of dropped entries."""
+        with self._lock:
+            self._versions[table_name] = self._versions.get(table_name, 0) + 1
+            stale = [key for key in self._entries if key[0] == table_name]
+            for key in stale:
+                self._bytes -= self._entries.pop(key).size
+            self.stats.invalidations += 1
+            return len(stale)
+
+    def clear(self) -> int:
+        with self._lock:
+            removed = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            return removed
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                **self.stats.as_dict(),
+            }
+
+
+_retrieval_cache: Optional[RetrievalCache] = None
+_retrieval_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache() -> RetrievalCache:
+    """The process-wide retrieval cache."""
+    global _retrieval_cache
+    with _retrieval_cache_lock:
+        if _retrieval_cache is None:
+            _retrieval_cache = RetrievalCache()
+        return _retrieval_cache
@@ -0,0 +1,138 @@
+"""
+Session registry for the RAG API server.
+
+Every client gets its own SessionState (agent, chat messages, models) under a
+session id returned by /initialize/. The registry caps the number of live agents
+and evicts sessions that are least recently used or idle for longer than the TTL;
+on_close is called for every removed or evicted session (e.g. to pool its agent).
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+from uuid import uuid4
+
+from phi.agent import Agent
+from phi.utils.log import logger
+
+from chat_history import ChatHistory, ChatHistoryStore
+from kb_snapshots import Snapshot
+
+DEFAULT_SESSION_ID = "default"
+
+
+class SessionState:
+    def __init__(self, session_id: str, history_store: Optional[ChatHistoryStore] = None):
+        self.session_id = session_id
+        self.rag_assistant: Optional[Agent] = None
+        # Latest messages in memory, all of them in the history store
+        self.history = ChatHistory(session_id, history_store)
+        self.rag_assistant_run_id: Optional[str] = None
+        self.llm_model: Optional[str] = None
+        self.embeddings_model: Optional[str] = None
+        # Agent pool key of rag_assistant, so it can be given back to the pool
+        self.agent_key: Optional[tuple] = None
+        # Knowledge-base snapshot the agent searches; None means the per-model base table
+        self.kb_snapshot: Optional[Snapshot] = None
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        # Number of requests currently using this session; busy sessions are never evicted
+        self.in_flight = 0
+        # Serializes agent runs of this session
+        self.lock = threading.Lock()
+
+    def describe(self) -> Dict:
+        now = time.time()
+        return {
+            "session_id": self.session_id,
+            "llm_model": self.llm_model,
+            "embeddings_model": self.embeddings_model,
+            "initialized": self.rag_assistant is not None,
+            "kb_snapshot": f"{self.kb_snapshot.name}@v{self.kb_snapshot.version}" if self.kb_snapshot else None,
+            "kb_table": self.kb_snapshot.table_name if self.kb_snapshot else None,
+            "age_s": round(now - self.created_at, 1),
+            "idle_s": round(now - self.last_used, 1),
+            "in_flight": self.in_flight,
+            "messages": self.history.count,
+        }
+
+
+class SessionRegistry:
+    """Thread-safe LRU/TTL registry of live sessions."""
+
+    def __init__(self, max_sessions: int = 8, ttl_s: float = 3600,
+                 on_close: Optional[Callable[[SessionState], None]] = None,
+                 history_store: Optional[ChatHistoryStore] = None):
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.on_close = on_close
+        self.history_store = history_store
+        self._sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, session_id: Optional[str] = None) -> SessionState:
+        """Create a session (a fresh id unless one is given), evicting others if over capacity."""
+        session = SessionState(session_id or uuid4().hex, self.history_store)
+        with self._lock:
+            self._sessions[session.session_id] = session
+            evicted = self._evict_locked(keep=session.session_id)
+        self._close(evicted)
+        logger.info(f"Created session {session.session_id} ({len(self._sessions)} live)")
+        return session
+
+    def get(self, session_id: str) -> Optional[SessionState]:
+        """Return a live session and mark it as recently used."""
+        with self._lock:
+            evicted = self._evict_locked()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.time()
+                self._sessions.move_to_end(session_id)
+        self._close(evicted)
+        return session
+
+    def get_or_create(self, session_id: str) -> SessionState:
+        return self.get(session_id) or self.create(session_id)
+
+    def remove(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        self._close([session] if session is not None else [])
+        return session is not None
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            evicted = self._evict_locked()
+            sessions = [session.describe() for session in self._sessions.values()]
+        self._close(evicted)
+        return sessions
+
+    def _close(self, closed: List[SessionState]):
+        if self.on_close is None:
+            return
+        for session in closed:
+            try:
+                self.on_close(session)
+            except Exception as e:
+                logger.warning(f"Could not close session {session.session_id}: {e}")
+
+    def _evict_locked(self, keep: Optional[str] = None) -> List[SessionState]:
+        """Drop expired sessions, then least recently used ones over capacity; returns the dropped sessions."""
+        evicted = []
+        now = time.time()
+        expired = [
+            sid for sid, session in self._sessions.items()
+            if sid != keep and session.in_flight == 0 and now - session.last_used > self.ttl_s
+        ]
+        for sid in expired:
+            evicted.append(self._sessions.pop(sid))
+            logger.info(f"Evicted session {sid} (idle for more than {self.ttl_s}s)")
+
+        # Least recently used sessions are at the front of the OrderedDict
+        for sid in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            if sid != keep and self._sessions[sid].in_flight == 0:
+                evicted.append(self._sessions.pop(sid))
+                logger.info(f"Evicted session {sid} (more than {self.max_sessions} live sessions)")
+        return evicted
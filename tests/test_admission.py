@@ -0,0 +1,192 @@
+"""Admission control: limits, priority lanes, shedding, round-robin, timeouts and cancellation."""
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, Overloaded, parse_model_limits
+
+MODEL = "llama3.1:70b"
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def queue(controller, order, client, priority="interactive"):
+    """Start a request that records its client once admitted; returns its task."""
+    async def request():
+        await controller.acquire(MODEL, client, priority)
+        order.append(client)
+
+    task = asyncio.create_task(request())
+    await asyncio.sleep(0)
+    return task
+
+
+async def drain(controller, tasks):
+    """Release the held slot and every admitted run one at a time, in admission order."""
+    for task in tasks:
+        controller.release(MODEL, 0.0)
+        await task
+
+
+def test_admits_up_to_the_limit_then_queues():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=2, max_queue=4)
+        assert await controller.acquire(MODEL, "a") == 0.0
+        assert await controller.acquire(MODEL, "b") == 0.0
+        order = []
+        waiting = await queue(controller, order, "c")
+        lane = controller.lane(MODEL)
+        assert (lane.running, lane.queued, order) == (2, 1, [])
+        controller.release(MODEL, 1.0)
+        await waiting
+        assert (lane.running, lane.queued, order) == (2, 0, ["c"])
+    run(scenario())
+
+
+def test_interactive_is_admitted_before_batch():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=8)
+        await controller.acquire(MODEL, "holder")
+        order = []
+        tasks = [await queue(controller, order, "batch-1", "batch"),
+                 await queue(controller, order, "batch-2", "batch"),
+                 await queue(controller, order, "interactive", "interactive")]
+        await drain(controller, [tasks[2], tasks[0], tasks[1]])
+        assert order == ["interactive", "batch-1", "batch-2"]
+    run(scenario())
+
+
+def test_clients_of_a_lane_are_served_round_robin():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=8)
+        await controller.acquire(MODEL, "holder")
+        order = []
+        tasks = [await queue(controller, order, client, "batch") for client in ("a", "a", "a", "b", "c")]
+        await drain(controller, [tasks[0], tasks[3], tasks[4], tasks[1], tasks[2]])
+        assert order == ["a", "b", "c", "a", "a"]
+    run(scenario())
+
+
+def test_full_queue_rejects_batch_and_sheds_newest_batch_for_interactive():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=2)
+        await controller.acquire(MODEL, "holder")
+        order = []
+        older = await queue(controller, order, "old", "batch")
+        newer = await queue(controller, order, "new", "batch")
+
+        with pytest.raises(Overloaded) as rejected:
+            await controller.acquire(MODEL, "late", "batch")
+        assert rejected.value.reason == "queue_full" and rejected.value.retry_after >= 1
+
+        interactive = await queue(controller, order, "interactive")
+        with pytest.raises(Overloaded) as shed:
+            await newer
+        assert shed.value.reason == "shed"
+        assert not older.done()
+        await drain(controller, [interactive, older])
+        assert order == ["interactive", "old"]
+        assert controller.lane(MODEL).rejected == {"queue_full": 1, "shed": 1}
+    run(scenario())
+
+
+def test_interactive_is_rejected_when_no_batch_can_be_shed():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=1)
+        await controller.acquire(MODEL, "holder")
+        waiting = await queue(controller, [], "first")
+        with pytest.raises(Overloaded) as rejected:
+            await controller.acquire(MODEL, "second")
+        assert rejected.value.reason == "queue_full"
+        waiting.cancel()
+    run(scenario())
+
+
+def test_queue_timeout_rejects_and_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout_s=0.05)
+        await controller.acquire(MODEL, "holder")
+        with pytest.raises(Overloaded) as rejected:
+            await controller.acquire(MODEL, "slow")
+        assert rejected.value.reason == "queue_timeout"
+        lane = controller.lane(MODEL)
+        assert (lane.running, lane.queued) == (1, 0)
+    run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=4)
+        await controller.acquire(MODEL, "holder")
+        task = await queue(controller, [], "gone")
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        lane = controller.lane(MODEL)
+        assert (lane.running, lane.queued) == (1, 0)
+        controller.release(MODEL, 0.0)
+        assert lane.running == 0
+    run(scenario())
+
+
+def test_slot_handed_to_a_cancelled_waiter_is_passed_on():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=4)
+        await controller.acquire(MODEL, "holder")
+        order = []
+        first = await queue(controller, order, "first")
+        second = await queue(controller, order, "second")
+        # The slot goes to "first", which is cancelled before it resumes
+        controller.release(MODEL, 0.0)
+        first.cancel()
+        try:
+            await first
+        except asyncio.CancelledError:
+            pass
+        else:
+            # asyncio.wait_for may swallow a cancellation that lands after admission (Python < 3.12):
+            # then "first" holds the slot like any admitted run and releases it
+            assert order == ["first"]
+            controller.release(MODEL, 0.0)
+        await second
+        lane = controller.lane(MODEL)
+        assert order[-1] == "second" and (lane.running, lane.queued) == (1, 0)
+    run(scenario())
+
+
+def test_models_have_their_own_limits():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=0, model_limits={"gpt-4o": (2, 0)})
+        await controller.acquire("gpt-4o", "a")
+        await controller.acquire("gpt-4o", "b")
+        await controller.acquire(MODEL, "c")
+        with pytest.raises(Overloaded):
+            await controller.acquire(MODEL, "d")
+        assert controller.stats()["models"]["gpt-4o"]["running"] == 2
+    run(scenario())
+
+
+def test_retry_after_follows_the_average_run_time():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=0)
+        await controller.acquire(MODEL, "a")
+        controller.release(MODEL, 10.0)
+        await controller.acquire(MODEL, "a")
+        with pytest.raises(Overloaded) as rejected:
+            await controller.acquire(MODEL, "b")
+        assert rejected.value.retry_after == 10
+    run(scenario())
+
+
+def test_unknown_priority_is_refused():
+    with pytest.raises(ValueError):
+        run(AdmissionController().acquire(MODEL, "a", "urgent"))
+
+
+def test_parse_model_limits():
+    assert parse_model_limits("llama3.1:70b=1/4, gpt-4o=8/64") == {"llama3.1:70b": (1, 4), "gpt-4o": (8, 64)}
+    assert parse_model_limits(None) == {}
+    with pytest.raises(ValueError):
+        parse_model_limits("gpt-4o=8")
@@ -0,0 +1,111 @@
+"""BM25 index: tokenizer, ranking, tombstones and compaction, rank fusion."""
+import pytest
+
+from bm25 import BM25Index, linear_fusion, reciprocal_rank_fusion, tokenize
+
+
+def test_tokenize_keeps_identifiers_and_indexes_their_parts():
+    assert tokenize("CrashLoopBackOff") == ["crashloopbackoff", "crash", "loop", "back", "off"]
+    assert tokenize("targetPort:") == ["targetport", "target", "port"]
+    assert tokenize("kube-system") == ["kube-system", "kube", "system"]
+    assert tokenize("nginx:1.19") == ["nginx:1.19", "nginx", "1", "19"]
+
+
+def test_tokenize_drops_stopwords():
+    assert tokenize("The pod is in the namespace") == ["pod", "namespace"]
+
+
+@pytest.fixture
+def index():
+    index = BM25Index()
+    index.add("probe", "Readiness probe failed: connection refused on port 8080", {"filters": {"kind": "pod"}})
+    index.add("crash", "Pod is in CrashLoopBackOff, back-off restarting failed container", {"filters": {"kind": "pod"}})
+    index.add("service", "Service targetPort does not match the containerPort of the pod", {"filters": {"kind": "svc"}})
+    index.add("image", "ImagePullBackOff: the image tag does not exist in the registry", {"filters": {"kind": "pod"}})
+    return index
+
+
+def test_search_ranks_the_best_matching_document_first(index):
+    assert [doc_id for doc_id, _ in index.search("crash loop back off")][0] == "crash"
+    assert [doc_id for doc_id, _ in index.search("targetPort mismatch")][0] == "service"
+    results = index.search("readiness probe port", limit=2)
+    assert [doc_id for doc_id, _ in results] == ["probe", "service"]
+    assert results[0][1] > results[1][1] > 0
+
+
+def test_rarer_terms_weigh_more(index):
+    # "pod" is in three documents, "registry" in one
+    scores = dict(index.search("pod registry", limit=4))
+    assert scores["image"] > scores["crash"]
+
+
+def test_search_without_matches_or_limit_is_empty(index):
+    assert index.search("etcd quorum") == []
+    assert index.search("probe", limit=0) == []
+    assert BM25Index().search("probe") == []
+
+
+def test_filters_match_the_payload(index):
+    assert [doc_id for doc_id, _ in index.search("port", filters={"kind": "svc"})] == ["service"]
+    assert "service" not in dict(index.search("port", filters={"kind": "pod"}))
+
+
+def test_add_replaces_an_indexed_id(index):
+    index.add("probe", "Liveness probe timed out")
+    assert len(index) == 4
+    assert "probe" not in dict(index.search("connection refused"))
+    assert [doc_id for doc_id, _ in index.search("liveness")] == ["probe"]
+
+
+def test_removed_documents_are_tombstoned_until_compaction(index):
+    assert index.remove("crash")
+    assert not index.remove("crash")
+    assert len(index) == 3 and index.removed == 1
+    assert "crash" not in dict(index.search("restarting container"))
+    assert index.payload("crash") is None
+
+    before = dict(index.search("pod port image"))
+    index.compact()
+    assert index.removed == 0 and len(index.doc_ids) == 3
+    assert all(term_docs.tolist() for term_docs, _ in index.postings.values())
+    after = dict(index.search("pod port image"))
+    assert after.keys() == before.keys()
+    assert after == pytest.approx(before)
+    assert index.payload("service") == {"filters": {"kind": "svc"}}
+
+
+def test_compaction_runs_once_a_quarter_is_removed():
+    index = BM25Index()
+    for number in range(4004):
+        index.add(f"doc-{number}", f"pod {number} restarted")
+    for number in range(1001):
+        index.remove(f"doc-{number}")
+    assert index.removed == 1001
+    index.remove("doc-1001")
+    assert index.removed == 0 and len(index.doc_ids) == len(index) == 3002
+    assert [doc_id for doc_id, _ in index.search("4003")] == ["doc-4003"]
+
+
+def test_save_and_load_round_trip(index, tmp_path):
+    index.remove("image")
+    index.save(tmp_path / "bm25.pkl")
+    loaded = BM25Index.load(tmp_path / "bm25.pkl")
+    assert len(loaded) == 3
+    assert loaded.search("pod port") == index.search("pod port")
+
+
+def test_reciprocal_rank_fusion_order():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "d"]], k=60)
+    assert [doc_id for doc_id, _ in fused] == ["b", "c", "a", "d"]
+    assert dict(fused)["b"] == pytest.approx(1 / 62 + 1 / 61)
+
+
+def test_reciprocal_rank_fusion_weights():
+    fused = reciprocal_rank_fusion([["a", "b"], ["b", "a"]], k=60, weights=[3.0, 1.0])
+    assert [doc_id for doc_id, _ in fused] == ["a", "b"]
+
+
+def test_linear_fusion_normalizes_each_list():
+    fused = linear_fusion([[("a", 10.0), ("b", 5.0), ("c", 0.0)], [("c", 0.9), ("b", 0.5)]])
+    assert dict(fused) == pytest.approx({"a": 1.0, "b": 0.5, "c": 1.0})
+    assert linear_fusion([[("a", 2.0)], []]) == [("a", 1.0)]
@@ -0,0 +1,59 @@
+"""Heading-aware chunking: sections, chunk sizes and overlap."""
+import random
+
+import pytest
+from phi.document import Document
+
+from chunking import HeadingChunking
+
+
+def test_pack_never_exceeds_chunk_size_after_overlap():
+    chunks = HeadingChunking(chunk_size=100, overlap=40).pack(["a" * 30, "b" * 30, "c" * 30, "d" * 95], 100)
+    assert max(len(chunk) for chunk in chunks) <= 100
+    assert chunks[-1].endswith("d" * 95)
+
+
+def test_pack_repeats_trailing_lines_up_to_overlap():
+    chunks = HeadingChunking(chunk_size=50, overlap=25).pack(["a" * 20, "b" * 20, "c" * 20], 50)
+    assert chunks == ["a" * 20 + "\n" + "b" * 20, "b" * 20 + "\n" + "c" * 20]
+
+
+def test_pack_splits_long_lines_on_whitespace():
+    line = " ".join(["word"] * 60)
+    chunks = HeadingChunking(chunk_size=50, overlap=10).pack([line], 50)
+    assert max(len(chunk) for chunk in chunks) <= 50
+    assert " ".join(" ".join(chunks).split()).count("word") >= 60
+
+
+@pytest.mark.parametrize("chunk_size,overlap", [(100, 40), (200, 150), (80, 10)])
+def test_chunks_fit_chunk_size(chunk_size, overlap):
+    rng = random.Random(chunk_size)
+    lines = []
+    for section in range(5):
+        lines.append(f"## Section {section}")
+        lines.extend("x" * rng.randint(0, chunk_size) for _ in range(20))
+    chunks = HeadingChunking(chunk_size=chunk_size, overlap=overlap).chunk(Document(name="doc", content="\n".join(lines)))
+    assert chunks
+    assert max(len(chunk.content) for chunk in chunks) <= chunk_size
+    assert all(chunk.meta_data["chunk_size"] == len(chunk.content) for chunk in chunks)
+
+
+def test_chunks_never_cross_headings():
+    text = "# Pods\nPods run containers.\n## Probes\nReadiness gates traffic.\n# Services\nServices route traffic."
+    chunks = HeadingChunking(chunk_size=200, overlap=20).chunk(Document(name="doc", content=text))
+    assert [chunk.content for chunk in chunks] == [
+        "Pods\nPods run containers.",
+        "Pods > Probes\nReadiness gates traffic.",
+        "Services\nServices route traffic.",
+    ]
+
+
+def test_headings_inside_code_fences_are_content():
+    text = "# Config\n```\n# not a heading\n```"
+    sections = HeadingChunking.split_sections(text)
+    assert sections == [("Config", ["```", "# not a heading", "```"])]
+
+
+def test_overlap_must_be_less_than_chunk_size():
+    with pytest.raises(ValueError):
+        HeadingChunking(chunk_size=100, overlap=100)
@@ -0,0 +1,150 @@
+"""load_knowledge_base against a local server that honours ETag / Last-Modified validators."""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import pytest
+from phi.embedder.base import Embedder
+
+import api_server
+from crawler import Crawler
+from ingest_cache import IngestCache
+from near_dups import NearDuplicateDetector
+from vector_store import LocalVectorDb
+
+
+class Site:
+    """One page whose body and validators a test can change; every request's headers are recorded."""
+
+    def __init__(self):
+        self.body = ""
+        self.etag = None
+        self.last_modified = None
+        self.requests = []
+        self.statuses = []
+
+    def publish(self, body: str, etag: str, last_modified: str):
+        self.body, self.etag, self.last_modified = body, etag, last_modified
+
+
+def handler_for(site: Site):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            site.requests.append(dict(self.headers))
+            not_modified = (self.headers.get("If-None-Match") == site.etag
+                            or (self.headers.get("If-None-Match") is None
+                                and self.headers.get("If-Modified-Since") == site.last_modified))
+            status = 304 if not_modified else 200
+            site.statuses.append(status)
+            self.send_response(status)
+            self.send_header("ETag", site.etag)
+            self.send_header("Last-Modified", site.last_modified)
+            if not_modified:
+                self.end_headers()
+                return
+            body = site.body.encode()
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class CountingEmbedder(Embedder):
+    """Deterministic embedder that counts the texts it embeds."""
+
+    dimensions: int = 4
+    texts: List[str] = []
+
+    def get_embedding(self, text: str) -> List[float]:
+        self.texts.append(text)
+        return [float(len(text)), float(sum(map(ord, text)) % 97), 1.0, 0.5]
+
+    def get_embedding_and_usage(self, text: str):
+        return self.get_embedding(text), None
+
+
+PAGE = ("<html><head><title>Services</title></head><body><h1>Services</h1>"
+        "<p>A Service selects pods by label and forwards traffic to their targetPort.</p>"
+        "<a href='pods.html'>Pods</a></body></html>")
+# Different enough not to be skipped as a near duplicate of the first version
+CHANGED_PAGE = ("<html><head><title>Readiness</title></head><body><h1>Readiness probes</h1>"
+                "<p>Pods failing their readiness probe are removed from the endpoints of every Service.</p>"
+                "</body></html>")
+
+
+@pytest.fixture
+def site():
+    site = Site()
+    site.publish(PAGE, '"v1"', "Mon, 05 Oct 2026 10:00:00 GMT")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler_for(site))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    site.url = f"http://127.0.0.1:{server.server_port}/services.html"
+    yield site
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def embedder(monkeypatch, tmp_path):
+    """Point load_knowledge_base at a local table, fresh caches and the counting embedder."""
+    embedder = CountingEmbedder(texts=[])
+    crawler = Crawler(max_workers=2, timeout=5, retries=0)
+    monkeypatch.setattr(api_server, "crawler", crawler)
+    monkeypatch.setattr(api_server, "ingest_cache", IngestCache(tmp_path / "ingest_cache.db"))
+    monkeypatch.setattr(api_server, "near_dups", NearDuplicateDetector(tmp_path / "near_dups.db"))
+    monkeypatch.setattr(api_server, "get_embedder", lambda embeddings_model: embedder)
+    monkeypatch.setattr(api_server, "get_vector_db", lambda table_name, embedder, schema="ai", **kwargs: LocalVectorDb(
+        table_name=table_name, schema=schema, embedder=embedder, data_dir=tmp_path / "vectors"))
+    yield embedder
+    crawler.close()
+
+
+def load(site):
+    return api_server.load_knowledge_base(site.url, "local_rag_documents_test", "counting")
+
+
+def test_first_load_fetches_unconditionally_and_embeds(site, embedder):
+    result = load(site)
+    assert result["cache"] == "miss"
+    assert "If-None-Match" not in site.requests[0] and "If-Modified-Since" not in site.requests[0]
+    assert site.statuses == [200]
+    assert embedder.texts
+
+
+def test_unchanged_page_is_revalidated_and_not_embedded_again(site, embedder):
+    first = load(site)
+    embedded = len(embedder.texts)
+
+    second = load(site)
+    assert site.requests[1]["If-None-Match"] == '"v1"'
+    assert site.requests[1]["If-Modified-Since"] == "Mon, 05 Oct 2026 10:00:00 GMT"
+    assert site.statuses == [200, 304]
+    assert second["cache"] == "not-modified"
+    assert second["timings"]["embed_s"] == 0.0
+    assert len(embedder.texts) == embedded
+    # The cached rows are the ones loaded the first time, links included
+    assert second["content_hash"] == first["content_hash"]
+    assert second["links"] == first["links"]
+
+
+def test_changed_etag_reingests_the_page(site, embedder):
+    first = load(site)
+    embedded = len(embedder.texts)
+
+    site.publish(CHANGED_PAGE, '"v2"', "Tue, 06 Oct 2026 10:00:00 GMT")
+    second = load(site)
+    assert site.requests[1]["If-None-Match"] == '"v1"'
+    assert site.statuses == [200, 200]
+    assert second["cache"] == "miss"
+    assert len(embedder.texts) > embedded
+    assert second["content_hash"] != first["content_hash"]
+
+    # The new validators are remembered for the next revalidation
+    third = load(site)
+    assert site.requests[2]["If-None-Match"] == '"v2"'
+    assert third["cache"] == "not-modified"
@@ -0,0 +1,104 @@
+"""Crawler against a local http.server serving a small site of linked pages."""
+import functools
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from bs4 import BeautifulSoup
+
+from crawler import Crawler, extract_links
+
+PAGES = {
+    "index.html": '<a href="page1.html">1</a> <a href="page2.html#intro">2</a> <a href="page1.html">1 again</a>'
+                  '<a href="http://other.example/x.html">other host</a> <a href="mailto:a@b.c">mail</a>'
+                  '<a href="/page3.html">3</a>',
+    "page1.html": '<a href="page2.html">2</a> <a href="deep.html">deep</a>',
+    "page2.html": '<a href="index.html">home</a>',
+    "page3.html": '<a href="deep.html">deep</a> <a href="missing.html">broken</a>',
+    "deep.html": '<a href="deeper.html">deeper</a>',
+    "deeper.html": 'end',
+}
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def site(tmp_path_factory):
+    root = tmp_path_factory.mktemp("site")
+    for name, body in PAGES.items():
+        (root / name).write_text(f"<html><head><title>{name}</title></head><body>{body}</body></html>")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=str(root)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def crawler():
+    crawler = Crawler(max_workers=4, timeout=5, retries=0)
+    yield crawler
+    crawler.close()
+
+
+def crawl(crawler, site, seeds, **kwargs):
+    """Crawl with an ingest that fetches and parses like load_knowledge_base; returns (reports, ingested urls)."""
+    ingested = []
+    lock = threading.Lock()
+
+    def ingest(url):
+        response = crawler.get(url)
+        response.raise_for_status()
+        soup = BeautifulSoup(response.content, "html.parser")
+        with lock:
+            ingested.append(url)
+        return {"title": soup.title.string, "links": extract_links(soup, response.url)}
+
+    reports = crawler.crawl([site + seed for seed in seeds], ingest, **kwargs)
+    return reports, ingested
+
+
+def names(site, urls):
+    return sorted(url[len(site):] for url in urls)
+
+
+def test_extract_links_keeps_same_host_links_without_fragments(site):
+    soup = BeautifulSoup(PAGES["index.html"], "html.parser")
+    assert extract_links(soup, site + "index.html") == [site + "page1.html", site + "page2.html", site + "page3.html"]
+
+
+def test_depth_zero_ingests_each_seed_once(crawler, site):
+    reports, ingested = crawl(crawler, site, ["index.html", "index.html", "page2.html"], max_depth=0, max_links=10)
+    assert names(site, ingested) == ["index.html", "page2.html"]
+    assert all(report["status"] == "ok" and "links" not in report for report in reports)
+
+
+def test_follows_same_host_links_breadth_first(crawler, site):
+    reports, ingested = crawl(crawler, site, ["index.html"], max_depth=1, max_links=10)
+    assert names(site, ingested) == ["index.html", "page1.html", "page2.html", "page3.html"]
+    assert {report["url"][len(site):]: report["depth"] for report in reports} == {
+        "index.html": 0, "page1.html": 1, "page2.html": 1, "page3.html": 1,
+    }
+
+
+def test_pages_linked_twice_or_in_cycles_are_ingested_once(crawler, site):
+    reports, ingested = crawl(crawler, site, ["index.html"], max_depth=3, max_links=20)
+    assert sorted(ingested) == sorted(set(ingested))
+    assert names(site, ingested) == ["deep.html", "deeper.html", "index.html", "page1.html", "page2.html", "page3.html"]
+    # The broken link is reported, not ingested
+    errors = [report for report in reports if report["status"] == "error"]
+    assert [report["url"] for report in errors] == [site + "missing.html"]
+
+
+def test_max_links_caps_followed_links_in_page_order(crawler, site):
+    reports, ingested = crawl(crawler, site, ["index.html"], max_depth=3, max_links=2)
+    assert names(site, ingested) == ["index.html", "page1.html", "page2.html"]
+    assert len(reports) == 3
+
+
+def test_max_links_zero_follows_nothing(crawler, site):
+    _, ingested = crawl(crawler, site, ["index.html"], max_depth=2, max_links=0)
+    assert names(site, ingested) == ["index.html"]
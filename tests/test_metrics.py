@@ -0,0 +1,109 @@
+"""Metrics registry: histogram quantiles, Prometheus text exposition and JSON summary."""
+import pytest
+
+from metrics import Gauge, Histogram, MetricsRegistry
+
+
+@pytest.fixture
+def histogram():
+    histogram = Histogram("rag_test_seconds", "Test latency.", buckets=(1.0, 2.0, 4.0))
+    for value in (0.5, 1.5, 1.5, 3.0):
+        histogram.observe(value)
+    return histogram
+
+
+def quantile(histogram, q):
+    _, counts, _, count = histogram._snapshot()[0]
+    return histogram.quantile(counts, count, q)
+
+
+def test_quantile_interpolates_within_the_bucket(histogram):
+    # counts per bucket: (0, 1] 1, (1, 2] 2, (2, 4] 1
+    assert quantile(histogram, 0.25) == pytest.approx(1.0)
+    assert quantile(histogram, 0.5) == pytest.approx(1.5)
+    assert quantile(histogram, 0.75) == pytest.approx(2.0)
+    assert quantile(histogram, 0.99) == pytest.approx(2.0 + 2.0 * 0.96)
+
+
+def test_quantile_skips_empty_buckets():
+    histogram = Histogram("rag_test_seconds", "Test latency.", buckets=(1.0, 2.0, 4.0))
+    histogram.observe(3.0)
+    assert quantile(histogram, 0.0) == pytest.approx(2.0)
+    assert quantile(histogram, 0.5) == pytest.approx(3.0)
+
+
+def test_quantile_in_the_inf_bucket_is_the_largest_bound(histogram):
+    for _ in range(4):
+        histogram.observe(60.0)
+    assert quantile(histogram, 0.99) == 4.0
+
+
+def test_quantile_of_an_empty_series_is_none(histogram):
+    assert histogram.quantile([0, 0, 0, 0], 0, 0.5) is None
+
+
+def test_histogram_exposition():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("rag_test_seconds", "Test latency.", ("stage",), buckets=(0.5, 1.0))
+    histogram.observe(0.25, stage="embed")
+    histogram.observe(0.75, stage="embed")
+    histogram.observe(2.0, stage="embed")
+    assert registry.render_prometheus() == (
+        "# HELP rag_test_seconds Test latency.\n"
+        "# TYPE rag_test_seconds histogram\n"
+        'rag_test_seconds_bucket{stage="embed",le="0.5"} 1\n'
+        'rag_test_seconds_bucket{stage="embed",le="1"} 2\n'
+        'rag_test_seconds_bucket{stage="embed",le="+Inf"} 3\n'
+        'rag_test_seconds_sum{stage="embed"} 3\n'
+        'rag_test_seconds_count{stage="embed"} 3\n'
+    )
+
+
+def test_counter_and_gauge_exposition_escapes_labels():
+    registry = MetricsRegistry()
+    tokens = registry.counter("rag_test_tokens_total", "Test tokens.", ("model",))
+    tokens.inc(3, model='llama"3"\\70b')
+    tokens.inc(0.5, model='llama"3"\\70b')
+    in_flight = registry.gauge("rag_test_in_flight", "Test gauge.")
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+    assert registry.render_prometheus().splitlines() == [
+        "# HELP rag_test_tokens_total Test tokens.",
+        "# TYPE rag_test_tokens_total counter",
+        'rag_test_tokens_total{model="llama\\"3\\"\\\\70b"} 3.5',
+        "# HELP rag_test_in_flight Test gauge.",
+        "# TYPE rag_test_in_flight gauge",
+        "rag_test_in_flight 1",
+    ]
+
+
+def test_collectors_are_read_at_scrape_time_and_failures_skipped():
+    registry = MetricsRegistry()
+    queued = Gauge("rag_test_queued", "Test collector gauge.", ("pool",))
+    queued.set(7, pool="ingest")
+
+    def broken():
+        raise RuntimeError("pool is gone")
+
+    registry.register_collector(lambda: [queued])
+    registry.register_collector(broken)
+    assert 'rag_test_queued{pool="ingest"} 7' in registry.render_prometheus().splitlines()
+
+
+def test_labels_and_names_are_checked():
+    registry = MetricsRegistry()
+    counter = registry.counter("rag_test_total", "Test counter.", ("model",))
+    with pytest.raises(ValueError):
+        counter.inc(model="a", stage="b")
+    with pytest.raises(ValueError):
+        counter.inc(-1, model="a")
+    with pytest.raises(ValueError):
+        registry.gauge("rag_test_total", "Same name.")
+
+
+def test_summary_reports_percentiles(histogram):
+    registry = MetricsRegistry()
+    registry._register(histogram)
+    [series] = registry.summary()["rag_test_seconds"]["series"]
+    assert series == {"labels": {}, "count": 4, "avg_s": 1.625, "p50_s": 1.5, "p95_s": 3.6, "p99_s": 3.92}
@@ -0,0 +1,160 @@
+"""Near-duplicate detection: MinHash similarity against the threshold, modes, persistence and rebuilds."""
+from typing import List
+
+import numpy as np
+import pytest
+from phi.document import Document
+from phi.embedder.base import Embedder
+
+from near_dups import NUM_PERM, NearDuplicateDetector, chunk_id, minhash
+from vector_store import LocalVectorDb
+
+TABLE = "local_rag_documents_test"
+
+PARAGRAPH = (
+    "A Service selects the pods it routes traffic to with a label selector. When a pod fails its "
+    "readiness probe the endpoints controller removes the pod address from the endpoints of every "
+    "Service that selects it, so no new connections reach the container until the probe succeeds "
+    "again. The targetPort of the Service must match the containerPort the application listens on, "
+    "otherwise the connection is refused even though the pod is ready and the endpoints are listed."
+)
+# The same paragraph with one word changed, as on a mirrored page
+EDITED = PARAGRAPH.replace("refused even", "rejected even")
+# Same topic and vocabulary, different sentences
+DISTINCT = (
+    "Pods stuck in CrashLoopBackOff restart their container with an exponential back-off. Check the "
+    "logs of the previous container instance, the exit code in the pod status and the events of the "
+    "namespace; a failing liveness probe or a missing config map are the usual causes of the restarts."
+)
+
+
+def doc(content: str, source: str = "https://example.com/services") -> Document:
+    return Document(name=source, content=content, meta_data={"source": source})
+
+
+def similarity(a: str, b: str) -> float:
+    return float(np.mean(minhash(a) == minhash(b)))
+
+
+@pytest.fixture
+def detector(tmp_path):
+    return NearDuplicateDetector(tmp_path / "near_dups.db", mode="skip", threshold=0.85)
+
+
+def ingest(detector, documents: List[Document], table_name: str = TABLE):
+    """Filter then register, as load_knowledge_base does once the kept chunks are inserted."""
+    kept, report = detector.filter(table_name, documents)
+    detector.register(table_name, report)
+    return kept, report
+
+
+def test_minhash_is_deterministic_and_estimates_jaccard():
+    assert minhash(PARAGRAPH).shape == (NUM_PERM,)
+    assert np.array_equal(minhash(PARAGRAPH), minhash(PARAGRAPH.upper()))
+    assert similarity(PARAGRAPH, EDITED) > 0.85
+    assert similarity(PARAGRAPH, DISTINCT) < 0.2
+
+
+def test_edited_copy_of_a_stored_chunk_is_skipped(detector):
+    ingest(detector, [doc(PARAGRAPH)])
+    kept, report = ingest(detector, [doc(EDITED, "https://mirror.example.com/services"), doc(DISTINCT)])
+    assert [d.content for d in kept] == [DISTINCT]
+    assert (report.chunks, report.duplicates, report.existing, report.skipped) == (2, 1, 1, 1)
+    assert report.matched_ids == {chunk_id(doc(PARAGRAPH))}
+    assert report.as_dict()["ratio"] == 0.5
+
+
+@pytest.mark.parametrize("offset,duplicate", [(0.0, True), (1 / NUM_PERM, False)])
+def test_threshold_is_inclusive(tmp_path, offset, duplicate):
+    # Similarity exactly at the threshold is a duplicate, one permutation above it is not
+    threshold = similarity(PARAGRAPH, EDITED) + offset
+    detector = NearDuplicateDetector(tmp_path / "near_dups.db", mode="skip", threshold=threshold)
+    ingest(detector, [doc(PARAGRAPH)])
+    kept, report = ingest(detector, [doc(EDITED)])
+    assert report.duplicates == int(duplicate)
+    assert len(kept) == int(not duplicate)
+
+
+def test_chunks_below_the_threshold_are_kept_and_registered(detector):
+    ingest(detector, [doc(PARAGRAPH)])
+    kept, report = ingest(detector, [doc(DISTINCT)])
+    assert len(kept) == 1 and report.duplicates == 0
+    _, again = detector.filter(TABLE, [doc(DISTINCT)])
+    assert again.existing == 1
+
+
+def test_duplicates_within_one_ingest(detector):
+    kept, report = ingest(detector, [doc(PARAGRAPH), doc(EDITED), doc(PARAGRAPH)])
+    assert [d.content for d in kept] == [PARAGRAPH]
+    assert (report.duplicates, report.existing, report.within_ingest) == (2, 0, 2)
+
+
+def test_report_mode_keeps_duplicates(tmp_path):
+    detector = NearDuplicateDetector(tmp_path / "near_dups.db", mode="report")
+    ingest(detector, [doc(PARAGRAPH)])
+    kept, report = ingest(detector, [doc(EDITED)])
+    assert len(kept) == 1
+    assert (report.duplicates, report.skipped) == (1, 0)
+
+
+def test_off_mode_checks_nothing(tmp_path):
+    detector = NearDuplicateDetector(tmp_path / "near_dups.db", mode="off")
+    kept, report = ingest(detector, [doc(PARAGRAPH), doc(PARAGRAPH)])
+    assert len(kept) == 2 and report.duplicates == 0
+    assert detector.stats()["tables"] == []
+
+
+def test_unknown_mode_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        NearDuplicateDetector(tmp_path / "near_dups.db", mode="drop")
+
+
+def test_unregistered_chunks_are_not_matched(detector):
+    # A failed ingest never reaches register(), so retrying it is not skipped
+    detector.filter(TABLE, [doc(PARAGRAPH)])
+    kept, report = ingest(detector, [doc(PARAGRAPH)])
+    assert len(kept) == 1 and report.duplicates == 0
+
+
+def test_signatures_and_aliases_survive_a_restart(detector, tmp_path):
+    ingest(detector, [doc(PARAGRAPH)])
+    ingest(detector, [doc(EDITED, "https://mirror.example.com/services")])
+    restarted = NearDuplicateDetector(tmp_path / "near_dups.db", mode="skip", threshold=0.85)
+    assert restarted.stats()["tables"] == [{"table": TABLE, "signatures": 1, "aliases": 1}]
+    kept, _ = restarted.filter(TABLE, [doc(EDITED)])
+    assert kept == []
+
+
+def test_clear_and_copy(detector):
+    ingest(detector, [doc(PARAGRAPH)])
+    detector.copy(TABLE, f"{TABLE}_snapshot")
+    assert detector.clear(TABLE) == 1
+    assert len(detector.filter(TABLE, [doc(EDITED)])[0]) == 1
+    assert detector.filter(f"{TABLE}_snapshot", [doc(EDITED)])[0] == []
+
+
+class FixedEmbedder(Embedder):
+    dimensions: int = 2
+
+    def get_embedding(self, text: str) -> List[float]:
+        return [float(len(text)), 1.0]
+
+    def get_embedding_and_usage(self, text: str):
+        return self.get_embedding(text), None
+
+
+def test_signatures_are_rebuilt_when_the_table_lost_rows(detector, tmp_path):
+    vector_db = LocalVectorDb(table_name=TABLE, embedder=FixedEmbedder(), data_dir=tmp_path / "vectors")
+    vector_db.create()
+    kept, report = detector.filter(TABLE, [doc(PARAGRAPH), doc(DISTINCT)], vector_db)
+    vector_db.upsert(kept)
+    detector.register(TABLE, report)
+
+    # The table is reloaded behind the detector's back with only the second chunk
+    vector_db.drop()
+    vector_db.create()
+    vector_db.upsert([doc(DISTINCT)])
+    kept, report = detector.filter(TABLE, [doc(EDITED), doc(DISTINCT)], vector_db)
+    assert [d.content for d in kept] == [EDITED]
+    assert report.existing == 1
+    assert detector.stats()["tables"][0]["signatures"] == 1
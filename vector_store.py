@@ -0,0 +1,635 @@
+"""
+Vector store selection and the in-process LocalVectorDb backend.
+
+RAG_VECTOR_STORE picks the backend behind every knowledge base: "pgvector" (default,
+the Postgres container on localhost:5532) or "local". LocalVectorDb implements the
+phi VectorDb interface without a database server: embeddings live in a float32
+NumPy matrix memory-mapped from disk, searched with blocked matrix products and a
+top-k selection; document rows and a full-text index (FTS5) live in SQLite next to it.
+Upserts overwrite a row in place and deleted rows are reused. A table must only be
+written by one process at a time.
+"""
+import json
+import os
+import sqlite3
+import threading
+from hashlib import md5
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from phi.document import Document
+from phi.embedder.base import Embedder
+from phi.utils.log import logger
+from phi.vectordb.base import VectorDb
+from phi.vectordb.pgvector import PgVector, SearchType
+from sqlalchemy import delete, select
+
+from bm25 import BM25Index, linear_fusion, reciprocal_rank_fusion
+from db import get_engine
+from kb_indexes import ann_index
+
+VECTOR_STORE = os.getenv("RAG_VECTOR_STORE", "pgvector")
+LOCAL_VECTOR_DIR = Path(os.getenv("RAG_LOCAL_VECTOR_DIR", Path.home() / ".cache" / "kubellm" / "vectors"))
+# Lexical leg of hybrid search: "native" (Postgres full-text / SQLite FTS5) or "bm25" (in-process index)
+HYBRID_LEXICAL = os.getenv("RAG_HYBRID_LEXICAL", "native")
+# How the bm25 and vector rankings are combined: "rrf" (reciprocal rank fusion) or "linear"
+HYBRID_FUSION = os.getenv("RAG_HYBRID_FUSION", "rrf")
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+BM25_DIR = Path(os.getenv("RAG_BM25_DIR", Path.home() / ".cache" / "kubellm" / "bm25"))
+
+
+def get_vector_db(table_name: str, embedder: Embedder, db_url: str, schema: str = "ai",
+                  search_type: SearchType = SearchType.vector, backend: Optional[str] = None) -> VectorDb:
+    """The knowledge-base table on the configured backend."""
+    backend = backend or VECTOR_STORE
+    bm25_hybrid = search_type == SearchType.hybrid and HYBRID_LEXICAL == "bm25"
+    if bm25_hybrid:
+        # The backend only serves the vector leg
+        search_type = SearchType.vector
+    if backend == "local":
+        vector_db = LocalVectorDb(table_name=table_name, schema=schema, embedder=embedder, search_type=search_type)
+    elif backend == "pgvector":
+        vector_db = PgVector(table_name=table_name, schema=schema, db_engine=get_engine(db_url), embedder=embedder,
+                             search_type=search_type, vector_index=ann_index())
+    else:
+        raise ValueError(f"Unknown vector store '{backend}': use 'pgvector' or 'local'")
+    return BM25HybridDb(vector_db) if bm25_hybrid else vector_db
+
+
+class _LocalTable:
+    """Shared state of one table: the memory-mapped matrix, its row slots and the SQLite rows."""
+
+    INITIAL_CAPACITY = 1024
+    # Rows scored per matrix product, bounds the temporary memory of a search
+    BLOCK_ROWS = 65536
+
+    def __init__(self, path: Path, dimensions: int):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(self.path / "rows.db", check_same_thread=False, timeout=30)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                slot INTEGER NOT NULL UNIQUE,
+                name TEXT,
+                meta_data TEXT,
+                filters TEXT,
+                content TEXT,
+                usage TEXT,
+                content_hash TEXT
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS documents_name ON documents (name)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS documents_content_hash ON documents (content_hash)')
+        self.conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(content, slot UNINDEXED)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)')
+        stored = dict(self.conn.execute('SELECT key, value FROM info').fetchall())
+        if "dimensions" in stored and int(stored["dimensions"]) != dimensions:
+            raise ValueError(f"{path} holds {stored['dimensions']}-dimensional vectors, not {dimensions}")
+        self.conn.execute("INSERT OR IGNORE INTO info VALUES ('dimensions', ?)", (str(dimensions),))
+        self.conn.commit()
+        self.dimensions = dimensions
+
+        rows = self.conn.execute('SELECT slot, filters FROM documents').fetchall()
+        high_water = max((slot for slot, _ in rows), default=-1) + 1
+        self.capacity = max(self.INITIAL_CAPACITY, high_water)
+        self.matrix = self._open_matrix(self.capacity)
+        self.valid = np.zeros(self.capacity, dtype=bool)
+        self.filters: List[Optional[Dict]] = [None] * self.capacity
+        for slot, filters in rows:
+            self.valid[slot] = True
+            self.filters[slot] = json.loads(filters) if filters else None
+        self.high_water = high_water
+        self.free = sorted(set(range(high_water)) - {slot for slot, _ in rows}, reverse=True)
+        self.norms = np.linalg.norm(self.matrix[:high_water], axis=1) if high_water else np.zeros(0, dtype=np.float32)
+        self.norms = np.resize(self.norms, self.capacity)
+
+    def _open_matrix(self, capacity: int) -> np.memmap:
+        matrix_path = self.path / "vectors.f32"
+        size = capacity * self.dimensions * 4
+        with open(matrix_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(matrix_path, dtype=np.float32, mode="r+", shape=(capacity, self.dimensions))
+
+    def _grow(self, needed: int):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        if capacity == self.capacity:
+            return
+        self.matrix.flush()
+        del self.matrix
+        self.matrix = self._open_matrix(capacity)
+        self.valid = np.concatenate([self.valid, np.zeros(capacity - self.capacity, dtype=bool)])
+        self.norms = np.concatenate([self.norms, np.zeros(capacity - self.capacity, dtype=np.float32)])
+        self.filters.extend([None] * (capacity - self.capacity))
+        self.capacity = capacity
+
+    def count(self) -> int:
+        return int(self.valid[:self.high_water].sum())
+
+    def upsert(self, records: List[Dict], embeddings: np.ndarray):
+        with self.lock:
+            slots = dict(self.conn.execute(
+                f'SELECT id, slot FROM documents WHERE id IN ({",".join("?" * len(records))})',
+                [record["id"] for record in records],
+            ).fetchall()) if records else {}
+            for record in records:
+                if record["id"] not in slots:
+                    if self.free:
+                        slots[record["id"]] = self.free.pop()
+                    else:
+                        slots[record["id"]] = self.high_water
+                        self.high_water += 1
+            self._grow(self.high_water)
+
+            rows = []
+            for record, embedding in zip(records, embeddings):
+                slot = slots[record["id"]]
+                self.matrix[slot] = embedding
+                self.norms[slot] = np.linalg.norm(embedding)
+                self.valid[slot] = True
+                self.filters[slot] = record["filters"]
+                rows.append((record["id"], slot, record["name"], json.dumps(record["meta_data"]),
+                             json.dumps(record["filters"]) if record["filters"] is not None else None,
+                             record["content"], json.dumps(record["usage"]) if record["usage"] else None,
+                             record["content_hash"]))
+            self.matrix.flush()
+            self.conn.executemany('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self.conn.executemany('DELETE FROM documents_fts WHERE slot = ?', [(row[1],) for row in rows])
+            self.conn.executemany('INSERT INTO documents_fts (content, slot) VALUES (?, ?)',
+                                  [(row[5], row[1]) for row in rows])
+            self.conn.commit()
+
+    def delete_ids(self, ids: List[str]) -> int:
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT slot FROM documents WHERE id IN ({",".join("?" * len(ids))})', ids
+            ).fetchall() if ids else []
+            for (slot,) in rows:
+                self.valid[slot] = False
+                self.filters[slot] = None
+                self.free.append(slot)
+            self.conn.executemany('DELETE FROM documents WHERE slot = ?', rows)
+            self.conn.executemany('DELETE FROM documents_fts WHERE slot = ?', rows)
+            self.conn.commit()
+            return len(rows)
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM documents')
+            self.conn.execute('DELETE FROM documents_fts')
+            self.conn.commit()
+            self.valid[:] = False
+            self.filters = [None] * self.capacity
+            self.high_water = 0
+            self.free = []
+
+    def close(self):
+        with self.lock:
+            self.matrix.flush()
+            del self.matrix
+            self.conn.close()
+
+    def _candidates(self, filters: Optional[Dict[str, Any]]) -> np.ndarray:
+        mask = self.valid[:self.high_water].copy()
+        if filters:
+            for slot in np.flatnonzero(mask):
+                slot_filters = self.filters[slot] or {}
+                if any(slot_filters.get(key) != value for key, value in filters.items()):
+                    mask[slot] = False
+        return mask
+
+    def vector_scores(self, query: np.ndarray, filters: Optional[Dict[str, Any]] = None) -> np.ndarray:
+        """Cosine similarity of every row to the query (-inf for deleted or filtered-out rows)."""
+        with self.lock:
+            mask = self._candidates(filters)
+            scores = np.full(self.high_water, -np.inf, dtype=np.float32)
+            query_norm = np.linalg.norm(query)
+            if query_norm == 0:
+                return scores
+            for start in range(0, self.high_water, self.BLOCK_ROWS):
+                stop = min(start + self.BLOCK_ROWS, self.high_water)
+                block = np.asarray(self.matrix[start:stop]) @ query
+                norms = self.norms[start:stop] * query_norm
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    scores[start:stop] = np.where(mask[start:stop] & (norms > 0), block / norms, -np.inf)
+            return scores
+
+    def keyword_scores(self, query: str, filters: Optional[Dict[str, Any]] = None) -> np.ndarray:
+        """FTS5 bm25 relevance of every row mapped to [0, 1) (0 when a row does not match)."""
+        terms = [term.replace('"', '""') for term in query.split() if term.strip()]
+        scores = np.zeros(self.high_water, dtype=np.float32)
+        if not terms:
+            return scores
+        fts_query = " OR ".join(f'"{term}"' for term in terms)
+        with self.lock:
+            mask = self._candidates(filters)
+            rows = self.conn.execute(
+                'SELECT slot, bm25(documents_fts) FROM documents_fts WHERE documents_fts MATCH ?', (fts_query,)
+            ).fetchall()
+        for slot, rank in rows:
+            if slot < self.high_water and mask[slot]:
+                relevance = -rank
+                scores[slot] = relevance / (1 + relevance)
+        return scores
+
+    def documents(self, slots: List[int], embedder: Optional[Embedder]) -> List[Document]:
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT slot, id, name, meta_data, content, usage FROM documents '
+                f'WHERE slot IN ({",".join("?" * len(slots))})', slots
+            ).fetchall() if slots else []
+            by_slot = {row[0]: row for row in rows}
+            documents = []
+            for slot in slots:
+                if slot not in by_slot:
+                    continue
+                _, doc_id, name, meta_data, content, usage = by_slot[slot]
+                documents.append(Document(
+                    id=doc_id, name=name, meta_data=json.loads(meta_data) if meta_data else {},
+                    content=content, embedder=embedder, embedding=self.matrix[slot].tolist(),
+                    usage=json.loads(usage) if usage else None,
+                ))
+            return documents
+
+    def rows(self) -> List[Dict]:
+        with self.lock:
+            rows = self.conn.execute('SELECT id, name, meta_data, filters, content FROM documents').fetchall()
+        return [
+            {"id": doc_id, "name": name, "meta_data": json.loads(meta_data) if meta_data else {},
+             "filters": json.loads(filters) if filters else None, "content": content}
+            for doc_id, name, meta_data, filters, content in rows
+        ]
+
+    def exists(self, column: str, value: str) -> bool:
+        with self.lock:
+            return self.conn.execute(f'SELECT 1 FROM documents WHERE {column} = ? LIMIT 1', (value,)).fetchone() is not None
+
+
+_tables: Dict[Path, _LocalTable] = {}
+_tables_lock = threading.Lock()
+
+
+class LocalVectorDb(VectorDb):
+    """Drop-in replacement for PgVector backed by a memory-mapped NumPy matrix."""
+
+    def __init__(
+        self,
+        table_name: str,
+        schema: Optional[str] = "ai",
+        embedder: Optional[Embedder] = None,
+        search_type: SearchType = SearchType.vector,
+        vector_score_weight: float = 0.5,
+        data_dir: Optional[Path] = None,
+    ):
+        if embedder is None:
+            from phi.embedder.openai import OpenAIEmbedder
+
+            embedder = OpenAIEmbedder()
+        self.table_name = table_name
+        self.schema = schema
+        self.embedder: Embedder = embedder
+        self.dimensions: Optional[int] = embedder.dimensions
+        self.search_type = search_type
+        self.vector_score_weight = vector_score_weight
+        self.path = Path(data_dir or LOCAL_VECTOR_DIR) / (f"{schema}.{table_name}" if schema else table_name)
+
+    @property
+    def table(self) -> _LocalTable:
+        with _tables_lock:
+            table = _tables.get(self.path)
+            if table is None:
+                table = _tables[self.path] = _LocalTable(self.path, self.dimensions)
+            return table
+
+    def create(self) -> None:
+        self.table
+
+    def exists(self) -> bool:
+        return (self.path / "rows.db").exists()
+
+    def doc_exists(self, document: Document) -> bool:
+        cleaned_content = document.content.replace("\x00", "\ufffd")
+        return self.table.exists("content_hash", md5(cleaned_content.encode()).hexdigest())
+
+    def name_exists(self, name: str) -> bool:
+        return self.table.exists("name", name)
+
+    def id_exists(self, id: str) -> bool:
+        return self.table.exists("id", id)
+
+    def upsert_available(self) -> bool:
+        return True
+
+    def insert(self, documents: List[Document], filters: Optional[Dict[str, Any]] = None, batch_size: int = 100) -> None:
+        self.upsert(documents, filters, batch_size)
+
+    def upsert(self, documents: List[Document], filters: Optional[Dict[str, Any]] = None, batch_size: int = 100) -> None:
+        """Write documents, embedding only those that do not carry an embedding yet."""
+        for start in range(0, len(documents), batch_size):
+            batch = documents[start:start + batch_size]
+            records, embeddings = [], []
+            for doc in batch:
+                if not doc.embedding:
+                    doc.embed(embedder=self.embedder)
+                cleaned_content = doc.content.replace("\x00", "\ufffd")
+                content_hash = md5(cleaned_content.encode()).hexdigest()
+                records.append({
+                    "id": doc.id or content_hash,
+                    "name": doc.name,
+                    "meta_data": doc.meta_data,
+                    "filters": filters,
+                    "content": cleaned_content,
+                    "usage": doc.usage,
+                    "content_hash": content_hash,
+                })
+                embeddings.append(doc.embedding)
+            # The last write of an id wins, as with ON CONFLICT DO UPDATE
+            unique = {record["id"]: (record, embedding) for record, embedding in zip(records, embeddings)}
+            self.table.upsert([record for record, _ in unique.values()],
+                              np.asarray([embedding for _, embedding in unique.values()], dtype=np.float32))
+            logger.info(f"Upserted batch of {len(unique)} documents into '{self.path.name}'")
+
+    def search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        if self.search_type == SearchType.keyword:
+            return self.keyword_search(query, limit, filters)
+        if self.search_type == SearchType.hybrid:
+            return self.hybrid_search(query, limit, filters)
+        return self.vector_search(query, limit, filters)
+
+    def _query_vector(self, query: str) -> Optional[np.ndarray]:
+        query_embedding = self.embedder.get_embedding(query)
+        if not query_embedding:
+            logger.error(f"Error getting embedding for Query: {query}")
+            return None
+        return np.asarray(query_embedding, dtype=np.float32)
+
+    def _top_k(self, scores: np.ndarray, limit: int) -> List[int]:
+        finite = np.flatnonzero(np.isfinite(scores))
+        if finite.size == 0 or limit <= 0:
+            return []
+        if finite.size > limit:
+            finite = finite[np.argpartition(-scores[finite], limit - 1)[:limit]]
+        return finite[np.argsort(-scores[finite], kind="stable")].tolist()
+
+    def vector_search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        query_vector = self._query_vector(query)
+        if query_vector is None:
+            return []
+        table = self.table
+        return table.documents(self._top_k(table.vector_scores(query_vector, filters), limit), self.embedder)
+
+    def keyword_search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        table = self.table
+        scores = table.keyword_scores(query, filters)
+        scores[scores <= 0] = -np.inf
+        return table.documents(self._top_k(scores, limit), self.embedder)
+
+    def hybrid_search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """Same scoring as PgVector: w / (1 + cosine distance) + (1 - w) * text rank."""
+        query_vector = self._query_vector(query)
+        if query_vector is None:
+            return []
+        table = self.table
+        vector_scores = table.vector_scores(query_vector, filters)
+        vector_scores = np.where(np.isfinite(vector_scores), 1 / (2 - vector_scores), -np.inf)
+        scores = self.vector_score_weight * vector_scores + (1 - self.vector_score_weight) * table.keyword_scores(query, filters)
+        return table.documents(self._top_k(scores, limit), self.embedder)
+
+    def get_count(self) -> int:
+        return self.table.count()
+
+    def delete_ids(self, ids: List[str]) -> int:
+        return self.table.delete_ids(ids)
+
+    def drop(self) -> None:
+        with _tables_lock:
+            table = _tables.pop(self.path, None)
+        if table is not None:
+            table.close()
+        for name in ("rows.db", "vectors.f32"):
+            (self.path / name).unlink(missing_ok=True)
+
+    def delete(self) -> bool:
+        self.table.clear()
+        return True
+
+    def optimize(self) -> None:
+        pass
+
+
+_bm25_indexes: Dict[Path, BM25Index] = {}
+# Indexes checked against their table in this process
+_bm25_synced = set()
+
+
+class BM25HybridDb(VectorDb):
+    """
+    Hybrid search with the lexical leg served by an in-process BM25 index.
+
+    Wraps a vector backend (PgVector or LocalVectorDb): writes go to both, and searches
+    fuse the backend's vector ranking with the BM25 ranking. The index is persisted
+    under RAG_BM25_DIR and rebuilt from the table when their row counts disagree.
+    """
+
+    def __init__(self, vector_db: VectorDb, fusion: str = HYBRID_FUSION, rrf_k: int = RRF_K,
+                 vector_weight: float = 0.5, candidates_factor: int = 4):
+        if fusion not in ("rrf", "linear"):
+            raise ValueError(f"Unknown fusion '{fusion}': use 'rrf' or 'linear'")
+        self.vector_db = vector_db
+        self.table_name = vector_db.table_name
+        self.schema = vector_db.schema
+        self.embedder = vector_db.embedder
+        self.dimensions = vector_db.dimensions
+        self.search_type = SearchType.hybrid
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+        self.vector_weight = vector_weight
+        self.candidates_factor = candidates_factor
+        self.index_path = BM25_DIR / f"{self.schema}.{self.table_name}.bm25"
+
+    @property
+    def index(self) -> BM25Index:
+        with _tables_lock:
+            index = _bm25_indexes.get(self.index_path)
+            if index is None:
+                index = BM25Index.load(self.index_path) if self.index_path.exists() else BM25Index()
+                _bm25_indexes[self.index_path] = index
+            return index
+
+    def _sync(self):
+        """Rebuild the index from the table if it was changed behind the index's back."""
+        if self.index_path in _bm25_synced:
+            return
+        index = self.index
+        try:
+            count = self.vector_db.get_count() if self.vector_db.exists() else 0
+        except Exception as e:
+            logger.warning(f"Could not count rows of '{self.table_name}': {e}")
+            return
+        if count != len(index):
+            logger.info(f"Rebuilding BM25 index of '{self.table_name}' ({len(index)} indexed, {count} rows)")
+            with index.lock:
+                index.clear()
+                for row in table_rows(self.vector_db):
+                    index.add(row["id"], row["content"] or "", self._payload(row["name"], row["meta_data"], row["content"], row["filters"]))
+                index.save(self.index_path)
+        _bm25_synced.add(self.index_path)
+
+    @staticmethod
+    def _payload(name, meta_data, content, filters) -> Dict:
+        return {"name": name, "meta_data": meta_data, "content": content, "filters": filters}
+
+    def index_documents(self, documents: List[Document], filters: Optional[Dict[str, Any]] = None):
+        """Add documents that were written to the backend directly to the BM25 index."""
+        index = self.index
+        with index.lock:
+            for doc in documents:
+                cleaned_content = doc.content.replace("\x00", "\ufffd")
+                doc_id = doc.id or md5(cleaned_content.encode()).hexdigest()
+                index.add(doc_id, cleaned_content, self._payload(doc.name, doc.meta_data, cleaned_content, filters))
+            index.save(self.index_path)
+
+    def clear_index(self):
+        index = self.index
+        with index.lock:
+            index.clear()
+            index.save(self.index_path)
+
+    def create(self) -> None:
+        self.vector_db.create()
+
+    def exists(self) -> bool:
+        return self.vector_db.exists()
+
+    def doc_exists(self, document: Document) -> bool:
+        return self.vector_db.doc_exists(document)
+
+    def name_exists(self, name: str) -> bool:
+        return self.vector_db.name_exists(name)
+
+    def id_exists(self, id: str) -> bool:
+        return self.vector_db.id_exists(id)
+
+    def upsert_available(self) -> bool:
+        return self.vector_db.upsert_available()
+
+    def insert(self, documents: List[Document], filters: Optional[Dict[str, Any]] = None, batch_size: int = 100) -> None:
+        self.vector_db.insert(documents, filters, batch_size=batch_size)
+        self.index_documents(documents, filters)
+
+    def upsert(self, documents: List[Document], filters: Optional[Dict[str, Any]] = None, batch_size: int = 100) -> None:
+        self.vector_db.upsert(documents, filters, batch_size=batch_size)
+        self.index_documents(documents, filters)
+
+    def search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        return self.hybrid_search(query, limit, filters)
+
+    def vector_search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        return self.vector_db.vector_search(query, limit=limit, filters=filters)
+
+    def keyword_search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        self._sync()
+        documents = [self._document(doc_id) for doc_id, _ in self.index.search(query, limit, filters)]
+        return [doc for doc in documents if doc is not None]
+
+    def hybrid_search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        self._sync()
+        candidates = max(limit * self.candidates_factor, 20)
+        vector_docs = {doc.id: doc for doc in self.vector_db.vector_search(query, limit=candidates, filters=filters)}
+        lexical = self.index.search(query, candidates, filters)
+        weights = [self.vector_weight, 1 - self.vector_weight]
+        if self.fusion == "rrf":
+            fused = reciprocal_rank_fusion([list(vector_docs), [doc_id for doc_id, _ in lexical]], k=self.rrf_k, weights=weights)
+        else:
+            fused = linear_fusion([self._vector_scores(query, list(vector_docs.values())), lexical], weights=weights)
+        documents = []
+        for doc_id, _ in fused[:limit]:
+            doc = vector_docs.get(doc_id) or self._document(doc_id)
+            if doc is not None:
+                documents.append(doc)
+        return documents
+
+    def _vector_scores(self, query: str, documents: List[Document]) -> List[tuple]:
+        query_embedding = np.asarray(self.embedder.get_embedding(query) or [], dtype=np.float32)
+        scores = []
+        for doc in documents:
+            embedding = np.asarray(doc.embedding if doc.embedding is not None else [], dtype=np.float32)
+            norm = np.linalg.norm(embedding) * np.linalg.norm(query_embedding)
+            scores.append((doc.id, float(embedding @ query_embedding / norm) if norm and embedding.shape == query_embedding.shape else 0.0))
+        return scores
+
+    def _document(self, doc_id: str) -> Optional[Document]:
+        payload = self.index.payload(doc_id)
+        if payload is None:
+            return None
+        return Document(id=doc_id, name=payload["name"], meta_data=payload["meta_data"] or {},
+                        content=payload["content"], embedder=self.embedder)
+
+    def get_count(self) -> int:
+        return self.vector_db.get_count()
+
+    def delete_ids(self, ids: List[str]) -> int:
+        if isinstance(self.vector_db, LocalVectorDb):
+            deleted = self.vector_db.delete_ids(ids)
+        else:
+            # phi's PgVector has no delete by id
+            table = self.vector_db.table
+            with self.vector_db.Session() as sess, sess.begin():
+                deleted = sess.execute(delete(table).where(table.c.id.in_(ids))).rowcount if ids else 0
+        index = self.index
+        with index.lock:
+            for doc_id in ids:
+                index.remove(doc_id)
+            index.save(self.index_path)
+        return deleted
+
+    def drop(self) -> None:
+        self.vector_db.drop()
+        self.clear_index()
+
+    def delete(self) -> bool:
+        deleted = self.vector_db.delete()
+        self.clear_index()
+        return deleted
+
+    def optimize(self) -> None:
+        self.vector_db.optimize()
+
+
+def _backend(vector_db: VectorDb) -> VectorDb:
+    return vector_db.vector_db if isinstance(vector_db, BM25HybridDb) else vector_db
+
+
+def table_count(vector_db: VectorDb) -> int:
+    """Rows of a knowledge-base table; 0 when it does not exist."""
+    return vector_db.get_count() if vector_db.exists() else 0
+
+
+def table_rows(vector_db: VectorDb) -> List[Dict]:
+    """id, name, meta_data, filters and content of every row of a knowledge-base table."""
+    vector_db = _backend(vector_db)
+    if isinstance(vector_db, LocalVectorDb):
+        return vector_db.table.rows()
+    if not vector_db.exists():
+        return []
+    table = vector_db.table
+    with vector_db.Session() as sess:
+        rows = sess.execute(select(table.c.id, table.c.name, table.c.meta_data, table.c.filters, table.c.content)).fetchall()
+    return [dict(row._mapping) for row in rows]
+
+
+def existing_ids(vector_db: VectorDb, ids: List[str]) -> set:
+    """The ids of the list that are rows of the table."""
+    vector_db = _backend(vector_db)
+    if not ids or not vector_db.exists():
+        return set()
+    if isinstance(vector_db, LocalVectorDb):
+        return {doc_id for doc_id in ids if vector_db.id_exists(doc_id)}
+    table = vector_db.table
+    with vector_db.Session() as sess:
+        return set(sess.execute(select(table.c.id).where(table.c.id.in_(ids))).scalars())
@@ -0,0 +1,71 @@
+"""
+Bounded worker pool for the blocking agent calls made by api_server.
+
+Agent.run() is synchronous and can take minutes, so it must not run on the event
+loop. Calls are handed to a fixed-size thread pool; the pool keeps a gauge of how
+many calls are waiting and reports queue wait vs execution time for each call.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Tuple
+
+
+class WorkerPool:
+    def __init__(self, max_workers: int = 4, name: str = "rag-worker"):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Tuple[Any, Dict[str, float]]:
+        """Run fn(*args, **kwargs) on the pool; returns its result and the per-call timings."""
+        submitted_at = time.perf_counter()
+        started_at = submitted_at
+        with self._lock:
+            self.queued += 1
+
+        def task():
+            nonlocal started_at
+            started_at = time.perf_counter()
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+            try:
+                result = fn(*args, **kwargs)
+                with self._lock:
+                    self.completed += 1
+                return result
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self.executor, task)
+        finished_at = time.perf_counter()
+        timings = {
+            "queue_wait_s": round(started_at - submitted_at, 4),
+            "execution_s": round(finished_at - started_at, 4),
+        }
+        return result, timings
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)